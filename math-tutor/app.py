@@ -1,19 +1,17 @@
 import streamlit as st
-import asyncio
 import sys
 from pathlib import Path
 import time
 from typing import Dict, Any
 import logging
-import tempfile
-import os
 
 # Add src to path
 src_path = Path(__file__).parent / "src"
 sys.path.insert(0, str(src_path))
 
 from agent import JEECalculusExpertWithMemory
-from utils.image_to_text import get_text_from_image
+from utils.image_to_text import get_text_from_image_async
+from utils.background_loop import get_background_loop, run_in_background
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -156,6 +154,13 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Response fields rendered progressively while the expert is still writing
+STREAMED_FIELDS = {
+    "problem_analysis": "Problem Analysis",
+    "step_by_step_solution": "Step-by-Step Solution",
+}
+RENDER_INTERVAL_SECONDS = 0.05
+
 # --- Session State Initialization ---
 if "expert" not in st.session_state:
     st.session_state.expert = None
@@ -178,47 +183,56 @@ def initialize_expert():
         st.error(f"Failed to initialize expert: {e}")
         return False
 
-def run_async_query(query: str) -> Dict[str, Any]:
-    """Runs an async query in a sync context."""
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    result = loop.run_until_complete(
-        st.session_state.expert.handle_jee_query_with_memory(
-            query=query, session_id=st.session_state.current_session_id, user_id="streamlit_user"
-        )
+def run_async(coro):
+    """Runs a coroutine on the shared background event loop and waits for its result."""
+    return run_in_background(coro)
+
+def run_streaming_query(query: str) -> Dict[str, Any]:
+    """Runs a query as a stream, rendering the main response fields as they are written."""
+    status = st.empty()
+    status.markdown("🧠 Thinking...")
+    sections = {
+        field: {"title": title, "header": st.empty(), "body": st.empty(), "text": "", "rendered_at": None}
+        for field, title in STREAMED_FIELDS.items()
+    }
+    result = {"success": False, "error": "No response received", "error_type": "system_error"}
+
+    events = st.session_state.expert.stream_jee_query(
+        query=query, session_id=st.session_state.current_session_id, user_id="streamlit_user"
     )
+    for event in get_background_loop().iterate(events):
+        kind = event["type"]
+        if kind == "tool_call":
+            status.markdown(f"🔧 Using {event['name']}...")
+        elif kind == "tool_output":
+            status.markdown("🧠 Thinking...")
+        elif kind == "first_token":
+            status.markdown(f"✍️ Writing... (first token after {event['ttft_ms'] / 1000:.1f}s)")
+        elif kind in ("field_delta", "field_done") and event["field"] in sections:
+            section = sections[event["field"]]
+            section["text"] = section["text"] + event["text"] if kind == "field_delta" else event["value"]
+            now = time.perf_counter()
+            # Re-render at most every RENDER_INTERVAL_SECONDS while a field is being written
+            if kind == "field_done" or section["rendered_at"] is None or now - section["rendered_at"] >= RENDER_INTERVAL_SECONDS:
+                if section["rendered_at"] is None:
+                    section["header"].markdown(f'<div class="section-header">{section["title"]}</div>', unsafe_allow_html=True)
+                section["body"].markdown(section["text"])
+                section["rendered_at"] = now
+        elif kind == "final":
+            result = event["result"]
+
+    status.empty()
     if result.get("success"):
         st.session_state.current_session_id = result.get("session_id")
     return result
 
 def process_uploaded_image(uploaded_file) -> str:
     """Process uploaded image and extract text."""
-    tmp_file_path = None
     try:
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-            tmp_file.write(uploaded_file.getbuffer())
-            tmp_file_path = tmp_file.name
-
-        # Extract text from image
-        extracted_text = get_text_from_image(tmp_file_path)
-        
-        return extracted_text
-        
+        # The upload's buffer goes straight to OCR; nothing touches the disk
+        return run_async(get_text_from_image_async(uploaded_file.getbuffer()))
     except Exception as e:
         return f"Error processing image: {str(e)}"
-    finally:
-        # Ensure temporary file is always deleted
-        if tmp_file_path and os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-                logger.info(f"Temporary image file deleted: {tmp_file_path}")
-            except Exception as cleanup_error:
-                logger.warning(f"Failed to delete temporary file {tmp_file_path}: {cleanup_error}")
 
 def display_conversation():
     """Displays the conversation history."""
@@ -245,7 +259,9 @@ def display_conversation():
             if response:
                 st.markdown('<div class="bot-response">', unsafe_allow_html=True) # Bot response container
                 
-                st.markdown(f'<div class="session-info">Session: {result.get("session_id", "N/A")[:8]}...</div>', unsafe_allow_html=True)
+                ttft_ms = result.get("ttft_ms")
+                ttft_info = f" · first token {ttft_ms / 1000:.1f}s" if ttft_ms is not None else ""
+                st.markdown(f'<div class="session-info">Session: {result.get("session_id", "N/A")[:8]}...{ttft_info}</div>', unsafe_allow_html=True)
                 
                 if response.problem_analysis:
                     st.markdown('<div class="section-header">Problem Analysis</div>', unsafe_allow_html=True)
@@ -361,13 +377,12 @@ def main():
                     final_query = query.strip()
             
             if final_query:
-                with st.spinner("🧠 Thinking..."):
-                    result = run_async_query(final_query)
-                    st.session_state.conversation_history.append({
-                        "query": final_query, 
-                        "result": result,
-                        "has_image": has_image
-                    })
+                result = run_streaming_query(final_query)
+                st.session_state.conversation_history.append({
+                    "query": final_query, 
+                    "result": result,
+                    "has_image": has_image
+                })
                 st.rerun()
             else:
                 st.warning("Please provide a question or upload an image.")
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import time
+import base64
+import random
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+# Add src to path
+src_path = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(src_path))
+
+from PIL import Image, ImageDraw
+from utils.image_to_text import preprocess_image
+
+ITERATIONS = 10
+IMAGE_SIZES = [(2000, 1500), (4000, 3000)]
+
+def read_proc_io() -> Dict[str, int]:
+    """Read/write syscall and byte counters for this process (Linux only)"""
+    try:
+        with open("/proc/self/io") as proc_io:
+            return {name: int(value) for name, value in (line.split(": ") for line in proc_io)}
+    except OSError:
+        return {}
+
+def make_upload(width: int, height: int, image_format: str = "PNG") -> memoryview:
+    """A phone-photo-like problem image: noisy paper with dark text lines, as an upload buffer"""
+    image = Image.effect_noise((width, height), 12).point(lambda value: 200 + value // 5).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        draw.text((width // 8, height // 8 + line * 30), f"Q{line}. Evaluate the integral of x^{random.randint(1, 9)} e^x dx", fill=(20, 20, 20))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    # Streamlit's UploadedFile.getbuffer() is a memoryview over a BytesIO
+    return io.BytesIO(buffer.getvalue()).getbuffer()
+
+def write_and_read_back(upload: memoryview) -> bytes:
+    """Old app path: write the upload to a temp file and read it back"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
+        tmp_file.write(upload)
+        tmp_file_path = tmp_file.name
+    try:
+        with open(tmp_file_path, "rb") as image_file:
+            return image_file.read()
+    finally:
+        os.unlink(tmp_file_path)
+
+def before_path(upload: memoryview) -> bytes:
+    """Before: temp file round trip, then the full image base64-encoded"""
+    return base64.b64encode(write_and_read_back(upload))
+
+def temp_file_preprocess_path(upload: memoryview) -> bytes:
+    """Temp file round trip followed by preprocessing, to isolate the ingestion cost"""
+    processed, _, _ = preprocess_image(write_and_read_back(upload))
+    return base64.b64encode(processed)
+
+def after_path(upload: memoryview) -> bytes:
+    """After: preprocess straight from the upload's buffer"""
+    processed, _, _ = preprocess_image(upload)
+    return base64.b64encode(processed)
+
+def bench(label: str, fn, upload: memoryview) -> Dict:
+    """Time fn over ITERATIONS calls and collect per-call syscall and byte counters"""
+    before = read_proc_io()
+    start_time = time.perf_counter()
+    for _ in range(ITERATIONS):
+        payload = fn(upload)
+    per_call_ms = (time.perf_counter() - start_time) / ITERATIONS * 1000
+    after = read_proc_io()
+    stats = {name: (after[name] - before[name]) / ITERATIONS for name in after} if after else {}
+    print(
+        f"{label:<32} {per_call_ms:>9.1f} ms"
+        f" {stats.get('syscr', float('nan')):>8.0f} {stats.get('syscw', float('nan')):>8.0f}"
+        f" {stats.get('rchar', 0) / 1024:>10.0f} {stats.get('wchar', 0) / 1024:>10.0f}"
+        f" {len(payload) / 1024:>10.0f}"
+    )
+    return stats
+
+def main():
+    """Compare temp-file ingestion of an upload with passing its buffer through"""
+    print(f"Iterations per case: {ITERATIONS}; syscall/byte counters from /proc/self/io (per call)")
+    for image_format in ("PNG", "JPEG"):
+        for width, height in IMAGE_SIZES:
+            upload = make_upload(width, height, image_format)
+            print(f"\n{width}x{height} {image_format} upload, {upload.nbytes / 1024:.0f} KiB")
+            print(f"{'path':<32} {'time':>12} {'read sc':>8} {'write sc':>8} {'read KiB':>10} {'write KiB':>10} {'b64 KiB':>10}")
+            print("-" * 96)
+            bench("temp file, full image (before)", before_path, upload)
+            bench("temp file + preprocess", temp_file_preprocess_path, upload)
+            bench("buffer + preprocess (after)", after_path, upload)
+    print("\nThe temp-file path copies every upload into the page cache and back out (one")
+    print("write and at least one read syscall, twice the upload size in copies) before")
+    print("OCR; the buffer path reads the upload in place and sends only the reduced image.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import uuid
+import tempfile
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add src to path
+src_path = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(src_path))
+
+from utils.session_store import MemorySessionStore, SQLiteSessionStore
+from utils.conversation_memory import new_memory, update_memory
+
+TOTAL_SESSIONS = 1_000_000
+CHECKPOINT_EVERY = 100_000
+MAX_SESSIONS = 10_000
+MAX_BYTES = 16 * 1024 * 1024
+QUERY = "Evaluate the integral of x^2 e^(x^3) dx"
+RESPONSE = SimpleNamespace(
+    step_by_step_solution="Let u = x^3 so that du = 3x^2 dx.\nTherefore the integral is (1/3) e^(x^3) + C",
+    key_formulas_used=["∫ e^u du = e^u + C", "d(x^n)/dx = n x^(n-1)"],
+    related_jee_topics=["Integration by substitution", "Indefinite integrals"],
+)
+
+def new_session(session_id: str) -> dict:
+    """Same shape as JEECalculusExpertWithMemory.get_or_create_session"""
+    return {
+        "session_id": session_id,
+        "user_id": "bench_user",
+        "created_at": "2026-01-01T00:00:00",
+        "last_activity": "2026-01-01T00:00:00",
+        "total_queries": 1,
+        "memory": new_memory(),
+    }
+
+def run(label: str, store, total: int = TOTAL_SESSIONS):
+    """Create total sessions with one exchange each, reporting traced memory at checkpoints"""
+    print(f"\n{label}")
+    print(f"{'sessions':>10} {'traced MiB':>11} {'peak MiB':>9} {'in store':>9} {'us/session':>11}")
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    for i in range(1, total + 1):
+        session_id = str(uuid.uuid4())
+        store.put(session_id, new_session(session_id))
+        session = store.get(session_id)
+        update_memory(session["memory"], QUERY, RESPONSE)
+        store.put(session_id, session)
+        if i % CHECKPOINT_EVERY == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            per_session_us = (time.perf_counter() - start_time) / i * 1e6
+            print(f"{i:>10} {current / 2**20:>11.1f} {peak / 2**20:>9.1f} {store.metrics()['sessions']:>9} {per_session_us:>11.1f}")
+    tracemalloc.stop()
+    print(store.metrics())
+
+class DictStore:
+    """The old plain dict, behind the store interface"""
+
+    def __init__(self):
+        self.sessions = {}
+
+    def put(self, session_id: str, session: dict):
+        self.sessions[session_id] = session
+
+    def get(self, session_id: str):
+        return self.sessions.get(session_id)
+
+    def metrics(self) -> dict:
+        return {"sessions": len(self.sessions)}
+
+def main():
+    """Traced memory should level off once the store reaches its bounds"""
+    run("plain dict (before, unbounded; stopped at 300k)", DictStore(), total=300_000)
+    run("MemorySessionStore", MemorySessionStore(max_sessions=MAX_SESSIONS, idle_ttl_seconds=3600, max_bytes=MAX_BYTES))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = SQLiteSessionStore(
+            os.path.join(tmp_dir, "sessions.sqlite3"),
+            memory=MemorySessionStore(max_sessions=MAX_SESSIONS, idle_ttl_seconds=3600, max_bytes=MAX_BYTES),
+        )
+        run("SQLiteSessionStore (write-behind)", store)
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
+import os
+import time
 import asyncio
 import logging
 import uuid
 import json
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Tuple, Union
 from pydantic import BaseModel
 from agents import (
     Agent, 
     Runner, 
     GuardrailFunctionOutput,
+    InputGuardrailResult,
     InputGuardrailTripwireTriggered,
     OutputGuardrailTripwireTriggered,
     RunContextWrapper,
@@ -17,9 +20,19 @@ from agents import (
     trace,
     gen_trace_id
 )
-from tools.rag_search import rag_search
+from tools.rag_search import rag_search, rag_search_batch
 from tools.web_search import web_search
 from utils.langfuse_config import configure_langfuse
+from utils.search_client import close_search_client
+from utils.db_pool import close_pool
+from utils.input_classifier import classify_query, ON_TOPIC
+from utils.output_validator import TieredOutputValidator
+from utils.session_store import get_session_store
+from utils.conversation_memory import new_memory, update_memory, build_context, NO_CONTEXT
+from utils.tokens import count_tokens
+from utils.answer_cache import AnswerCache, is_follow_up, ANSWER_CACHE_ENABLED
+from utils.embeddings import generate_embedding
+from utils.structured_stream import StructuredOutputParser
 
 configure_langfuse("jee_calculus_agent_with_memory")
 
@@ -34,6 +47,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Constants
+BATCH_SOLVE_CONCURRENCY = 2  # Agent runs in flight at once when solving a batch
+# "optimistic": skip the LLM input check for clearly on-topic queries and run it
+# alongside the main agent otherwise; "sdk": leave it to the Agents SDK as before
+INPUT_GUARDRAIL_MODE = os.getenv("INPUT_GUARDRAIL_MODE", "optimistic")
+
 # Simplified Input Guardrail Models
 class JEEInputValidationOutput(BaseModel):
     is_jee_calculus_related: bool
@@ -98,22 +117,12 @@ jee_output_guardrail_agent = Agent(
     output_type=JEEOutputValidationOutput,
 )
 
-@input_guardrail
-async def jee_input_guardrail_simple(
-    ctx: RunContextWrapper[None], 
-    agent: Agent, 
-    input: str | list[TResponseInputItem]
-) -> GuardrailFunctionOutput:
-    """Simplified input guardrail"""
+async def validate_input(input_text: str, context: Any = None) -> GuardrailFunctionOutput:
+    """Run the LLM input validator on a query"""
     try:
         logger.info("Running JEE input validation...")
         
-        if isinstance(input, list):
-            input_text = str(input)
-        else:
-            input_text = input
-            
-        result = await Runner.run(jee_input_guardrail_agent, input_text, context=ctx.context)
+        result = await Runner.run(jee_input_guardrail_agent, input_text, context=context)
         validation_result = result.final_output
         
         should_trip = not (validation_result.is_jee_calculus_related and validation_result.is_appropriate_question)
@@ -135,36 +144,61 @@ async def jee_input_guardrail_simple(
             tripwire_triggered=False,
         )
 
+@input_guardrail
+async def jee_input_guardrail_simple(
+    ctx: RunContextWrapper[None], 
+    agent: Agent, 
+    input: str | list[TResponseInputItem]
+) -> GuardrailFunctionOutput:
+    """Simplified input guardrail"""
+    if isinstance(input, list):
+        input_text = str(input)
+    else:
+        input_text = input
+    return await validate_input(input_text, context=ctx.context)
+
+# Local checks first; the LLM validator only sees responses they are unsure about
+output_validator = TieredOutputValidator()
+
+# Responses to self-contained questions, shared across sessions
+answer_cache = AnswerCache()
+
 @output_guardrail  
 async def jee_output_guardrail_simple(
     ctx: RunContextWrapper, 
     agent: Agent, 
     output: JEECalculusExpertResponse
 ) -> GuardrailFunctionOutput:
-    """Simplified output guardrail"""
+    """Tiered output guardrail: local checks, then the LLM validator when needed"""
     try:
         logger.info("Running JEE output validation...")
+        llm_validation = {}
         
-        output_summary = f"""
-        Analysis: {output.problem_analysis[:200]}
-        Solution: {output.step_by_step_solution[:200]}
-        Concepts: {output.concept_explanation[:200]}
-        """
-        
-        result = await Runner.run(jee_output_guardrail_agent, output_summary, context=ctx.context)
-        validation_result = result.final_output
+        async def validate_with_llm(response: JEECalculusExpertResponse) -> bool:
+            output_summary = f"""
+            Analysis: {response.problem_analysis[:200]}
+            Solution: {response.step_by_step_solution[:200]}
+            Concepts: {response.concept_explanation[:200]}
+            """
+            
+            result = await Runner.run(jee_output_guardrail_agent, output_summary, context=ctx.context)
+            validation_result = result.final_output
+            llm_validation["result"] = validation_result
+            
+            # Very lenient - only trip if explicitly marked as both non-comprehensive AND inaccurate
+            should_trip = (not validation_result.is_comprehensive) and (not validation_result.is_accurate)
+            if should_trip:
+                logger.warning(f"Output rejected: {validation_result.reasoning}")
+            return should_trip
         
-        # Very lenient - only trip if explicitly marked as both non-comprehensive AND inaccurate
-        should_trip = (not validation_result.is_comprehensive) and (not validation_result.is_accurate)
+        decision = await output_validator.validate(output, validate_with_llm)
         
-        if should_trip:
-            logger.warning(f"Output rejected: {validation_result.reasoning}")
-        else:
-            logger.info("Output validation passed")
+        if not decision["tripwire_triggered"]:
+            logger.info(f"Output validation passed ({decision['tier']} tier)")
             
         return GuardrailFunctionOutput(
-            output_info=validation_result,
-            tripwire_triggered=should_trip,
+            output_info=llm_validation.get("result", decision),
+            tripwire_triggered=decision["tripwire_triggered"],
         )
         
     except Exception as e:
@@ -174,13 +208,53 @@ async def jee_output_guardrail_simple(
             tripwire_triggered=False,
         )
 
+# Markers stream_jee_query puts on its event queue next to the SDK's stream events
+_INPUT_CLEARED = object()
+_RUN_FINISHED = object()
+
+def _stream_event_to_ui(event: Any, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Translate one Agents SDK stream event into stream_jee_query events.
+    
+    state holds the structured output parser (reset for every model
+    response) and the tool names seen so far, by call id.
+    """
+    if event.type == "raw_response_event":
+        data = event.data
+        if data.type == "response.created":
+            state["parser"] = StructuredOutputParser()
+        elif data.type == "response.output_text.delta" and state["parser"] is not None:
+            try:
+                return state["parser"].feed(data.delta)
+            except ValueError as e:
+                # Not the JSON object we expected; the final result is still complete
+                logger.warning(f"Cannot stream structured output fields: {e}")
+                state["parser"] = None
+    elif event.type == "run_item_stream_event":
+        raw_item = event.item.raw_item
+        if event.name == "tool_called":
+            name = getattr(raw_item, "name", None)
+            state["tool_names"][getattr(raw_item, "call_id", None)] = name
+            return [{"type": "tool_call", "name": name, "arguments": getattr(raw_item, "arguments", None)}]
+        if event.name == "tool_output":
+            call_id = raw_item.get("call_id") if isinstance(raw_item, dict) else getattr(raw_item, "call_id", None)
+            return [{"type": "tool_output", "name": state["tool_names"].get(call_id)}]
+    return []
+
 class JEECalculusExpertWithMemory:
     """JEE Integral Calculus Expert Agent (Memory system disabled for stability)"""
     
     def __init__(self):
         self.agent = None
-        self.sessions = {}  # Local session cache
+        self.sessions = get_session_store()  # Bounded, optionally durable (SESSION_STORE)
         self.memory_enabled = False  # Disabled for now
+        self.guardrail_stats = {
+            "local_accepts": 0,
+            "llm_checks": 0,
+            "llm_trips": 0,
+            "llm_total_ms": 0.0,
+            "latency_saved_ms": 0.0,
+        }
         
     def create_agent(self):
         """Create the JEE Calculus Expert Agent"""
@@ -200,7 +274,7 @@ class JEECalculusExpertWithMemory:
             
             APPROACH:
             1. Analyze the problem thoroughly
-            2. Use rag_search for NCERT concepts
+            2. Use rag_search for NCERT concepts (rag_search_batch when you need several related concepts at once)
             3. Use web_search for advanced techniques
             4. Review conversation history if provided for context
             5. Provide comprehensive solutions
@@ -228,8 +302,8 @@ class JEECalculusExpertWithMemory:
             Remember: Always end the conversation with a question seeking for user's feedback. You have to ask a question to the user.
             """,
             model="o4-mini",  # Using o4-mini for orchestration as requested
-            tools=[rag_search, web_search],
-            input_guardrails=[jee_input_guardrail_simple],
+            tools=[rag_search, rag_search_batch, web_search],
+            input_guardrails=[jee_input_guardrail_simple] if INPUT_GUARDRAIL_MODE == "sdk" else [],
             output_guardrails=[jee_output_guardrail_simple],
             output_type=JEECalculusExpertResponse,
         )
@@ -240,69 +314,145 @@ class JEECalculusExpertWithMemory:
     
     def get_or_create_session(self, session_id: Optional[str] = None, user_id: str = "default_user") -> str:
         """Get existing session or create new one"""
-        if session_id and session_id in self.sessions:
-            import datetime
-            self.sessions[session_id]["last_activity"] = datetime.datetime.now().isoformat()
-            self.sessions[session_id]["total_queries"] += 1
+        import datetime
+        session = self.sessions.get(session_id) if session_id else None
+        if session is not None:
+            session["last_activity"] = datetime.datetime.now().isoformat()
+            session["total_queries"] += 1
+            self.sessions.put(session_id, session)
             logger.info(f"Using existing session: {session_id}")
             return session_id
         else:
             new_session_id = self.generate_session_id()
-            import datetime
             now = datetime.datetime.now().isoformat()
             
-            self.sessions[new_session_id] = {
+            self.sessions.put(new_session_id, {
                 "session_id": new_session_id,
                 "user_id": user_id,
                 "created_at": now,
                 "last_activity": now,
                 "total_queries": 1,
-                "conversation_history": []  # Add conversation history
-            }
+                "memory": new_memory()  # Structured summary of earlier turns
+            })
             
             logger.info(f"Created new session: {new_session_id}")
             return new_session_id
     
-    def add_to_conversation_history(self, session_id: str, query: str, response: str):
-        """Add query-response pair to conversation history"""
-        if session_id in self.sessions:
-            self.sessions[session_id]["conversation_history"].append({
-                "query": query,
-                "response": response,
-                "timestamp": str(uuid.uuid4())[:8]
-            })
-            # Keep only last 3 exchanges to avoid context overflow
-            if len(self.sessions[session_id]["conversation_history"]) > 3:
-                self.sessions[session_id]["conversation_history"] = self.sessions[session_id]["conversation_history"][-3:]
+    def add_to_conversation_history(self, session_id: str, query: str, response: JEECalculusExpertResponse):
+        """Fold a query and its structured response into the session's memory"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            update_memory(session.setdefault("memory", new_memory()), query, response)
+            self.sessions.put(session_id, session)
     
     def get_conversation_context(self, session_id: str) -> str:
-        """Get formatted conversation history for context"""
-        if session_id not in self.sessions or not self.sessions[session_id]["conversation_history"]:
-            return "No previous conversation in this session."
+        """Get conversation memory formatted for the prompt, within CONVERSATION_CONTEXT_TOKENS"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return NO_CONTEXT
+        return build_context(session.get("memory"))
+    
+    def _mean_guardrail_ms(self) -> float:
+        """Mean latency of the LLM input check so far (0 before the first one)"""
+        checks = self.guardrail_stats["llm_checks"]
+        return self.guardrail_stats["llm_total_ms"] / checks if checks else 0.0
+    
+    async def run_with_input_guardrail(
+        self,
+        query: str,
+        agent_input: str,
+        run_agent: Optional[Callable[[], Awaitable[Any]]] = None,
+        on_input_cleared: Optional[Callable[[], None]] = None
+    ):
+        """
+        Run the main agent with optimistic input validation.
         
-        context = "CONVERSATION HISTORY:\n"
-        for i, exchange in enumerate(self.sessions[session_id]["conversation_history"], 1):
-            context += f"\nPREVIOUS QUERY {i}: {exchange['query']}\n"
-            context += f"PREVIOUS RESPONSE {i} (Summary): {exchange['response'][:500]}...\n"
+        Clearly on-topic queries (local classifier) skip the LLM check. Other
+        queries run the LLM check concurrently with the agent; if it trips, the
+        agent run is cancelled and InputGuardrailTripwireTriggered is raised.
         
-        return context
-    
-    async def handle_jee_query_with_memory(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> Dict[str, Any]:
-        """Handle a JEE calculus query"""
+        Args:
+            query: The user's query, for the local classifier
+            agent_input: The full prompt for the agent and the LLM check
+            run_agent: Coroutine function running the agent (default Runner.run)
+            on_input_cleared: Called once the input is known to be acceptable,
+                so streamed output can be shown from then on
+        
+        Returns:
+            (agent run result, guardrail info with the path taken and the
+            latency saved compared to checking before the agent starts)
+        """
+        run_agent = run_agent or (lambda: Runner.run(self.agent, agent_input))
+        input_cleared = on_input_cleared or (lambda: None)
+        
+        if INPUT_GUARDRAIL_MODE == "sdk":
+            # The SDK raises from the run itself if its guardrail trips
+            input_cleared()
+            return await run_agent(), {"path": "sdk"}
+        
+        start_time = time.perf_counter()
+        if classify_query(query) == ON_TOPIC:
+            # The saving is the LLM check we did not make, estimated from past checks
+            saved_ms = self._mean_guardrail_ms()
+            self.guardrail_stats["local_accepts"] += 1
+            self.guardrail_stats["latency_saved_ms"] += saved_ms
+            input_cleared()
+            result = await run_agent()
+            logger.info("Input accepted by local classifier; LLM input check skipped")
+            return result, {"path": "local", "guardrail_ms": 0.0, "latency_saved_ms": round(saved_ms, 1), "estimated": True}
+        
+        finished_at = {}
+        
+        async def timed(name: str, coro):
+            value = await coro
+            finished_at[name] = time.perf_counter()
+            return value
+        
+        guardrail_task = asyncio.create_task(timed("guardrail", validate_input(agent_input)))
+        agent_task = asyncio.create_task(timed("agent", run_agent()))
         try:
-            current_session_id = self.get_or_create_session(session_id, user_id)
+            # The agent's output is only used once the check has passed
+            verdict = await guardrail_task
+            guardrail_ms = (finished_at["guardrail"] - start_time) * 1000
+            self.guardrail_stats["llm_checks"] += 1
+            self.guardrail_stats["llm_total_ms"] += guardrail_ms
             
-            logger.info(f"Processing JEE query - Session: {current_session_id}")
-            logger.info(f"Query: {query}")
-            
-            # Get conversation context
-            conversation_context = self.get_conversation_context(current_session_id)
+            if verdict.tripwire_triggered:
+                self.guardrail_stats["llm_trips"] += 1
+                agent_task.cancel()
+                raise InputGuardrailTripwireTriggered(
+                    InputGuardrailResult(guardrail=jee_input_guardrail_simple, output=verdict)
+                )
             
-            # Enhanced query with session context and conversation history
-            enhanced_query = f"""
+            input_cleared()
+            result = await agent_task
+        finally:
+            for task in (guardrail_task, agent_task):
+                if not task.done():
+                    task.cancel()
+        
+        agent_ms = (finished_at["agent"] - start_time) * 1000
+        # Serially the run would take guardrail_ms + agent_ms; overlapped it takes the longer of the two
+        saved_ms = min(guardrail_ms, agent_ms)
+        self.guardrail_stats["latency_saved_ms"] += saved_ms
+        return result, {"path": "parallel", "guardrail_ms": round(guardrail_ms, 1), "latency_saved_ms": round(saved_ms, 1), "estimated": False}
+    
+    async def _prepare_query(self, query: str, session_id: Optional[str], user_id: str) -> Dict[str, Any]:
+        """Resolve the session, build the agent prompt and check the answer cache"""
+        current_session_id = self.get_or_create_session(session_id, user_id)
+        session = self.sessions.get(current_session_id)
+        
+        logger.info(f"Processing JEE query - Session: {current_session_id}")
+        logger.info(f"Query: {query}")
+        
+        # Get conversation context
+        conversation_context = self.get_conversation_context(current_session_id)
+        
+        # Enhanced query with session context and conversation history
+        enhanced_query = f"""
             Session ID: {current_session_id}
             Memory Status: disabled (fallback mode)
-            Query #{self.sessions[current_session_id]['total_queries']}
+            Query #{session['total_queries']}
             
             {conversation_context}
             
@@ -311,27 +461,64 @@ class JEECalculusExpertWithMemory:
             Please provide a comprehensive JEE-level response using rag_search and web_search.
             If the user refers to "previous problem", "from earlier", or similar context, use the conversation history above.
             """
-            
-            # Run the agent
-            result = await Runner.run(self.agent, enhanced_query)
-            response = result.final_output
-            
-            # Ensure session_id is set
-            response.session_id = current_session_id
-            
-            # Handle missing fields with defaults
-            if not hasattr(response, 'memory_insights') or not response.memory_insights:
-                response.memory_insights = "Memory system not available - using session context"
-            
-            if not hasattr(response, 'personalized_tips') or not response.personalized_tips:
-                response.personalized_tips = "Focus on practice and concept clarity for JEE success"
-            
-            # Format response
-            formatted_response = f"""
+        
+        # Self-contained questions can be answered from the answer cache. A cache hit
+        # skips the agent run and with it the input guardrail, so only queries the
+        # local classifier accepts on its own are looked up (or later cached).
+        follow_up = is_follow_up(query, session["memory"]["turn_count"] > 0)
+        cache_lookup = None
+        if ANSWER_CACHE_ENABLED and not follow_up and classify_query(query) == ON_TOPIC:
+            cache_lookup = await answer_cache.lookup(query, generate_embedding)
+            if cache_lookup["hit"]:
+                logger.info(f"Answer cache {cache_lookup['match']} hit in {cache_lookup['latency_ms']}ms")
+        
+        return {
+            "session_id": current_session_id,
+            "session": session,
+            "enhanced_query": enhanced_query,
+            "context_tokens": count_tokens(conversation_context),
+            "follow_up": follow_up,
+            "cache_lookup": cache_lookup,
+        }
+    
+    def _cached_response(self, prepared: Dict[str, Any]) -> Optional[JEECalculusExpertResponse]:
+        """The cached response for a prepared query, if the answer cache had one"""
+        cache_lookup = prepared["cache_lookup"]
+        if not cache_lookup or not cache_lookup["hit"]:
+            return None
+        return JEECalculusExpertResponse(**{**cache_lookup["response"], "session_id": prepared["session_id"]})
+    
+    async def _finish_query(
+        self,
+        query: str,
+        prepared: Dict[str, Any],
+        response: JEECalculusExpertResponse,
+        guardrail_info: Dict[str, Any],
+        ttft_ms: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Cache, format and remember a response, and build the result dict"""
+        current_session_id = prepared["session_id"]
+        session = prepared["session"]
+        cache_lookup = prepared["cache_lookup"]
+        if cache_lookup is not None and not cache_lookup["hit"]:
+            await answer_cache.store(cache_lookup, query, response.model_dump(), generate_embedding)
+        
+        # Ensure session_id is set
+        response.session_id = current_session_id
+        
+        # Handle missing fields with defaults
+        if not hasattr(response, 'memory_insights') or not response.memory_insights:
+            response.memory_insights = "Memory system not available - using session context"
+        
+        if not hasattr(response, 'personalized_tips') or not response.personalized_tips:
+            response.personalized_tips = "Focus on practice and concept clarity for JEE success"
+        
+        # Format response
+        formatted_response = f"""
 JEE INTEGRAL CALCULUS EXPERT RESPONSE (Session: {current_session_id})
 {'='*70}
 Memory Status: disabled (using session context)
-Query #{self.sessions[current_session_id]['total_queries']}
+Query #{session['total_queries']}
 
 PROBLEM ANALYSIS:
 {response.problem_analysis}
@@ -366,51 +553,226 @@ MEMORY INSIGHTS:
 PERSONALIZED TIPS:
 {response.personalized_tips}
 {'='*70}
-            """
+        """
+        
+        # Add to conversation history for future context
+        self.add_to_conversation_history(current_session_id, query, response)
+        
+        return {
+            "success": True,
+            "session_id": current_session_id,
+            "response": formatted_response.strip(),
+            "structured_response": response,
+            "session_info": session,
+            "total_queries": session['total_queries'],
+            "memory_enabled": self.memory_enabled,
+            "has_context": session["memory"]["turn_count"] > 1,
+            "context_tokens": prepared["context_tokens"],
+            "answer_cache": {
+                "hit": bool(cache_lookup and cache_lookup["hit"]),
+                "match": cache_lookup["match"] if cache_lookup else None,
+                "similarity": cache_lookup["similarity"] if cache_lookup else None,
+                "bypassed": prepared["follow_up"],
+            },
+            "guardrail": guardrail_info,
+            "output_validation": output_validator.metrics(),
+            "ttft_ms": ttft_ms
+        }
+    
+    def _error_result(self, error: Exception, session_id: Optional[str]) -> Dict[str, Any]:
+        """Result dict for a query that failed"""
+        if isinstance(error, InputGuardrailTripwireTriggered):
+            error_msg = "INPUT REJECTED: Please ask JEE-level calculus questions only."
+            error_type = "input_validation"
+            logger.warning(f"Input guardrail triggered: {error}")
+        elif isinstance(error, OutputGuardrailTripwireTriggered):
+            error_msg = "OUTPUT QUALITY CHECK FAILED: Response didn't meet standards. Please try rephrasing."
+            error_type = "output_validation"
+            logger.warning(f"Output guardrail triggered: {error}")
+        else:
+            error_msg = f"SYSTEM ERROR: {str(error)}"
+            error_type = "system_error"
+            logger.error(f"Error handling JEE query: {error}")
+        return {
+            "success": False,
+            "error": error_msg,
+            "session_id": session_id,
+            "error_type": error_type
+        }
+    
+    async def handle_jee_query_with_memory(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> Dict[str, Any]:
+        """Handle a JEE calculus query"""
+        try:
+            prepared = await self._prepare_query(query, session_id, user_id)
+            response = self._cached_response(prepared)
+            if response is not None:
+                guardrail_info = {"path": "answer_cache"}
+            else:
+                # Run the agent (with the input check, unless the SDK runs it)
+                result, guardrail_info = await self.run_with_input_guardrail(query, prepared["enhanced_query"])
+                response = result.final_output
+            return await self._finish_query(query, prepared, response, guardrail_info)
+        except Exception as e:
+            return self._error_result(e, session_id)
+    
+    async def stream_jee_query(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Handle a JEE calculus query as a stream of events.
+        
+        Same behaviour as handle_jee_query_with_memory, but built on a streamed
+        agent run so callers can show progress. When the input still needs the
+        LLM check, output is held back until the check passes.
+        
+        Yields:
+            {"type": "session", "session_id"} first, then as they happen
+            {"type": "tool_call", "name", "arguments"}, {"type": "tool_output", "name"},
+            {"type": "first_token", "ttft_ms"}, {"type": "field_delta", "field", "text"}
+            for string fields being written and {"type": "field_done", "field", "value"},
+            and finally {"type": "final", "result"} with the handle_jee_query_with_memory
+            result (including ttft_ms)
+        """
+        start_time = time.perf_counter()
+        run_task = None
+        try:
+            prepared = await self._prepare_query(query, session_id, user_id)
+            yield {"type": "session", "session_id": prepared["session_id"]}
             
-            # Add to conversation history for future context
-            self.add_to_conversation_history(current_session_id, query, formatted_response)
+            response = self._cached_response(prepared)
+            if response is not None:
+                ttft_ms = round((time.perf_counter() - start_time) * 1000, 1)
+                yield {"type": "first_token", "ttft_ms": ttft_ms}
+                for field, value in response.model_dump().items():
+                    yield {"type": "field_done", "field": field, "value": value}
+                result = await self._finish_query(query, prepared, response, {"path": "answer_cache"}, ttft_ms)
+                yield {"type": "final", "result": result}
+                return
             
-            return {
-                "success": True,
-                "session_id": current_session_id,
-                "response": formatted_response.strip(),
-                "structured_response": response,
-                "session_info": self.sessions[current_session_id],
-                "total_queries": self.sessions[current_session_id]['total_queries'],
-                "memory_enabled": self.memory_enabled,
-                "has_context": len(self.sessions[current_session_id]["conversation_history"]) > 1
-            }
+            events: asyncio.Queue = asyncio.Queue()
             
-        except InputGuardrailTripwireTriggered as e:
-            error_msg = "INPUT REJECTED: Please ask JEE-level calculus questions only."
-            logger.warning(f"Input guardrail triggered: {e}")
-            return {
-                "success": False,
-                "error": error_msg,
-                "session_id": session_id,
-                "error_type": "input_validation"
-            }
+            async def run_streamed():
+                run = Runner.run_streamed(self.agent, prepared["enhanced_query"])
+                try:
+                    async for event in run.stream_events():
+                        events.put_nowait(event)
+                finally:
+                    if not run.is_complete:
+                        run.cancel()
+                return run
             
-        except OutputGuardrailTripwireTriggered as e:
-            error_msg = "OUTPUT QUALITY CHECK FAILED: Response didn't meet standards. Please try rephrasing."
-            logger.warning(f"Output guardrail triggered: {e}")
-            return {
-                "success": False,
-                "error": error_msg,
-                "session_id": session_id,
-                "error_type": "output_validation"
-            }
+            run_task = asyncio.create_task(self.run_with_input_guardrail(
+                query,
+                prepared["enhanced_query"],
+                run_agent=run_streamed,
+                on_input_cleared=lambda: events.put_nowait(_INPUT_CLEARED)
+            ))
+            run_task.add_done_callback(lambda _: events.put_nowait(_RUN_FINISHED))
             
+            state = {"parser": StructuredOutputParser(), "tool_names": {}}
+            held: List[Dict[str, Any]] = []
+            released = False
+            ttft_ms = None
+            while True:
+                event = await events.get()
+                if event is _RUN_FINISHED:
+                    break
+                if event is _INPUT_CLEARED:
+                    released = True
+                    ui_events, held = held, []
+                else:
+                    ui_events = _stream_event_to_ui(event, state)
+                if not released:
+                    held.extend(ui_events)
+                    continue
+                for ui_event in ui_events:
+                    if ttft_ms is None and ui_event["type"] in ("field_delta", "field_done"):
+                        ttft_ms = round((time.perf_counter() - start_time) * 1000, 1)
+                        logger.info(f"Time to first token: {ttft_ms}ms")
+                        yield {"type": "first_token", "ttft_ms": ttft_ms}
+                    yield ui_event
+            
+            run, guardrail_info = await run_task
+            result = await self._finish_query(query, prepared, run.final_output, guardrail_info, ttft_ms)
+            yield {"type": "final", "result": result}
         except Exception as e:
-            error_msg = f"SYSTEM ERROR: {str(e)}"
-            logger.error(f"Error handling JEE query: {e}")
-            return {
-                "success": False,
-                "error": error_msg,
-                "session_id": session_id,
-                "error_type": "system_error"
-            }
+            yield {"type": "final", "result": self._error_result(e, session_id)}
+        finally:
+            if run_task is not None and not run_task.done():
+                run_task.cancel()
+    
+    async def solve_batch(
+        self,
+        problems: Union[Iterable[str], AsyncIterable[str]],
+        concurrency: int = BATCH_SOLVE_CONCURRENCY,
+        user_id: str = "batch_user"
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Solve independent problems concurrently, each in its own session.
+        
+        Problems may come from a list or stream in from an async iterable (e.g.
+        batch OCR); solving starts as soon as each one arrives. At most
+        concurrency agent runs are in flight.
+        
+        Args:
+            problems: Problem statements
+            concurrency: Maximum number of concurrent agent runs
+            user_id: User the batch sessions belong to
+        
+        Yields:
+            (index of the problem in input order, result of handle_jee_query_with_memory)
+            in completion order
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, concurrency))
+        results: asyncio.Queue = asyncio.Queue()
+        worker_count = max(1, concurrency)
+        
+        async def stop_workers():
+            for _ in range(worker_count):
+                await queue.put(None)
+        
+        async def produce():
+            index = 0
+            try:
+                if hasattr(problems, "__aiter__"):
+                    async for problem in problems:
+                        await queue.put((index, problem))
+                        index += 1
+                else:
+                    for problem in problems:
+                        await queue.put((index, problem))
+                        index += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await stop_workers()
+                raise
+            await stop_workers()
+        
+        async def work():
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    index, problem = item
+                    result = await self.handle_jee_query_with_memory(query=problem, session_id=None, user_id=user_id)
+                    await results.put((index, result))
+            finally:
+                await results.put(None)
+        
+        producer = asyncio.create_task(produce())
+        workers = [asyncio.create_task(work()) for _ in range(worker_count)]
+        try:
+            finished_workers = 0
+            while finished_workers < worker_count:
+                item = await results.get()
+                if item is None:
+                    finished_workers += 1
+                    continue
+                yield item
+            await producer  # Surface errors from the problem source
+        finally:
+            for task in [producer, *workers]:
+                task.cancel()
 
 async def main():
     """Main function for JEE Integral Calculus Expert with Memory"""
@@ -494,8 +856,8 @@ async def main():
                     continue
                 
                 if user_input.lower() == 'session':
-                    if current_session_id and current_session_id in expert.sessions:
-                        session_info = expert.sessions[current_session_id]
+                    session_info = expert.sessions.get(current_session_id) if current_session_id else None
+                    if session_info is not None:
                         print(f"Current Session: {current_session_id}")
                         print(f"Total Queries: {session_info['total_queries']}")
                         print(f"Memory Enabled: {expert.memory_enabled}")
@@ -532,6 +894,11 @@ async def main():
     except Exception as e:
         logger.error(f"Fatal error: {e}")
         print(f"Fatal error: {e}")
+    finally:
+        # Release pooled HTTP and database connections
+        await close_search_client()
+        await close_pool()
+        expert.sessions.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -1,12 +1,15 @@
 import os
+import json
+import asyncio
 import logging
-from typing import List, Dict
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from openai import AsyncOpenAI
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from agents import function_tool
+from utils.embeddings import generate_embeddings
+from utils.retrieval_backends import get_backend, MIN_SIMILARITY
+from utils.hybrid_search import reciprocal_rank_fusion, rerank, row_key
+from utils.single_flight import SingleFlight
 
 # Load environment variables
 load_dotenv()
@@ -15,12 +18,12 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 # Constants
-DATABASE_URL = os.getenv("DATABASE_URL")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-EMBEDDING_MODEL = "text-embedding-3-small"
+DEDUPE_CANDIDATE_FACTOR = 4  # Extra chunk candidates fetched when deduplicating by section
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "hybrid")  # "hybrid" or "vector"
+RAG_RERANK = os.getenv("RAG_RERANK", "false").lower() == "true"
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Coalesces concurrent identical searches
+rag_flight = SingleFlight("rag_search")
 
 class RAGSearchResult(BaseModel):
     """Result from RAG search containing relevant math content"""
@@ -32,95 +35,228 @@ class RAGSearchResult(BaseModel):
     sub_headings: List[str]
     notes: List[str]
     tips_to_approach: List[str]
+    chunk_index: int = 0
+    sub_heading: str = ""
 
-def get_db_connection():
-    """Establish database connection"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = False
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        return conn, cursor
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+class RAGSearchGroup(BaseModel):
+    """RAG search results for one query of a batch"""
+    query: str
+    results: List[RAGSearchResult]
 
-async def generate_embedding(text: str) -> List[float]:
-    """Generate embedding for given text using OpenAI"""
-    try:
-        response = await client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        raise
+async def _vector_search_many(queries: List[str], limit: int) -> Tuple[List[List[float]], List[List[Dict]]]:
+    """
+    Embed all queries with one API call and run every top-k search in one backend round trip.
+
+    Returns:
+        (query embeddings, rows per query)
+    """
+    query_embeddings = await generate_embeddings(queries)
+    return query_embeddings, await get_backend().search_many(query_embeddings, limit)
+
+async def _apply_similarity_cutoff(query_embeddings: List[List[float]], fused_lists: List[List[Dict]]) -> List[List[Dict]]:
+    """
+    Drop fused rows at or below MIN_SIMILARITY to their query.
+
+    Rows found by vector search already passed the cutoff; rows found only
+    by lexical search are scored against the query vector first, in one
+    backend call for the whole batch.
+    """
+    unscored = [[row_key(row) for row in fused if row.get('similarity_score') is None] for fused in fused_lists]
+    if any(unscored):
+        similarities = await get_backend().similarities_many(query_embeddings, unscored)
+        fused_lists = [
+            [
+                row if row.get('similarity_score') is not None
+                else {**row, "similarity_score": scores.get(row_key(row))}
+                for row in fused
+            ]
+            for fused, scores in zip(fused_lists, similarities)
+        ]
+    return [
+        [row for row in fused if row['similarity_score'] is not None and row['similarity_score'] > MIN_SIMILARITY]
+        for fused in fused_lists
+    ]
+
+async def retrieve_many(queries: List[str], limit: int) -> List[List[Dict]]:
+    """
+    Retrieve candidate chunks for each query.
+
+    In hybrid mode, vector and lexical search run concurrently (the lexical
+    query does not wait for the embeddings) and each query's lists are fused
+    with reciprocal rank fusion. The similarity cutoff is then applied to
+    the fused rows, so keyword-only matches must also be similar enough to
+    the query, and the local reranker optionally reorders what is left.
+    """
+    backend = get_backend()
+    if RAG_SEARCH_MODE != "hybrid":
+        _, vector_results = await _vector_search_many(queries, limit)
+        return vector_results
+    
+    vector_search, lexical_results = await asyncio.gather(
+        _vector_search_many(queries, limit),
+        backend.lexical_search_many(queries, limit),
+        return_exceptions=True
+    )
+    query_embeddings: Optional[List[List[float]]] = None
+    if isinstance(vector_search, Exception):
+        logger.warning(f"Vector search failed, using lexical results only: {vector_search}")
+        vector_results = [[] for _ in queries]
+    else:
+        query_embeddings, vector_results = vector_search
+    if isinstance(lexical_results, Exception):
+        logger.warning(f"Lexical search failed, using vector results only: {lexical_results}")
+        lexical_results = [[] for _ in queries]
+    
+    fused_lists = [
+        reciprocal_rank_fusion([vector_rows, lexical_rows])
+        for vector_rows, lexical_rows in zip(vector_results, lexical_results)
+    ]
+    if query_embeddings is not None:
+        try:
+            fused_lists = await _apply_similarity_cutoff(query_embeddings, fused_lists)
+        except Exception as e:
+            logger.warning(f"Scoring lexical matches failed, keeping vector matches only: {e}")
+            fused_lists = [[row for row in fused if row.get('similarity_score') is not None] for fused in fused_lists]
+    if RAG_RERANK:
+        fused_lists = [rerank(query, fused) for query, fused in zip(queries, fused_lists)]
+    return fused_lists
+
+def _to_result(result: Dict) -> RAGSearchResult:
+    """Convert a backend row into a RAGSearchResult"""
+    return RAGSearchResult(
+        content_id=result['content_id'],
+        section=result['section'],
+        difficulty_level=result['difficulty_level'],
+        content=result['content'],
+        similarity_score=float(result.get('similarity_score') or 0.0),
+        sub_headings=result['sub_headings'] or [],
+        notes=result['notes'] or [],
+        tips_to_approach=result['tips_to_approach'] or [],
+        chunk_index=result['chunk_index'],
+        sub_heading=result['sub_heading'] or ""
+    )
+
+async def search_math_content(queries: List[str], num_chunks: int = 3, one_chunk_per_section: bool = True) -> List[RAGSearchGroup]:
+    """
+    Batched RAG search shared by rag_search and rag_search_batch.
+
+    Every query gets its own top chunks, even when other queries of the
+    batch retrieved the same ones (see render_groups for de-duplicating the
+    output). Concurrent identical searches share one retrieval.
+    """
+    queries = [" ".join(query.split()) for query in queries if query and query.strip()]
+    if not queries:
+        raise ValueError("Query cannot be empty")
+    
+    num_chunks = max(1, min(num_chunks, 10))  # Limit between 1 and 10
+    
+    key = json.dumps([queries, num_chunks, one_chunk_per_section, RAG_SEARCH_MODE, RAG_RERANK])
+    return await rag_flight.do(key, lambda: _search_math_content(queries, num_chunks, one_chunk_per_section))
+
+async def _search_math_content(queries: List[str], num_chunks: int, one_chunk_per_section: bool) -> List[RAGSearchGroup]:
+    """Retrieve and group chunks for normalized queries"""
+    # Fetch extra candidates when deduplicating so enough distinct sections remain
+    candidate_count = num_chunks * DEDUPE_CANDIDATE_FACTOR if one_chunk_per_section else num_chunks
+    
+    candidate_lists = await retrieve_many(queries, candidate_count)
+    
+    groups = []
+    for query, candidates in zip(queries, candidate_lists):
+        search_results = []
+        seen_sections = set()
+        for result in candidates:
+            if one_chunk_per_section:
+                if result['content_id'] in seen_sections:
+                    continue
+                seen_sections.add(result['content_id'])
+            if len(search_results) >= num_chunks:
+                break
+            search_results.append(_to_result(result))
+        groups.append(RAGSearchGroup(query=query, results=search_results))
+    
+    return groups
+
+def render_groups(groups: List[RAGSearchGroup]) -> List[RAGSearchGroup]:
+    """
+    Prepare batch results for the model without repeating chunk text.
+
+    A chunk already shown for an earlier query keeps its place and metadata
+    in every later group, but its content, notes and tips are replaced by a
+    pointer to the first group. The groups passed in are not modified.
+    """
+    first_shown: Dict[Tuple[str, int], str] = {}
+    rendered = []
+    for group in groups:
+        results = []
+        for result in group.results:
+            key = (result.content_id, result.chunk_index)
+            if key in first_shown:
+                results.append(result.model_copy(update={
+                    "content": f"(Same chunk as in the results for '{first_shown[key]}')",
+                    "notes": [],
+                    "tips_to_approach": [],
+                }))
+            else:
+                first_shown[key] = group.query
+                results.append(result)
+        rendered.append(RAGSearchGroup(query=group.query, results=results))
+    return rendered
 
 @function_tool
-async def rag_search(query: str, num_chunks: int = 3) -> List[RAGSearchResult]:
+async def rag_search(query: str, num_chunks: int = 3, one_chunk_per_section: bool = True) -> List[RAGSearchResult]:
     """
-    Search the math content database for relevant information using vector similarity.
+    Search the math content database for relevant information using vector similarity
+    combined with keyword matching (exact symbols, section numbers like 7.6.2).
     
     Args:
         query: The search query to find relevant math content
         num_chunks: Number of relevant content chunks to return (default: 3, max: 10)
+        one_chunk_per_section: Return only the best chunk from each NCERT section (default: True)
     
     Returns:
         List of relevant math content chunks with metadata
     """
     try:
-        # Validate inputs
-        if not query or not query.strip():
-            raise ValueError("Query cannot be empty")
-        
-        num_chunks = max(1, min(num_chunks, 10))  # Limit between 1 and 10
-        
         logger.info(f"Performing RAG search for query: '{query}' with {num_chunks} chunks")
         
-        # Generate embedding for the query
-        query_embedding = await generate_embedding(query.strip())
-        
-        # Perform vector search
-        conn, cursor = get_db_connection()
+        groups = await search_math_content([query], num_chunks, one_chunk_per_section)
+        search_results = groups[0].results
         
-        search_sql = """
-        SELECT 
-            content_id, section, difficulty_level, content, sub_headings, 
-            notes, tips_to_approach,
-            1 - (embedding <=> %s::vector) as similarity_score
-        FROM math_content
-        WHERE 1 - (embedding <=> %s::vector) > 0.3
-        ORDER BY similarity_score DESC
-        LIMIT %s;
-        """
+        logger.info(f"Found {len(search_results)} relevant content chunks")
         
-        # Convert embedding to PostgreSQL array format
-        embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
+        return search_results
         
-        cursor.execute(search_sql, (embedding_str, embedding_str, num_chunks))
-        results = cursor.fetchall()
-        conn.close()
+    except Exception as e:
+        logger.error(f"Error in RAG search: {e}")
+        # Return empty list instead of raising exception to keep agent running
+        return []
+
+@function_tool
+async def rag_search_batch(queries: List[str], num_chunks: int = 3, one_chunk_per_section: bool = True) -> List[RAGSearchGroup]:
+    """
+    Search the math content database for several related concepts at once.
+    Prefer this over repeated rag_search calls: all queries share one embedding
+    request and one database round trip, and a chunk found for several queries is
+    listed under each of them but its text is only shown once.
+    
+    Args:
+        queries: The search queries, one per concept
+        num_chunks: Number of relevant content chunks to return per query (default: 3, max: 10)
+        one_chunk_per_section: Return only the best chunk from each NCERT section per query (default: True)
+    
+    Returns:
+        One group of relevant math content chunks per query
+    """
+    try:
+        logger.info(f"Performing batched RAG search for {len(queries)} queries with {num_chunks} chunks each")
         
-        # Convert results to RAGSearchResult objects
-        search_results = []
-        for result in results:
-            search_result = RAGSearchResult(
-                content_id=result['content_id'],
-                section=result['section'],
-                difficulty_level=result['difficulty_level'],
-                content=result['content'],
-                similarity_score=float(result['similarity_score']),
-                sub_headings=result['sub_headings'] or [],
-                notes=result['notes'] or [],
-                tips_to_approach=result['tips_to_approach'] or []
-            )
-            search_results.append(search_result)
+        groups = await search_math_content(queries, num_chunks, one_chunk_per_section)
         
-        logger.info(f"Found {len(search_results)} relevant content chunks")
+        logger.info(f"Found {sum(len(group.results) for group in groups)} relevant content chunks")
         
-        return search_results
+        return render_groups(groups)
         
     except Exception as e:
-        logger.error(f"Error in RAG search: {e}")
+        logger.error(f"Error in batched RAG search: {e}")
         # Return empty list instead of raising exception to keep agent running
         return []
@@ -1,21 +1,173 @@
-from exa_py import Exa
 import json
 import os
 import asyncio
 import time
-from concurrent.futures import ThreadPoolExecutor
+import logging
 from agents import function_tool
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Set, Tuple
+from utils.search_client import get_exa_client
+from utils.search_cache import SearchResultCache, search_cache_key, STALE
+from utils.web_content import clean_text, select_passages
+from utils.single_flight import SingleFlight
 
 load_dotenv()
 
-# Initialize Exa API key
-EXA_API_KEY = os.getenv("EXA_API_KEY")
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+SEARCH_NUM_RESULTS = 3  # Top 3 results for each query
+SEARCH_SOURCE_CHARS = 8000  # Cleaned page text cached per result, before passage selection
+WEB_SEARCH_TOKEN_BUDGET = int(os.getenv("WEB_SEARCH_TOKEN_BUDGET", "1200"))  # Page content tokens per tool response
+WEB_SEARCH_CACHE_SIZE = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "512"))
+WEB_SEARCH_CACHE_TTL_SECONDS = float(os.getenv("WEB_SEARCH_CACHE_TTL_SECONDS", "21600"))
+WEB_SEARCH_CACHE_STALE_SECONDS = float(os.getenv("WEB_SEARCH_CACHE_STALE_SECONDS", "86400"))  # 0 disables stale-while-revalidate
+WEB_SEARCH_CACHE_PATH = os.getenv("WEB_SEARCH_CACHE_PATH")  # SQLite file; unset disables the disk tier
+WEB_SEARCH_QUERY_TIMEOUT_SECONDS = float(os.getenv("WEB_SEARCH_QUERY_TIMEOUT_SECONDS", "8"))
+WEB_SEARCH_DEADLINE_SECONDS = float(os.getenv("WEB_SEARCH_DEADLINE_SECONDS", "12"))  # Budget for the whole tool call
+
+# Everything that changes what a search returns is part of the cache key
+SEARCH_PARAMS = {
+    "num_results": SEARCH_NUM_RESULTS,
+    "text": True,
+    "source_chars": SEARCH_SOURCE_CHARS,
+    "extraction": "clean-v1",
+}
+
+# Process-wide search result cache
+search_cache = SearchResultCache(
+    max_entries=WEB_SEARCH_CACHE_SIZE,
+    ttl_seconds=WEB_SEARCH_CACHE_TTL_SECONDS,
+    stale_seconds=WEB_SEARCH_CACHE_STALE_SECONDS,
+    disk_path=WEB_SEARCH_CACHE_PATH,
+)
+
+# Coalesces concurrent searches for the same cache key
+search_flight = SingleFlight("web_search")
+
+# Background refreshes of stale entries, by cache key
+_revalidations: Dict[str, asyncio.Task] = {}
+
+# Searches still running after a call's deadline passed (kept referenced until done)
+_background_searches: Set[asyncio.Task] = set()
+
+async def _search_one(exa, query: str):
+    """Run one Exa search on the shared client"""
+    return await exa.search_and_contents(
+        query,
+        text=True,
+        num_results=SEARCH_NUM_RESULTS
+    )
+
+def _process_search_result(query: str, search_result) -> Tuple[Dict, int]:
+    """
+    Turn an Exa response into the per-query result dict.
+
+    Returns:
+        The result dict and the number of bytes of page content Exa sent
+    """
+    content = []
+    citations = []
+    source_bytes = 0
+    
+    if hasattr(search_result, 'results') and search_result.results:
+        for result in search_result.results:
+            if hasattr(result, 'title') and hasattr(result, 'url'):
+                text = result.text if hasattr(result, 'text') and result.text else ""
+                source_bytes += len(text.encode("utf-8"))
+                content_text = clean_text(text)[:SEARCH_SOURCE_CHARS]
+                
+                content.append({
+                    "title": result.title,
+                    "content": content_text,
+                    "url": result.url
+                })
+                
+                citations.append({
+                    "title": result.title,
+                    "url": result.url
+                })
+    
+    return {
+        "summary": f"Found information about '{query}' from {len(content)} sources.",
+        "search_results": content,
+        "citations": citations,
+        "result_count": len(content)
+    }, source_bytes
+
+async def _fetch_and_cache(exa, query: str, key: str) -> Dict:
+    """Search Exa for one query and cache the processed result"""
+    search_result = await _search_one(exa, query)
+    result, source_bytes = _process_search_result(query, search_result)
+    search_cache.set(key, result, source_bytes)
+    return result
+
+async def _search_with_timeout(exa, query: str, key: str) -> Dict:
+    """Search one query, giving up after the per-query timeout; identical in-flight searches are shared"""
+    return await search_flight.do(
+        key,
+        lambda: asyncio.wait_for(_fetch_and_cache(exa, query, key), timeout=WEB_SEARCH_QUERY_TIMEOUT_SECONDS)
+    )
+
+def _error_result(message: str, timed_out: bool = False) -> Dict:
+    """Per-query result for a search that failed or ran out of time"""
+    return {
+        "error": message,
+        "search_results": [],
+        "citations": [],
+        "result_count": 0,
+        "cached": False,
+        "stale": False,
+        "timed_out": timed_out
+    }
+
+def _completed_result(query: str, task: asyncio.Task) -> Dict:
+    """Per-query result for a finished search task"""
+    error = task.exception()
+    if isinstance(error, asyncio.TimeoutError):
+        return _error_result(f"Search for query '{query}' timed out after {WEB_SEARCH_QUERY_TIMEOUT_SECONDS}s", timed_out=True)
+    if error is not None:
+        # Handle individual query failures
+        return _error_result(f"Search failed for query '{query}': {str(error)}")
+    return {**task.result(), "cached": False, "stale": False, "timed_out": False}
+
+def _finish_background_search(task: asyncio.Task):
+    """Drop a finished background search, logging why it failed"""
+    _background_searches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Background web search failed: {task.exception()!r}")
+
+def _schedule_revalidation(exa, query: str, key: str):
+    """Refresh a stale cache entry in the background (at most one refresh per key)"""
+    if key in _revalidations:
+        return
+    
+    async def revalidate():
+        try:
+            await _search_with_timeout(exa, query, key)
+            logger.info(f"Revalidated cached web search for '{query}'")
+        except Exception as e:
+            logger.warning(f"Background revalidation failed for '{query}': {e}")
+        finally:
+            _revalidations.pop(key, None)
+    
+    _revalidations[key] = asyncio.create_task(revalidate())
 
 async def exa_search_async(queries: List[str]) -> Dict:
     """Use Deep Exa search engine for getting latest information from the web.
     
+    Results are served from the search cache when possible; stale entries are
+    returned immediately and refreshed in the background. Uncached searches
+    run concurrently and are collected as they complete, each bounded by
+    WEB_SEARCH_QUERY_TIMEOUT_SECONDS, and the whole call by
+    WEB_SEARCH_DEADLINE_SECONDS; queries that miss either limit come back
+    with timed_out set instead of holding up the others.
+    
+    Page text is cleaned of boilerplate before caching, and only the passages
+    most relevant to each query, without near-duplicates across queries, are
+    returned within WEB_SEARCH_TOKEN_BUDGET tokens.
+    
     Args:
         queries (List[str]): A list of queries that need to be searched.
     
@@ -25,83 +177,93 @@ async def exa_search_async(queries: List[str]) -> Dict:
     try:
         start_time = time.time()
         
-        # Initialize Exa client
-        exa = Exa(api_key=EXA_API_KEY)
+        # Shared client: connections are pooled and kept alive across calls
+        exa = get_exa_client()
         
-        # Create a list to store all search tasks
-        search_tasks = []
+        results = {}
+        misses = []
+        cache_hits = 0
+        bytes_saved = 0
+        for query in queries:
+            key = search_cache_key(query, SEARCH_PARAMS)
+            cached, state, saved = await search_cache.get_async(key)
+            if cached is None:
+                misses.append((query, key))
+                continue
+            cache_hits += 1
+            bytes_saved += saved
+            results[query] = {**cached, "cached": True, "stale": state == STALE, "timed_out": False}
+            if state == STALE:
+                _schedule_revalidation(exa, query, key)
+        
+        # Run all uncached searches concurrently and record each one as it
+        # completes; stragglers past the deadline are reported as timed out
+        pending = {
+            asyncio.create_task(_search_with_timeout(exa, query, key)): query
+            for query, key in misses
+        }
+        deadline = start_time + WEB_SEARCH_DEADLINE_SECONDS
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                query = pending.pop(task)
+                results[query] = _completed_result(query, task)
         
-        # Create a ThreadPoolExecutor for parallel requests
-        with ThreadPoolExecutor() as executor:
-            # Create a future for each query
-            loop = asyncio.get_event_loop()
-            for query in queries:
-                # Submit the search task to the executor
-                task = loop.run_in_executor(
-                    executor,
-                    lambda q=query: exa.search_and_contents(
-                        q,
-                        text=True,
-                        num_results=3,  # Top 3 results for each query
-                        use_autoprompt=True
-                    )
-                )
-                search_tasks.append((query, task))
-            
-            # Wait for all tasks to complete
-            results = {}
-            for query, task in search_tasks:
-                try:
-                    search_result = await task
-                    
-                    # Process the search results
-                    content = []
-                    citations = []
-                    
-                    if hasattr(search_result, 'results') and search_result.results:
-                        for result in search_result.results:
-                            if hasattr(result, 'title') and hasattr(result, 'url'):
-                                content_text = result.text[:1500] if hasattr(result, 'text') and result.text else "No content available"
-                                
-                                content.append({
-                                    "title": result.title,
-                                    "content": content_text,
-                                    "url": result.url
-                                })
-                                
-                                citations.append({
-                                    "title": result.title,
-                                    "url": result.url
-                                })
-                    
-                    # Store processed results for this query
-                    results[query] = {
-                        "summary": f"Found information about '{query}' from {len(content)} sources.",
-                        "search_results": content,
-                        "citations": citations,
-                        "result_count": len(content)
-                    }
-                except Exception as e:
-                    # Handle individual query failures
-                    results[query] = {
-                        "error": f"Search failed for query '{query}': {str(e)}",
-                        "search_results": [],
-                        "citations": [],
-                        "result_count": 0
-                    }
+        for task, query in pending.items():
+            # Let the search finish in the background so its result still
+            # reaches the cache; the per-query timeout bounds how long it runs
+            _background_searches.add(task)
+            task.add_done_callback(_finish_background_search)
+            results[query] = _error_result(f"Search for query '{query}' exceeded the {WEB_SEARCH_DEADLINE_SECONDS}s deadline", timed_out=True)
+        timed_out = sum(1 for result in results.values() if result.get("timed_out"))
+        
+        # Keep only the most relevant, non-duplicate passages within the token budget
+        selection = select_passages(
+            {query: result["search_results"] for query, result in results.items() if result["search_results"]},
+            WEB_SEARCH_TOKEN_BUDGET
+        )
+        for query, passages_by_url in selection["passages"].items():
+            kept = [
+                {**item, "content": "\n\n".join(passages_by_url[item["url"]])}
+                for item in results[query]["search_results"]
+                if item["url"] in passages_by_url
+            ]
+            # Cite only the sources whose content survived the budget
+            results[query] = {
+                **results[query],
+                "summary": f"Found information about '{query}' from {len(kept)} sources.",
+                "search_results": kept,
+                "citations": [{"title": item["title"], "url": item["url"]} for item in kept],
+                "result_count": len(kept)
+            }
         
         end_time = time.time()
         execution_time = end_time - start_time
+        cache_metrics = search_cache.metrics()
         
         # Create a structured response
         response = {
             "status": "success",
             "metadata": {
                 "query_count": len(queries),
-                "execution_time_seconds": round(execution_time, 2),
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+                "execution_time_seconds": round(execution_time, 4),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "timed_out_count": timed_out,
+                "deadline_exceeded": bool(pending),
+                "content_tokens": selection["tokens"],
+                "token_budget": WEB_SEARCH_TOKEN_BUDGET,
+                "duplicate_passages_removed": selection["duplicates_removed"],
+                "cache_hits": cache_hits,
+                "cache_hit_ratio": round(cache_hits / len(queries), 4) if queries else 0.0,
+                "bytes_saved": bytes_saved,
+                "cache_hit_ratio_total": cache_metrics["hit_ratio"],
+                "bytes_saved_total": cache_metrics["bytes_saved"],
+                "coalesced_searches_total": search_flight.stats["upstream_calls_saved"]
             },
-            "results": results
+            "results": {query: results[query] for query in queries}
         }
         
         return response
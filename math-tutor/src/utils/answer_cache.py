@@ -0,0 +1,317 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from utils.input_classifier import score_query, ON_TOPIC_THRESHOLD
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "604800"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+
+# LaTeX commands and Unicode symbols rewritten to one plain-text spelling
+LATEX_REPLACEMENTS = [
+    (r"\\left|\\right|\\displaystyle|\\limits|\\,|\\;|\\!|\\quad|\$", " "),
+    (r"\\(?:d|t)?frac\s*\{([^{}]*)\}\s*\{([^{}]*)\}", r"(\1)/(\2)"),
+    (r"\\sqrt\s*\{([^{}]*)\}", r"sqrt(\1)"),
+    (r"\\int", " integral "),
+    (r"\\(?:cdot|times)", "*"),
+    (r"\\pi", "pi"),
+    (r"\\infty", "infinity"),
+    (r"\\(arcsin|arccos|arctan|sinh|cosh|tanh|sin|cos|tan|cot|sec|csc|cosec|log|ln|exp)\b", r"\1"),
+    (r"\^\s*\{([^{}]*)\}", r"^(\1)"),
+    (r"_\s*\{([^{}]*)\}", r"_(\1)"),
+    (r"\*\*", "^"),
+]
+UNICODE_REPLACEMENTS = {
+    "∫": " integral ", "√": "sqrt", "π": "pi", "∞": "infinity", "×": "*", "·": "*", "−": "-", "÷": "/",
+    "¹": "^1", "²": "^2", "³": "^3", "⁴": "^4", "ⁿ": "^n", "ˣ": "^x", "θ": "theta",
+    **{chr(0x2080 + digit): f"_{digit}" for digit in range(10)},
+}
+# Politeness and imperative wording that does not change the problem. No single
+# letters: "a" is as likely to be a variable (x^a, 0 to a) as an article.
+FILLER_WORDS = re.compile(
+    r"\b(please|kindly|can|could|would|you|help|me|us|with|evaluate|find|compute|calculate|determine|solve|"
+    r"what|whats|is|are|the|value|of|an|this|given|question|problem)\b"
+)
+MATH_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z]+|[-+/^_()=<>|,]")  # "*" is left out: x*e^x and x e^x agree
+MATH_WORDS = {
+    "sin", "cos", "tan", "cot", "sec", "csc", "cosec", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh",
+    "log", "ln", "exp", "sqrt", "pi", "infinity", "theta",
+}
+# The operation asked for, so "integrate f" and "differentiate f" never share a fingerprint
+OPERATION_WORDS = {
+    "integral": "integral", "integrate": "integral", "integration": "integral", "antiderivative": "integral",
+    "primitive": "integral", "derivative": "derivative", "differentiate": "derivative",
+    "differentiation": "derivative", "lim": "limit", "limit": "limit", "area": "area",
+    "maximum": "extremum", "minimum": "extremum", "maxima": "extremum", "minima": "extremum",
+}
+
+# Queries that lean on earlier turns and so must never be answered from the cache
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(previous|earlier|above|last (one|problem|question|answer)|same (problem|question|method|integral)|"
+    r"that (problem|question|one|integral|step|answer)|this (step|answer|method)|again|"
+    r"another (way|method)|other method|explain (it|that|step)|why (did|is|do)|what about|you (said|used|did)|"
+    r"step \d+|continue|go on|more detail|elaborate)\b",
+    re.IGNORECASE
+)
+
+def normalize_math_query(query: str) -> str:
+    """
+    Canonical text of a math question.
+
+    Unifies LaTeX and Unicode notation, case and spacing, and drops wording
+    that does not change the problem ("please evaluate the ..."), so that
+    re-typed versions of the same question produce the same string.
+    """
+    # Superscripts first: NFKC would turn x² into x2
+    text = query
+    for symbol, replacement in UNICODE_REPLACEMENTS.items():
+        text = text.replace(symbol, replacement)
+    text = unicodedata.normalize("NFKC", text)
+    for pattern, replacement in LATEX_REPLACEMENTS:
+        text = re.sub(pattern, replacement, text)
+    text = text.lower()
+    text = re.sub(r"['’]s\b", "", text)
+    text = re.sub(r"[{}\[\]]", lambda match: "(" if match.group() in "{[" else ")", text)
+    text = re.sub(r"\bw\.?r\.?t\.?\b", "with respect to", text)
+    text = FILLER_WORDS.sub(" ", text)
+    text = re.sub(r"[?!.;:]+(\s|$)", " ", text)
+    # No spaces around operators or inside brackets, one before a differential; single spaces elsewhere
+    text = re.sub(r"\s*([-+*/^()=<>|,])\s*", r"\1", text)
+    # x^(2) -> x^2, keeping a space if a word follows: e^(2x)for must not become e^2xfor
+    text = re.sub(r"([\^_])\((\w+)\)(?=\w)", r"\1\2 ", text)
+    text = re.sub(r"([\^_])\((\w+)\)", r"\1\2", text)
+    text = re.sub(r"(?<=[\w)])\s*d([a-z])\b", r" d\1", text)
+    return " ".join(text.split())
+
+def math_fingerprint(normalized: str) -> Tuple[str, ...]:
+    """
+    Canonical form of the math in a normalized query.
+
+    The operations asked for (sorted, so "integrate" and "find the integral"
+    agree wherever they appear) followed by the numbers, variables,
+    functions and operators in the order they are written. Order is kept:
+    limits 0 to 1 and 1 to 0, or x^3 e^(2x) and x^2 e^(3x), use the same
+    tokens but are different problems. Ordinary words are left to the
+    embedding.
+    """
+    operations = set()
+    tokens = []
+    for token in MATH_TOKEN.findall(normalized):
+        if token in OPERATION_WORDS:
+            operations.add(OPERATION_WORDS[token])
+        elif not token.isalpha() or len(token) == 1 or token in MATH_WORDS or re.fullmatch(r"d[a-z]", token):
+            tokens.append(token)
+    return tuple(sorted(operations)) + tuple(tokens)
+
+def _has_math(fingerprint: Tuple[str, ...]) -> bool:
+    """Only questions with actual math (a number or variable) are matched by similarity"""
+    return any(token.isalnum() for token in fingerprint)
+
+def answer_cache_key(normalized: str) -> str:
+    """Exact-match key of a normalized query"""
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def is_follow_up(query: str, has_history: bool) -> bool:
+    """
+    Whether a query depends on earlier turns of the session.
+
+    Explicit references ("the previous problem", "explain step 2", ...) always
+    count; with history present, a query that is not a self-contained math
+    question ("and now with limits 0 to 1?") counts as well.
+    """
+    if FOLLOW_UP_PATTERN.search(query):
+        return True
+    return has_history and score_query(query)["score"] < ON_TOPIC_THRESHOLD
+
+class AnswerCache:
+    """
+    LRU cache of expert responses keyed by normalized question.
+
+    Lookups try the exact normalized key first. Otherwise the query embedding
+    is compared with the cached questions whose math fingerprint is exactly
+    the same, and the closest one is a hit if its cosine similarity reaches
+    the threshold. The fingerprint decides which problem it is (x^2 vs x^3,
+    limits 0 to 1 vs 1 to 0), which embeddings alone cannot; the embedding
+    only tolerates differences in the surrounding wording.
+    Vectors live in one preallocated matrix, one row per cache slot.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # key -> {"created_at", "fingerprint", "slot", "query", "response"}
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._by_fingerprint: Dict[Tuple[str, ...], set] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._free_slots: List[int] = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "stores": 0, "embedding_errors": 0}
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl_seconds <= 0 or (time.time() - created_at) < self.ttl_seconds
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        keys = self._by_fingerprint.get(entry["fingerprint"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_fingerprint[entry["fingerprint"]]
+        if entry["slot"] is not None:
+            self._free_slots.append(entry["slot"])
+
+    def _semantic_match(self, fingerprint: Tuple[str, ...], embedding: np.ndarray) -> Tuple[Optional[str], float]:
+        candidates = [key for key in self._by_fingerprint.get(fingerprint, ()) if self._entries[key]["slot"] is not None]
+        if not candidates:
+            return None, 0.0
+        slots = [self._entries[key]["slot"] for key in candidates]
+        similarities = self._vectors[slots] @ embedding
+        best = int(np.argmax(similarities))
+        return candidates[best], float(similarities[best])
+
+    def _hit(self, key: str) -> Optional[Dict]:
+        """Entry for key if present and fresh, refreshing its LRU position (lock held)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry["created_at"]):
+            self._drop(key)
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def lookup(self, query: str, embed: Callable[[str], Awaitable[List[float]]]) -> Dict:
+        """
+        Find a cached response for query.
+
+        Args:
+            query: The user's question
+            embed: Coroutine function returning an embedding for a text
+
+        Returns:
+            {"hit": bool, "match": "exact" | "semantic" | None, "similarity",
+             "response" (dict or None), "latency_ms", plus the normalized
+             query and its embedding for store()}
+        """
+        start_time = time.perf_counter()
+        normalized = normalize_math_query(query)
+        key = answer_cache_key(normalized)
+        result = {"hit": False, "match": None, "similarity": None, "response": None, "normalized": normalized, "key": key, "embedding": None}
+
+        with self._lock:
+            entry = self._hit(key)
+            if entry is not None:
+                self.stats["exact_hits"] += 1
+                result.update(hit=True, match="exact", similarity=1.0, response=entry["response"])
+            fingerprint = math_fingerprint(normalized)
+            has_candidates = _has_math(fingerprint) and bool(self._by_fingerprint.get(fingerprint))
+
+        # Only pay for an embedding when a cached question shares the fingerprint
+        if not result["hit"] and has_candidates:
+            try:
+                embedding = np.asarray(await embed(normalized), dtype=np.float32)
+                embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+                result["embedding"] = embedding
+                with self._lock:
+                    match_key, similarity = self._semantic_match(fingerprint, embedding)
+                    entry = self._hit(match_key) if match_key and similarity >= self.similarity_threshold else None
+                    result["similarity"] = round(similarity, 4) if match_key else None
+                    if entry is not None:
+                        self.stats["semantic_hits"] += 1
+                        result.update(hit=True, match="semantic", response=entry["response"])
+            except Exception as e:
+                logger.warning(f"Answer cache embedding failed, exact lookup only: {e}")
+                self.stats["embedding_errors"] += 1
+
+        if not result["hit"]:
+            with self._lock:
+                self.stats["misses"] += 1
+        result["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+        return result
+
+    async def store(self, lookup: Dict, query: str, response: Dict, embed: Callable[[str], Awaitable[List[float]]]):
+        """
+        Cache a response under the normalized query from a previous lookup().
+
+        The embedding from the lookup is reused when there was one; questions
+        without math are stored for exact matches only.
+        """
+        key = lookup["key"]
+        fingerprint = math_fingerprint(lookup["normalized"])
+        embedding = lookup.get("embedding")
+        if embedding is None and _has_math(fingerprint):
+            try:
+                embedding = np.asarray(await embed(lookup["normalized"]), dtype=np.float32)
+                embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+            except Exception as e:
+                logger.warning(f"Answer cache embedding failed, storing for exact matches only: {e}")
+                self.stats["embedding_errors"] += 1
+                embedding = None
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+            slot = None
+            if embedding is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+                slot = self._free_slots.pop()
+                self._vectors[slot] = embedding
+
+            self._entries[key] = {
+                "created_at": time.time(),
+                "fingerprint": fingerprint,
+                "slot": slot,
+                "query": query,
+                "response": response,
+            }
+            if _has_math(fingerprint):
+                self._by_fingerprint.setdefault(fingerprint, set()).add(key)
+            self.stats["stores"] += 1
+
+    def metrics(self) -> Dict:
+        """Hit/miss counters and the current size"""
+        with self._lock:
+            hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hits": hits,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
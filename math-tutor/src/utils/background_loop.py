@@ -0,0 +1,143 @@
+import atexit
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class BackgroundLoop:
+    """
+    One long-lived asyncio event loop running in a daemon thread.
+
+    Sync code (Streamlit reruns, worker threads) hands coroutines to it
+    through submit() / run() / iterate() instead of creating its own loops,
+    so loop-bound resources (the asyncpg pool, the Exa and Anthropic HTTP
+    clients) are created once and shared by every caller for the life of
+    the process.
+    """
+
+    def __init__(self, name: str = "async-background-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running loop, started on first use"""
+        if self._loop is None or self._loop.is_closed():
+            with self._lock:
+                if self._loop is None or self._loop.is_closed():
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        started.wait()
+        self._loop = loop
+        logger.info(f"Started background event loop thread {self.name}")
+
+    def in_loop_thread(self) -> bool:
+        """Whether the caller is running on the background loop's own thread"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine on the loop from any thread; returns a thread-safe future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """
+        Run a coroutine on the loop and block the calling thread for its result.
+
+        Args:
+            coro: The coroutine to run
+            timeout: Seconds to wait before cancelling it and raising TimeoutError
+
+        Returns:
+            The coroutine's result (its exception is re-raised in the caller)
+        """
+        if self.in_loop_thread():
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise RuntimeError("BackgroundLoop.run() called from the loop's own thread; await the coroutine instead")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Timed out, or the caller is going away (e.g. a Streamlit rerun
+            # interrupted it); do not leave the work running on the loop
+            future.cancel()
+            raise
+
+    def iterate(self, async_iterator: AsyncIterator[T], timeout: Optional[float] = None) -> Iterator[T]:
+        """Step an async generator on the loop from sync code, one item at a time"""
+        try:
+            while True:
+                try:
+                    yield self.run(async_iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            aclose = getattr(async_iterator, "aclose", None)
+            if aclose is not None:
+                try:
+                    self.run(aclose())
+                except Exception as e:
+                    # A step cancelled mid-flight can leave the generator still running for a moment
+                    logger.debug(f"Could not close async iterator: {e}")
+
+    def stop(self, timeout: float = 5.0):
+        """Cancel outstanding tasks, stop the loop and join its thread"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        loop = self._loop
+
+        async def cancel_tasks():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_tasks(), loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"Background loop tasks did not finish cancelling: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            loop.close()
+
+_background_loop: Optional[BackgroundLoop] = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop() -> BackgroundLoop:
+    """The process-wide background loop, created on first use"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = BackgroundLoop()
+                atexit.register(_background_loop.stop)
+    return _background_loop
+
+def run_in_background(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the process-wide background loop and wait for its result"""
+    return get_background_loop().run(coro, timeout)
+
+def submit_to_background(coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+    """Schedule a coroutine on the process-wide background loop without waiting"""
+    return get_background_loop().submit(coro)
@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, TextIO, Union
+from dotenv import load_dotenv
+
+# Add src to path so the shared utils package resolves when run as a script
+src_path = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(src_path))
+
+from utils.image_to_text import get_text_from_image_async
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+PROBLEM_SEPARATOR = "---"
+WORKSHEET_PROMPT = (
+    "The image is a math worksheet that may contain several questions. Extract every question "
+    "along with its options if present, keeping the original question numbers. Put a line containing "
+    f"only {PROBLEM_SEPARATOR} between consecutive questions. Never answer the questions. You are "
+    "providing an OCR service, so only extract the questions and options."
+)
+
+# A new problem starts at a line like "1.", "2)", "Q3)", "Q.4" or "Question 5:". Parenthesized
+# numbers such as "(1)" are option labels and never start a problem.
+PROBLEM_START_PATTERN = re.compile(
+    r"^\s*(?:Q(?:uestion)?\.?\s*(\d{1,3})[.):]?|(\d{1,3})[.)])\s",
+    re.IGNORECASE | re.MULTILINE
+)
+
+def iter_image_paths(inputs: Iterable[Union[str, Path]]) -> List[Path]:
+    """Expand files and directories into a sorted list of image paths"""
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS))
+        elif path.suffix.lower() in IMAGE_EXTENSIONS:
+            paths.append(path)
+        else:
+            logger.warning(f"Skipping {path}: not an image or directory")
+    return paths
+
+def split_problems(text: str) -> List[str]:
+    """
+    Split the text extracted from one page into separate problems.
+
+    Uses the separator lines the worksheet prompt asks for, and falls back to
+    splitting at numbered question starts when the model did not add them.
+    Only starts whose numbers increase are used, so a numbered list inside a
+    question (e.g. options "1) ... 2) ...") stays with that question.
+    """
+    parts = [part.strip() for part in re.split(rf"^\s*{re.escape(PROBLEM_SEPARATOR)}\s*$", text, flags=re.MULTILINE)]
+    parts = [part for part in parts if part]
+    if len(parts) > 1:
+        return parts
+
+    starts = []
+    last_number = 0
+    for match in PROBLEM_START_PATTERN.finditer(text):
+        number = int(match.group(1) or match.group(2))
+        if number > last_number:
+            starts.append(match.start())
+            last_number = number
+    if len(starts) < 2:
+        return [text.strip()] if text.strip() else []
+    if starts[0] > 0 and text[:starts[0]].strip():
+        # Text before the first number (a sheet heading or instructions) stays with the first problem
+        starts[0] = 0
+    bounds = starts + [len(text)]
+    return [text[bounds[i]:bounds[i + 1]].strip() for i in range(len(starts)) if text[bounds[i]:bounds[i + 1]].strip()]
+
+async def _ocr_page(path: Path, semaphore: asyncio.Semaphore) -> List[Dict]:
+    """OCR one page under the concurrency limit and turn it into JSONL records"""
+    async with semaphore:
+        start_time = time.perf_counter()
+        text = await get_text_from_image_async(str(path), prompt=WORKSHEET_PROMPT)
+        latency_ms = round((time.perf_counter() - start_time) * 1000, 1)
+
+    if text.startswith("Error:"):
+        return [{"type": "error", "source": str(path), "error": text, "latency_ms": latency_ms}]
+
+    problems = split_problems(text)
+    return [
+        {
+            "type": "problem",
+            "problem_id": f"{path.name}#{index}",
+            "source": str(path),
+            "index": index,
+            "problems_on_page": len(problems),
+            "text": problem,
+            "latency_ms": latency_ms,
+        }
+        for index, problem in enumerate(problems, 1)
+    ]
+
+async def ocr_batch(inputs: Iterable[Union[str, Path]], concurrency: int = OCR_BATCH_CONCURRENCY) -> AsyncIterator[Dict]:
+    """
+    OCR many worksheet images concurrently, yielding problems as pages finish.
+
+    Args:
+        inputs: Image files and/or directories of images
+        concurrency: Maximum number of OCR requests in flight
+
+    Yields:
+        One record per extracted problem ({"type": "problem", ...}) or per
+        failed page ({"type": "error", ...}), in completion order
+    """
+    paths = iter_image_paths(inputs)
+    logger.info(f"Batch OCR of {len(paths)} images with concurrency {concurrency}")
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [asyncio.create_task(_ocr_page(path, semaphore)) for path in paths]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for record in await next_done:
+                yield record
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def write_jsonl(record: Dict, out: TextIO):
+    """Write one record as a JSON line and flush so consumers see it immediately"""
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+async def run_batch(inputs: List[str], out: TextIO, concurrency: int, solve: bool, solve_concurrency: int) -> Dict:
+    """Stream OCR records (and, with solve, the expert's solutions) to out as JSONL"""
+    counts = {"problems": 0, "errors": 0, "solutions": 0}
+    start_time = time.perf_counter()
+
+    if not solve:
+        async for record in ocr_batch(inputs, concurrency):
+            write_jsonl(record, out)
+            counts["problems" if record["type"] == "problem" else "errors"] += 1
+    else:
+        from agent import JEECalculusExpertWithMemory
+
+        expert = JEECalculusExpertWithMemory()
+        expert.create_agent()
+        problem_ids = {}
+
+        async def problems():
+            # Each problem is solved as soon as it is extracted
+            async for record in ocr_batch(inputs, concurrency):
+                write_jsonl(record, out)
+                if record["type"] == "problem":
+                    counts["problems"] += 1
+                    problem_ids[counts["problems"] - 1] = record["problem_id"]
+                    yield record["text"]
+                else:
+                    counts["errors"] += 1
+
+        async for index, result in expert.solve_batch(problems(), concurrency=solve_concurrency, user_id="batch_ocr"):
+            write_jsonl({
+                "type": "solution",
+                "problem_id": problem_ids.get(index),
+                "success": result.get("success", False),
+                "response": result.get("response"),
+                "error": result.get("error"),
+            }, out)
+            counts["solutions"] += 1
+
+    counts["elapsed_seconds"] = round(time.perf_counter() - start_time, 2)
+    return counts
+
+async def main(args):
+    """Run the batch and release shared connections"""
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        counts = await run_batch(args.inputs, out, args.concurrency, args.solve, args.solve_concurrency)
+        logger.info(f"Batch OCR finished: {counts}")
+    finally:
+        if args.output:
+            out.close()
+        if args.solve:
+            from utils.search_client import close_search_client
+            from utils.db_pool import close_pool
+            await close_search_client()
+            await close_pool()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+
+    parser = argparse.ArgumentParser(description="Extract problems from worksheet images as JSONL, optionally solving them")
+    parser.add_argument("inputs", nargs="+", help="Image files and/or directories of images")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=OCR_BATCH_CONCURRENCY, help="Concurrent OCR requests")
+    parser.add_argument("--solve", action="store_true", help="Send each extracted problem to the expert agent")
+    parser.add_argument("--solve-concurrency", type=int, default=2, help="Problems solved concurrently with --solve")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
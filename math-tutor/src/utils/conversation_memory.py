@@ -0,0 +1,115 @@
+import os
+import re
+import logging
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from utils.tokens import count_tokens, truncate_to_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "400"))
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "4"))
+MAX_PROBLEM_TOKENS = 80  # A long pasted problem is cut before it is stored
+MAX_ANSWER_TOKENS = 60
+MAX_FORMULAS_PER_TURN = 3
+MAX_EARLIER_ITEMS = 8  # Topics / formulas kept from turns that have rolled out of the recent window
+
+NO_CONTEXT = "No previous conversation in this session."
+
+# Lines that usually state the result of a worked solution
+ANSWER_PATTERN = re.compile(r"\b(final answer|answer|therefore|hence|thus)\b|∴|\\boxed", re.IGNORECASE)
+
+def new_memory() -> Dict:
+    """Empty per-session memory; plain JSON so every session store can persist it"""
+    return {"turn_count": 0, "recent": [], "earlier_topics": [], "earlier_formulas": []}
+
+def extract_final_answer(solution: str) -> str:
+    """
+    Pull the final answer out of a step-by-step solution.
+
+    Takes the last line that announces a result ("Answer", "Therefore", "∴",
+    ...), falling back to the last line containing an equals sign and then
+    to the last non-empty line.
+    """
+    lines = [line.strip(" -*#\t") for line in solution.splitlines() if line.strip(" -*#\t")]
+    if not lines:
+        return ""
+    for predicate in (ANSWER_PATTERN.search, lambda line: "=" in line):
+        for line in reversed(lines):
+            if predicate(line):
+                return truncate_to_tokens(line, MAX_ANSWER_TOKENS, "...")
+    return truncate_to_tokens(lines[-1], MAX_ANSWER_TOKENS, "...")
+
+def summarize_turn(query: str, response: Any) -> Dict:
+    """Compact, structured record of one exchange (problem, key formulas, final answer, topics)"""
+    return {
+        "problem": truncate_to_tokens(" ".join(query.split()), MAX_PROBLEM_TOKENS, "..."),
+        "formulas": list(response.key_formulas_used[:MAX_FORMULAS_PER_TURN]),
+        "answer": extract_final_answer(response.step_by_step_solution),
+        "topics": list(response.related_jee_topics[:MAX_FORMULAS_PER_TURN]),
+    }
+
+def _merge_recent_first(existing: List[str], new_items: List[str]) -> List[str]:
+    merged = list(dict.fromkeys(new_items + [item for item in existing if item not in new_items]))
+    return merged[:MAX_EARLIER_ITEMS]
+
+def update_memory(memory: Dict, query: str, response: Any) -> Dict:
+    """
+    Add one exchange to a session's memory in place.
+
+    The newest CONVERSATION_RECENT_TURNS exchanges are kept in full; older
+    ones are folded into short lists of earlier topics and formulas, so the
+    memory stays the same size however long the conversation runs.
+    """
+    memory["turn_count"] += 1
+    memory["recent"].append({"turn": memory["turn_count"], **summarize_turn(query, response)})
+    while len(memory["recent"]) > CONVERSATION_RECENT_TURNS:
+        oldest = memory["recent"].pop(0)
+        memory["earlier_topics"] = _merge_recent_first(memory["earlier_topics"], oldest["topics"])
+        memory["earlier_formulas"] = _merge_recent_first(memory["earlier_formulas"], oldest["formulas"])
+    return memory
+
+def _render_turn(turn: Dict) -> str:
+    lines = [f"TURN {turn['turn']} PROBLEM: {turn['problem']}"]
+    if turn["formulas"]:
+        lines.append(f"  Key formulas: {'; '.join(turn['formulas'])}")
+    if turn["answer"]:
+        lines.append(f"  Final answer: {turn['answer']}")
+    return "\n".join(lines)
+
+def build_context(memory: Dict, token_budget: int = CONVERSATION_CONTEXT_TOKENS) -> str:
+    """
+    Render a session's memory as prompt context within token_budget tokens.
+
+    The newest turns are added first and kept whole where possible; the
+    oldest turn that only partly fits is truncated, and the earlier-topics
+    line is included only if there is room left.
+    """
+    if not memory or not memory["turn_count"]:
+        return NO_CONTEXT
+
+    header = "CONVERSATION HISTORY (most recent last):"
+    remaining = token_budget - count_tokens(header)
+    blocks: List[str] = []
+    for turn in reversed(memory["recent"]):
+        block = _render_turn(turn)
+        tokens = count_tokens(block) + 1
+        if tokens > remaining:
+            if not blocks and remaining > 0:
+                # Always keep at least the latest turn, cut to fit
+                blocks.append(truncate_to_tokens(block, remaining - 1, "..."))
+            break
+        blocks.append(block)
+        remaining -= tokens
+
+    if memory["earlier_topics"] or memory["earlier_formulas"]:
+        earlier = f"EARLIER IN THIS SESSION: topics {', '.join(memory['earlier_topics']) or 'n/a'}; formulas {'; '.join(memory['earlier_formulas']) or 'n/a'}"
+        if count_tokens(earlier) + 1 <= remaining:
+            blocks.append(earlier)
+
+    return "\n".join([header] + list(reversed(blocks)))
@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+import asyncpg
+from dotenv import load_dotenv
+from utils.vector_codec import register_vector_codec
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Process-wide pool state. The pool is bound to the event loop that created it,
+# so it is rebuilt if it is requested from a different loop.
+_pool: Optional[asyncpg.Pool] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+# One creation lock per event loop, so concurrent first callers on a loop
+# wait for the same pool instead of each creating one
+_pool_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+# Statements prepared on every new connection: list of (sql, warmup_args)
+_prepared_statements: List[Tuple[str, tuple]] = []
+
+# Session settings (e.g. ivfflat.probes) persisted in the db_session_settings
+# table. They are read when a connection opens and re-applied after the
+# RESET ALL that the pool runs on release.
+SESSION_SETTINGS_TABLE = "db_session_settings"
+_session_settings: Dict[str, str] = {}
+
+_metrics = {
+    "acquisitions": 0,
+    "acquire_failures": 0,
+    "in_use": 0,
+    "max_in_use": 0,
+    "total_wait_ms": 0.0,
+    "max_wait_ms": 0.0,
+    "health_checks": 0,
+    "health_check_failures": 0,
+}
+
+def register_statement(sql: str, *warmup_args):
+    """
+    Register a statement to be prepared on every pooled connection.
+
+    asyncpg caches prepared statements per connection, so the statement is
+    executed once with the warmup arguments when a connection is opened and
+    every later call with the same SQL text skips parse/plan.
+
+    Args:
+        sql: The SQL text, exactly as it will be passed to fetch/execute
+        warmup_args: Arguments used for the warmup execution (use LIMIT 0 style args)
+    """
+    if not any(existing_sql == sql for existing_sql, _ in _prepared_statements):
+        _prepared_statements.append((sql, warmup_args))
+
+def _session_settings_sql() -> str:
+    """SET statements for the current session settings"""
+    return "".join(
+        f"SET {name} TO '{value.replace(chr(39), chr(39) * 2)}';"
+        for name, value in _session_settings.items()
+    )
+
+async def _load_session_settings(conn: asyncpg.Connection):
+    """Refresh session settings from the database and apply them to this connection"""
+    try:
+        rows = await conn.fetch(f"SELECT name, value FROM {SESSION_SETTINGS_TABLE};")
+    except asyncpg.UndefinedTableError:
+        return
+    _session_settings.clear()
+    _session_settings.update({row['name']: row['value'] for row in rows})
+    if _session_settings:
+        await conn.execute(_session_settings_sql())
+
+async def _reset_connection(conn: asyncpg.Connection):
+    """Default pool reset, then restore the persisted session settings"""
+    await conn.execute(conn.get_reset_query() + _session_settings_sql())
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Register the binary vector codec, apply session settings and prepare registered statements on a fresh connection"""
+    await register_vector_codec(conn)
+    await _load_session_settings(conn)
+
+    for sql, warmup_args in _prepared_statements:
+        try:
+            await conn.fetch(sql, *warmup_args)
+        except Exception as e:
+            # The schema may not exist yet (e.g. while prepare_db creates it)
+            logger.debug(f"Skipping statement warmup: {e}")
+
+async def _create_pool() -> asyncpg.Pool:
+    """Create the connection pool and open its minimum number of connections"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL not found in environment variables")
+
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_IDLE_SECONDS,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        init=_init_connection,
+        reset=_reset_connection,
+    )
+    logger.info(f"Database pool created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    return pool
+
+async def get_pool() -> asyncpg.Pool:
+    """Get the process-wide connection pool, creating and warming it on first use"""
+    global _pool, _pool_loop
+
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool_loop is loop and not _pool.is_closing():
+        return _pool
+
+    # Looked up or created without an await in between, so every caller on this loop shares it
+    pool_lock = _pool_locks.get(loop)
+    if pool_lock is None:
+        pool_lock = _pool_locks[loop] = asyncio.Lock()
+
+    async with pool_lock:
+        if _pool is not None and _pool_loop is loop and not _pool.is_closing():
+            return _pool
+
+        if _pool is not None and _pool_loop is not loop:
+            # The old loop owns those connections; they cannot be reused here
+            logger.warning("Event loop changed, discarding database pool")
+            _pool.terminate()
+
+        _pool = await _create_pool()
+        _pool_loop = loop
+        await health_check()
+
+    return _pool
+
+@asynccontextmanager
+async def acquire():
+    """Acquire a pooled connection, recording wait time and in-use counts"""
+    pool = await get_pool()
+
+    start_time = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except Exception:
+        _metrics["acquire_failures"] += 1
+        raise
+    wait_ms = (time.perf_counter() - start_time) * 1000
+
+    _metrics["acquisitions"] += 1
+    _metrics["total_wait_ms"] += wait_ms
+    _metrics["max_wait_ms"] = max(_metrics["max_wait_ms"], wait_ms)
+    _metrics["in_use"] += 1
+    _metrics["max_in_use"] = max(_metrics["max_in_use"], _metrics["in_use"])
+
+    try:
+        yield conn
+    finally:
+        _metrics["in_use"] -= 1
+        await pool.release(conn)
+
+async def expire_connections():
+    """Replace every pooled connection on next release (e.g. after CREATE EXTENSION)"""
+    pool = await get_pool()
+    await pool.expire_connections()
+
+async def save_session_settings(settings: Dict[str, str]):
+    """Persist session settings and recycle pooled connections so they pick them up"""
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {SESSION_SETTINGS_TABLE} (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            await conn.executemany(
+                f"""
+                INSERT INTO {SESSION_SETTINGS_TABLE} (name, value) VALUES ($1, $2)
+                ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;
+                """,
+                [(name, str(value)) for name, value in settings.items()]
+            )
+    _session_settings.update({name: str(value) for name, value in settings.items()})
+    await expire_connections()
+
+async def health_check() -> bool:
+    """Run a trivial query on a pooled connection to verify the database is reachable"""
+    _metrics["health_checks"] += 1
+    try:
+        async with acquire() as conn:
+            await conn.fetchval("SELECT 1;")
+        return True
+    except Exception as e:
+        _metrics["health_check_failures"] += 1
+        logger.error(f"Database health check failed: {e}")
+        return False
+
+def pool_metrics() -> Dict:
+    """Return pool wait time and connection usage metrics"""
+    acquisitions = _metrics["acquisitions"]
+    return {
+        "pool_size": _pool.get_size() if _pool is not None else 0,
+        "idle_connections": _pool.get_idle_size() if _pool is not None else 0,
+        "max_size": DB_POOL_MAX_SIZE,
+        "in_use": _metrics["in_use"],
+        "max_in_use": _metrics["max_in_use"],
+        "acquisitions": acquisitions,
+        "acquire_failures": _metrics["acquire_failures"],
+        "avg_wait_ms": round(_metrics["total_wait_ms"] / acquisitions, 3) if acquisitions else 0.0,
+        "max_wait_ms": round(_metrics["max_wait_ms"], 3),
+        "health_checks": _metrics["health_checks"],
+        "health_check_failures": _metrics["health_check_failures"],
+    }
+
+async def close_pool():
+    """Close the process-wide pool"""
+    global _pool, _pool_loop
+    if _pool is not None:
+        await _pool.close()
+        logger.info("Database pool closed")
+    _pool = None
+    _pool_loop = None
@@ -0,0 +1,260 @@
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def pack_vector(vector: List[float]) -> bytes:
+    """Pack a vector as contiguous float32 bytes"""
+    return array("f", vector).tobytes()
+
+def unpack_vector(data: bytes) -> List[float]:
+    """Unpack float32 bytes back into a list of floats"""
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """Content-hash key for a text embedded with the given model (whitespace-insensitive)"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{model}\x00{normalized}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embedding vectors.
+
+    The memory tier is an LRU bounded by entry count with a TTL per entry.
+    The optional disk tier is a SQLite file that survives restarts; vectors
+    are stored as packed float32 blobs and promoted to memory on a hit.
+
+    Async callers use get_async() / get_many_async(), which read the disk
+    tier on a worker thread. Disk writes are write-behind: set() only queues
+    the vector, and a background thread writes queued vectors in one
+    transaction every flush_seconds, so no caller waits on SQLite I/O.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400,
+        disk_path: Optional[str] = None,
+        flush_seconds: float = 1.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.flush_seconds = flush_seconds
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[float, bytes]] = {}  # Written to memory, not yet to disk
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "disk_writes": 0,
+            "disk_write_errors": 0,
+        }
+
+        if disk_path:
+            try:
+                self._db = sqlite3.connect(disk_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL;")
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        key TEXT PRIMARY KEY,
+                        created_at REAL NOT NULL,
+                        vector BLOB NOT NULL
+                    );
+                """)
+                self._db.commit()
+                logger.info(f"Embedding disk cache enabled at {disk_path}")
+            except Exception as e:
+                logger.error(f"Could not open embedding disk cache {disk_path}: {e}")
+                self._db = None
+
+        if self._db is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="embedding-cache-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl_seconds <= 0 or (time.time() - created_at) < self.ttl_seconds
+
+    def _remember(self, key: str, created_at: float, packed: bytes):
+        self._memory[key] = (created_at, packed)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        """Memory tier lookup (also sees vectors still waiting to be written to disk)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, packed = entry
+                if self._is_fresh(created_at):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return unpack_vector(packed)
+                del self._memory[key]
+                self.stats["expired"] += 1
+            entry = self._pending.get(key)
+            if entry is not None and self._is_fresh(entry[0]):
+                self._remember(key, *entry)
+                self.stats["memory_hits"] += 1
+                return unpack_vector(entry[1])
+            return None
+
+    def _get_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Disk tier lookup of many keys in one query; fresh rows are promoted to memory"""
+        rows = []
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    # Stay well under SQLite's limit on bound parameters
+                    for start in range(0, len(keys), 500):
+                        batch = keys[start:start + 500]
+                        placeholders = ", ".join("?" for _ in batch)
+                        rows += self._db.execute(
+                            f"SELECT key, created_at, vector FROM embeddings WHERE key IN ({placeholders});", batch
+                        ).fetchall()
+            except Exception as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+
+        found = {}
+        with self._lock:
+            for key, created_at, packed in rows:
+                if self._is_fresh(created_at):
+                    self._remember(key, created_at, packed)
+                    self.stats["disk_hits"] += 1
+                    found[key] = unpack_vector(packed)
+                else:
+                    self.stats["expired"] += 1
+            self.stats["misses"] += len(set(keys) - found.keys())
+        return found
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Look up a vector, checking memory first and then disk (blocks on disk reads; see get_async)"""
+        vector = self._get_memory(key)
+        if vector is not None:
+            return vector
+        return self._get_disk([key]).get(key)
+
+    async def get_async(self, key: str) -> Optional[List[float]]:
+        """Look up a vector without blocking the event loop; disk reads run on a worker thread"""
+        vector = self._get_memory(key)
+        if vector is not None:
+            return vector
+        if self._db is None:
+            return self._get_disk([key]).get(key)  # Nothing to read; only counts the miss
+        return (await asyncio.to_thread(self._get_disk, [key])).get(key)
+
+    async def get_many_async(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up many vectors without blocking the event loop.
+
+        Memory misses are read from disk in one query on a worker thread.
+
+        Returns:
+            Vectors in the order of keys (None for misses)
+        """
+        vectors = [self._get_memory(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        if not missing:
+            return vectors
+        if self._db is None:
+            found = self._get_disk(missing)
+        else:
+            found = await asyncio.to_thread(self._get_disk, missing)
+        return [vector if vector is not None else found.get(key) for key, vector in zip(keys, vectors)]
+
+    def set(self, key: str, vector: List[float]):
+        """Store a vector in memory and, if enabled, queue it for the disk tier"""
+        packed = pack_vector(vector)
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, packed)
+            if self._db is not None:
+                self._pending[key] = (created_at, packed)
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every queued vector to disk in one transaction; returns the number written"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+        rows = [(key, created_at, packed) for key, (created_at, packed) in pending.items()]
+
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, created_at, vector) VALUES (?, ?, ?);", rows
+                )
+                self._db.commit()
+            except Exception as e:
+                logger.warning(f"Embedding disk cache write of {len(rows)} vectors failed: {e}")
+                with self._lock:
+                    self.stats["disk_write_errors"] += 1
+                    # Keep them for the next flush unless a newer vector is already queued
+                    for key, entry in pending.items():
+                        self._pending.setdefault(key, entry)
+                return 0
+        with self._lock:
+            self.stats["disk_writes"] += len(rows)
+        return len(rows)
+
+    def close(self):
+        """Write queued vectors and close the disk tier"""
+        if self._db is None or self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def metrics(self) -> Dict:
+        """Return hit/miss counters and the current memory tier size"""
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hits": hits,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "pending_disk_writes": len(self._pending),
+                "disk_enabled": self._db is not None,
+            }
+
+    def clear(self):
+        """Drop every cached vector from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._pending.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM embeddings;")
+                self._db.commit()
@@ -0,0 +1,128 @@
+import os
+import logging
+from typing import List, Dict, Optional
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from utils.embedding_cache import EmbeddingCache, embedding_cache_key
+from utils.single_flight import SingleFlight
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "604800"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # SQLite file; unset disables the disk tier
+
+# Initialize OpenAI client
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# Upstream usage counters (cache hits cost nothing and are not counted)
+embedding_usage = {
+    "api_calls": 0,
+    "texts_embedded": 0,
+    "prompt_tokens": 0,
+}
+
+# Coalesces concurrent identical embedding requests
+embedding_flight = SingleFlight("embeddings")
+
+# Process-wide embedding cache
+embedding_cache = EmbeddingCache(
+    max_entries=EMBEDDING_CACHE_SIZE,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    disk_path=EMBEDDING_CACHE_PATH,
+)
+
+async def generate_embedding(text: str) -> List[float]:
+    """Generate embedding for given text using OpenAI, served from the cache when possible"""
+    key = embedding_cache_key(EMBEDDING_MODEL, text)
+    cached = await embedding_cache.get_async(key)
+    if cached is not None:
+        return cached
+
+    # Concurrent requests for the same text share one API call. Keys are
+    # prefixed by call kind: a batch of one has the same cache key but
+    # returns a list of vectors
+    return await embedding_flight.do(f"one:{key}", lambda: _embed_one(key, text))
+
+async def _embed_one(key: str, text: str) -> List[float]:
+    """Embed one text upstream and cache it"""
+    try:
+        response = await client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=text
+        )
+        embedding = response.data[0].embedding
+    except Exception as e:
+        logger.error(f"Error generating embedding: {e}")
+        raise
+
+    _record_usage(response, 1)
+    embedding_cache.set(key, embedding)
+    return embedding
+
+async def generate_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Generate embeddings for many texts with a single embeddings request.
+
+    Cached texts are served locally; only the misses are sent upstream, and
+    concurrent calls with the same misses share one request.
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        Embeddings in the same order as the input texts
+    """
+    keys = [embedding_cache_key(EMBEDDING_MODEL, text) for text in texts]
+    embeddings: List[Optional[List[float]]] = await embedding_cache.get_many_async(keys)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if missing:
+        missing_keys = [keys[i] for i in missing]
+        missing_texts = [texts[i] for i in missing]
+        fresh = await embedding_flight.do(
+            "many:" + "\x00".join(missing_keys),
+            lambda: _embed_many(missing_keys, missing_texts)
+        )
+        for i, embedding in zip(missing, fresh):
+            embeddings[i] = embedding
+
+    return embeddings
+
+async def _embed_many(keys: List[str], texts: List[str]) -> List[List[float]]:
+    """Embed texts upstream in one request and cache them"""
+    try:
+        response = await client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts
+        )
+    except Exception as e:
+        logger.error(f"Error generating {len(texts)} embeddings: {e}")
+        raise
+
+    _record_usage(response, len(texts))
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    for item in response.data:
+        embeddings[item.index] = item.embedding
+        embedding_cache.set(keys[item.index], item.embedding)
+    return embeddings
+
+def _record_usage(response, text_count: int):
+    """Accumulate upstream call and token counters from an embeddings response"""
+    embedding_usage["api_calls"] += 1
+    embedding_usage["texts_embedded"] += text_count
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        embedding_usage["prompt_tokens"] += usage.prompt_tokens or 0
+
+def embedding_cache_metrics() -> Dict:
+    """Return hit/miss counters for the embedding cache"""
+    return embedding_cache.metrics()
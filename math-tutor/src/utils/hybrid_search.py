@@ -0,0 +1,113 @@
+import re
+import math
+from collections import Counter
+from typing import List, Dict, Tuple, Iterable
+
+# Constants
+RRF_K = 60  # Standard reciprocal rank fusion constant
+
+# Section numbers (7.6.2) stay whole, words are lowercased, and non-ASCII
+# math symbols (∫, √, π, ·) are kept as their own tokens; ASCII punctuation is dropped.
+TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)+|\w+|[^\w\s\x00-\x7f]")
+SECTION_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)+")
+
+def tokenize(text: str) -> List[str]:
+    """Tokenize text for lexical matching"""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+def row_key(row: Dict) -> Tuple[str, int]:
+    """Identity of a retrieved chunk"""
+    return row['content_id'], row.get('chunk_index', 0)
+
+def lexical_document(row: Dict) -> str:
+    """Text indexed for lexical search: section, sub-headings, notes and chunk content"""
+    return " ".join([
+        row.get('content_id', ''),
+        row.get('section', '') or '',
+        row.get('sub_heading', '') or '',
+        " ".join(row.get('sub_headings') or []),
+        " ".join(row.get('notes') or []),
+        row.get('content', '') or '',
+    ])
+
+class BM25Index:
+    """Okapi BM25 over a small in-memory corpus of chunk rows"""
+
+    def __init__(self, rows: List[Dict], k1: float = 1.5, b: float = 0.75):
+        self.rows = rows
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(lexical_document(row))) for row in rows]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+        total = len(rows)
+        self.idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        """Return up to limit rows with a positive BM25 score, best first"""
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        if not terms:
+            return []
+
+        scored = []
+        for index, counts in enumerate(self.term_counts):
+            score = 0.0
+            length_norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.average_length or 1))
+            for term in terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + length_norm)
+            if score > 0:
+                scored.append((score, index))
+
+        scored.sort(reverse=True)
+        return [{**self.rows[index], "lexical_score": score} for score, index in scored[:limit]]
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """
+    Fuse ranked result lists with reciprocal rank fusion.
+
+    Rows are matched by (content_id, chunk_index); fields from every list are
+    merged so a fused row keeps both its similarity_score and lexical_score.
+    """
+    fused: Dict[Tuple[str, int], Dict] = {}
+    for results in result_lists:
+        for rank, row in enumerate(results, 1):
+            key = row_key(row)
+            entry = fused.setdefault(key, {"fusion_score": 0.0})
+            for field, value in row.items():
+                entry.setdefault(field, value)
+            entry["fusion_score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda row: row["fusion_score"], reverse=True)
+
+def rerank(query: str, rows: List[Dict]) -> List[Dict]:
+    """
+    Cheap local reranking of fused candidates.
+
+    Adds to the fusion score the fraction of query terms the chunk covers
+    and a boost when a section number in the query matches the chunk's
+    section, so exact-symbol and section lookups surface first.
+    """
+    query_terms = set(tokenize(query))
+    section_numbers = set(SECTION_NUMBER_PATTERN.findall(query))
+    if not query_terms:
+        return rows
+
+    reranked = []
+    for row in rows:
+        document_terms = set(tokenize(lexical_document(row)))
+        coverage = len(query_terms & document_terms) / len(query_terms)
+        section_match = any(
+            row.get('content_id') == number or (row.get('section') or '').startswith(number)
+            for number in section_numbers
+        )
+        score = row.get("fusion_score", 0.0) * RRF_K + coverage + (1.0 if section_match else 0.0)
+        reranked.append({**row, "rerank_score": score})
+    return sorted(reranked, key=lambda row: row["rerank_score"], reverse=True)
@@ -1,54 +1,418 @@
-import anthropic
+import io
+import os
+import time
 import base64
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+import numpy as np
+import anthropic
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+OCR_MODEL = os.getenv("OCR_MODEL", "claude-opus-4-20250514")
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", "1150000"))  # Larger images are downscaled by the API anyway
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() == "true"
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+OCR_CROP_MARGIN = 16  # Pixels of background kept around the cropped content
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "256"))
+HASH_SIZE = 16  # dHash grid; 16x16 gives a 256-bit hash, used only to find near-duplicate candidates
+OCR_HASH_DISTANCE = 32  # Most differing dHash bits for a cached image to be compared pixel by pixel
+OCR_MATCH_SIZE = (256, 64)  # Grid of the pixel comparison that confirms a near-duplicate
+OCR_MATCH_TOLERANCE = float(os.getenv("OCR_MATCH_TOLERANCE", "24"))  # Largest gray-level difference of any cell
+OCR_PROMPT = "Given image is having a math question, extract the question along with the options if present. Thats it. Never answer the question. Just extract the question and options. You are providing a OCR service. So dont answer the question. Just extract the question and options."
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Preprocessing and perceptual hashing are skipped without Pillow
+    Image = None
+    ImageOps = None
+
+# Clients are reused across calls. The async client's connections belong to
+# the event loop that opened them, so it is rebuilt on a different loop.
+_client: Optional[anthropic.Anthropic] = None
+_async_client: Optional[anthropic.AsyncAnthropic] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# A file path, or the encoded image itself (e.g. an upload's getbuffer())
+ImageInput = Union[str, os.PathLike, bytes, bytearray, memoryview]
+
+class ImageFingerprint(NamedTuple):
+    """What near-duplicate lookups compare: the dHash, then the content's shape and pixels"""
+    dhash: str
+    aspect: float
+    pixels: np.ndarray
+
+# Extracted text by content hash of the image bytes and prompt (LRU);
+# each entry keeps its image's fingerprint for near-duplicate lookups
+_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+_metrics = {
+    "requests": 0,
+    "cache_hits": 0,
+    "near_duplicate_hits": 0,
+    "api_calls": 0,
+    "original_bytes": 0,
+    "upload_bytes": 0,
+    "total_latency_ms": 0.0,
+}
+
+def _get_client() -> anthropic.Anthropic:
+    """Get the shared synchronous Anthropic client"""
+    global _client
+    if _client is None:
+        _client = anthropic.Anthropic()
+    return _client
+
+def _get_async_client() -> anthropic.AsyncAnthropic:
+    """Get the shared async Anthropic client for the running event loop"""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = anthropic.AsyncAnthropic()
+        _async_client_loop = loop
+    return _async_client
+
+def _detect_media_type(data: ImageInput) -> str:
+    """Media type from the image's magic bytes"""
+    data = bytes(data[:12])
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/png"
+
+def perceptual_hash(image) -> str:
+    """
+    Difference hash (dHash) of an image.
+
+    Re-uploads of the same problem (re-encoded or re-saved) give the same
+    hash, unlike a hash of the file bytes. So do different problems with the
+    same layout, so a matching hash only nominates a cache candidate.
+    """
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+class _BufferReader(io.RawIOBase):
+    """Read-only file object over a buffer without copying it (io.BytesIO copies a memoryview)"""
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview]):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+def image_fingerprint(image) -> ImageFingerprint:
+    """dHash plus the cropped content as a coarse grayscale grid (one cell per few pixels of text)"""
+    content = _crop_to_content(image).convert("L")
+    pixels = np.asarray(content.resize(OCR_MATCH_SIZE, Image.BOX), dtype=np.int16)
+    return ImageFingerprint(perceptual_hash(content), content.width / content.height, pixels)
+
+def is_same_image(a: ImageFingerprint, b: ImageFingerprint) -> bool:
+    """
+    Whether two fingerprints show the same content.
+
+    Re-encoding moves each cell by a few gray levels; a different digit or
+    symbol anywhere in the problem changes its cells by far more.
+    """
+    if abs(a.aspect - b.aspect) > 0.02 * a.aspect:
+        return False
+    return int(np.abs(a.pixels - b.pixels).max()) <= OCR_MATCH_TOLERANCE
+
+def _crop_to_content(image):
+    """Crop uniform background borders, keeping a small margin"""
+    gray = image.convert("L")
+    # Content is whatever differs clearly from the border colour
+    background = gray.getpixel((0, 0))
+    mask = gray.point(lambda value: 255 if abs(value - background) > 40 else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - OCR_CROP_MARGIN),
+        max(0, top - OCR_CROP_MARGIN),
+        min(image.width, right + OCR_CROP_MARGIN),
+        min(image.height, bottom + OCR_CROP_MARGIN),
+    ))
+
+def preprocess_image(data: Union[bytes, bytearray, memoryview]) -> Tuple[bytes, str, Optional[ImageFingerprint]]:
+    """
+    Prepare an image for OCR upload.
+
+    Applies EXIF rotation, crops empty borders, converts to grayscale and
+    downscales to OCR_MAX_PIXELS, then re-encodes (JPEG for JPEG sources,
+    PNG otherwise).
+
+    Args:
+        data: The original image bytes (any buffer; it is not copied)
+
+    Returns:
+        (upload bytes, media type, fingerprint for near-duplicate lookups)
+    """
+    if Image is None:
+        return data, _detect_media_type(data), None
+
+    image = Image.open(_BufferReader(data))
+    if image.format == "JPEG" and image.width * image.height > OCR_MAX_PIXELS:
+        # Let the JPEG decoder scale down by a power of two instead of decoding every pixel
+        scale = (OCR_MAX_PIXELS / (image.width * image.height)) ** 0.5
+        image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        # Flatten transparency onto white so cropping sees the page background
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = background
+
+    fingerprint = image_fingerprint(image)
+
+    image = _crop_to_content(image)
+    if OCR_GRAYSCALE:
+        image = image.convert("L")
+    pixels = image.width * image.height
+    if pixels > OCR_MAX_PIXELS:
+        scale = (OCR_MAX_PIXELS / pixels) ** 0.5
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+
+    # Photos (JPEG sources) stay JPEG; PNG compresses them poorly and slowly
+    source_type = _detect_media_type(data)
+    buffer = io.BytesIO()
+    if source_type == "image/jpeg":
+        image.save(buffer, format="JPEG", quality=OCR_JPEG_QUALITY)
+    else:
+        image.save(buffer, format="PNG")
+    processed = buffer.getvalue()
+    media_type = source_type if source_type == "image/jpeg" else "image/png"
+    if len(processed) >= memoryview(data).nbytes and source_type == media_type:
+        # Already small; keep the original
+        processed = data
+    return processed, media_type, fingerprint
 
-def get_text_from_image(image_path: str) -> str:
+def _prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+def _cache_key(data: Union[bytes, bytearray, memoryview], prompt: str) -> str:
+    """Cache key for an image's exact bytes extracted with a given prompt"""
+    return f"{hashlib.sha256(memoryview(data).cast('B')).hexdigest()}:{_prompt_key(prompt)}"
+
+def _cache_get(key: str) -> Optional[str]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        _cache.move_to_end(key)
+        return entry["text"]
+
+def _cache_find_similar(fingerprint: Optional[ImageFingerprint], prompt: str) -> Optional[str]:
+    """
+    Text of a cached image with the same content, extracted with the same prompt.
+
+    Entries whose dHash is within OCR_HASH_DISTANCE bits are candidates;
+    one is returned only if the pixel comparison confirms it.
+    """
+    if fingerprint is None:
+        return None
+    prompt_key = _prompt_key(prompt)
+    dhash = int(fingerprint.dhash, 16)
+    with _cache_lock:
+        for key, entry in _cache.items():
+            cached = entry["fingerprint"]
+            if entry["prompt_key"] != prompt_key or cached is None:
+                continue
+            if (dhash ^ int(cached.dhash, 16)).bit_count() <= OCR_HASH_DISTANCE and is_same_image(fingerprint, cached):
+                _cache.move_to_end(key)
+                return entry["text"]
+    return None
+
+def _cache_set(key: str, text: str, fingerprint: Optional[ImageFingerprint], prompt: str):
+    with _cache_lock:
+        _cache[key] = {"text": text, "fingerprint": fingerprint, "prompt_key": _prompt_key(prompt)}
+        _cache.move_to_end(key)
+        while len(_cache) > OCR_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _build_messages(upload: Union[bytes, bytearray, memoryview], media_type: str, prompt: str):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": base64.b64encode(upload).decode("utf-8"),
+                    },
+                },
+                {
+                    "type": "text",
+                    "text": prompt
+                }
+            ],
+        }
+    ]
+
+def _extract_text(message) -> Optional[str]:
+    if message.content and isinstance(message.content, list) and len(message.content) > 0:
+        return message.content[0].text
+    return None
+
+def _is_path(image: ImageInput) -> bool:
+    return isinstance(image, (str, os.PathLike))
+
+def _read_file(image_path: Union[str, os.PathLike]) -> bytes:
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+def _record(original: ImageInput, upload: Optional[ImageInput], start_time: float, near_duplicate: bool = False):
+    _metrics["requests"] += 1
+    if upload is not None:
+        _metrics["api_calls"] += 1
+        _metrics["original_bytes"] += memoryview(original).nbytes
+        _metrics["upload_bytes"] += memoryview(upload).nbytes
+    else:
+        _metrics["cache_hits"] += 1
+        _metrics["near_duplicate_hits"] += near_duplicate
+    _metrics["total_latency_ms"] += (time.perf_counter() - start_time) * 1000
+
+async def get_text_from_image_async(image: ImageInput, prompt: str = OCR_PROMPT) -> str:
+    """
+    Extracts text of a math question from an image without blocking the event loop.
+
+    The image is preprocessed off the loop, re-uploads of the same image
+    (identical bytes, or re-encoded with the same content) are answered from
+    the cache, and the API call uses a shared async client.
+
+    Args:
+        image: The file path to the image, or its encoded bytes / memoryview.
+        prompt: The extraction instruction (defaults to single-question OCR).
+
+    Returns:
+        The extracted text of the question.
+    """
+    try:
+        start_time = time.perf_counter()
+        data = await asyncio.to_thread(_read_file, image) if _is_path(image) else image
+        key = _cache_key(data, prompt)
+        cached = _cache_get(key)
+        if cached is not None:
+            _record(data, None, start_time)
+            return cached
+
+        upload, media_type, fingerprint = await asyncio.to_thread(preprocess_image, data)
+        cached = _cache_find_similar(fingerprint, prompt)
+        if cached is not None:
+            _record(data, None, start_time, near_duplicate=True)
+            return cached
+
+        message = await _get_async_client().messages.create(
+            model=OCR_MODEL,
+            max_tokens=1024,
+            messages=_build_messages(upload, media_type, prompt),
+        )
+
+        text = _extract_text(message)
+        if text is None:
+            return "Error: Could not extract text from the image."
+        _cache_set(key, text, fingerprint, prompt)
+        _record(data, upload, start_time)
+        return text
+
+    except Exception as e:
+        return f"Error: Failed to process image - {str(e)}"
+
+def get_text_from_image(image: ImageInput, prompt: str = OCR_PROMPT) -> str:
     """
     Extracts text of a math question from an image using Anthropic's Claude.
 
     Args:
-        image_path: The file path to the image.
+        image: The file path to the image, or its encoded bytes / memoryview.
+        prompt: The extraction instruction (defaults to single-question OCR).
 
     Returns:
         The extracted text of the question.
     """
     try:
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode("utf-8")
+        start_time = time.perf_counter()
+        data = _read_file(image) if _is_path(image) else image
+        key = _cache_key(data, prompt)
+        cached = _cache_get(key)
+        if cached is not None:
+            _record(data, None, start_time)
+            return cached
 
-        message = anthropic.Anthropic().messages.create(
-            model="claude-opus-4-20250514",
+        upload, media_type, fingerprint = preprocess_image(data)
+        cached = _cache_find_similar(fingerprint, prompt)
+        if cached is not None:
+            _record(data, None, start_time, near_duplicate=True)
+            return cached
+
+        message = _get_client().messages.create(
+            model=OCR_MODEL,
             max_tokens=1024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": image_data,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": "Given image is having a math question, extract the question along with the options if present. Thats it. Never answer the question. Just extract the question and options. You are providing a OCR service. So dont answer the question. Just extract the question and options."
-                        }
-                    ],
-                }
-            ],
+            messages=_build_messages(upload, media_type, prompt),
         )
-        
-        if message.content and isinstance(message.content, list) and len(message.content) > 0:
-            return message.content[0].text
-        else:
+
+        text = _extract_text(message)
+        if text is None:
             return "Error: Could not extract text from the image."
-            
+        _cache_set(key, text, fingerprint, prompt)
+        _record(data, upload, start_time)
+        return text
+
     except Exception as e:
         return f"Error: Failed to process image - {str(e)}"
 
+def ocr_metrics() -> Dict:
+    """Return OCR request, cache and upload size counters"""
+    requests = _metrics["requests"]
+    return {
+        **_metrics,
+        "cache_hit_ratio": round(_metrics["cache_hits"] / requests, 4) if requests else 0.0,
+        "upload_ratio": round(_metrics["upload_bytes"] / _metrics["original_bytes"], 4) if _metrics["original_bytes"] else 0.0,
+        "mean_latency_ms": round(_metrics["total_latency_ms"] / requests, 2) if requests else 0.0,
+        "cache_entries": len(_cache),
+    }
+
 # Test the function if run directly
 if __name__ == '__main__':
     image_path = "img.png"
-    result = get_text_from_image(image_path)
-    print(result)
\ No newline at end of file
+    result = asyncio.run(get_text_from_image_async(image_path))
+    print(result)
@@ -0,0 +1,89 @@
+import re
+from typing import Dict, List, Tuple
+
+# Constants
+ON_TOPIC_THRESHOLD = 3.0  # Score at which a query is accepted without the LLM guardrail
+LOCAL_MAX_CHARS = 300  # Longer queries always get the LLM guardrail
+MAX_UNKNOWN_WORDS = 1  # Words outside MATH_VOCABULARY a locally accepted query may contain
+ON_TOPIC = "on_topic"
+UNCERTAIN = "uncertain"
+
+# (pattern, weight): calculus vocabulary and math notation
+SIGNALS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"\b(integra(l|ls|te|tion|ting)|antiderivative|primitive)\b", re.IGNORECASE), 2.0),
+    (re.compile(r"\b(differentia(l|te|tion)|derivative|limit|continuity|maxima|minima|definite|indefinite)\b", re.IGNORECASE), 1.5),
+    (re.compile(r"\b(by parts|substitution|partial fractions?|area under|area bounded|riemann|leibniz|newton[- ]leibniz)\b", re.IGNORECASE), 1.5),
+    (re.compile(r"\b(calculus|jee|ncert|differential equations?)\b", re.IGNORECASE), 1.0),
+    (re.compile(r"[∫∑√π∞θ]"), 2.0),
+    (re.compile(r"\bd[xytθ]\b|d/d[xyt]|dy/dx"), 2.0),
+    (re.compile(r"\b(sin|cos|tan|cot|sec|cosec|csc|log|ln|exp|sinh|cosh|arcsin|arctan)\s*(\^|\(|\w)", re.IGNORECASE), 1.0),
+    (re.compile(r"\blim\b|→|->"), 1.0),
+    (re.compile(r"[a-z0-9)]\s*\^\s*[-(a-z0-9]", re.IGNORECASE), 1.0),
+    (re.compile(r"\b(evaluate|solve|find|prove|show that)\b", re.IGNORECASE), 0.5),
+]
+
+# Anything that looks like prompt injection or non-educational content always
+# goes to the LLM guardrail, whatever its math score
+RED_FLAGS = re.compile(
+    r"ignore (all |the )?(previous|above) instructions|system prompt|jailbreak|pretend (to be|you are)|"
+    r"\b(password|credit card|hack|exploit|malware|weapon|drugs?|porn|nude)\b",
+    re.IGNORECASE
+)
+
+# The words a self-contained math question is made of. A query is only
+# accepted locally if (almost) all of its words are here, so a calculus
+# question cannot carry an unrelated request past the LLM guardrail
+MATH_VOCABULARY = set("""
+    a an and or the of to from in on at by for with into as is are be it its this that these then if
+    where when which what whose how why using use given let following equal equals between over
+    find evaluate compute calculate determine solve prove show explain value values answer step steps
+    method methods rule formula
+    integral integrals integrate integrating integration antiderivative primitive definite indefinite
+    derivative derivatives differentiate differentiation differential differentiable limit limits lim
+    continuity continuous maxima minima maximum minimum area under bounded enclosed curve curves region
+    parts substitution partial fraction fractions function functions equation equations expression
+    tends approaches infinity zero interval slope tangent normal rate change respect wrt sum series
+    sin cos tan cot sec cosec csc log ln exp sqrt sinh cosh tanh arcsin arccos arctan pi theta alpha beta
+    calculus jee ncert riemann leibniz newton axis line lines parabola circle ellipse positive negative
+    real constant
+""".split())
+WORD = re.compile(r"[a-z]{2,}")
+DIFFERENTIAL = re.compile(r"d[a-z]|d[a-z]d[a-z]")
+
+def unknown_words(text: str) -> List[str]:
+    """Words of a query that are not math vocabulary (single letters and differentials count as math)"""
+    return [word for word in WORD.findall(text.lower()) if word not in MATH_VOCABULARY and not DIFFERENTIAL.fullmatch(word)]
+
+def score_query(text: str) -> Dict:
+    """Score how clearly a query is a calculus / math question from its vocabulary and notation"""
+    matched = {}
+    score = 0.0
+    for pattern, weight in SIGNALS:
+        if pattern.search(text):
+            matched[pattern.pattern[:40]] = weight
+            score += weight
+    return {
+        "score": score,
+        "matched": matched,
+        "red_flag": bool(RED_FLAGS.search(text)),
+        "unknown_words": unknown_words(text),
+    }
+
+def classify_query(text: str) -> str:
+    """
+    Fast local pre-check for the input guardrail.
+
+    Returns ON_TOPIC for queries that are unmistakably math questions (the
+    LLM guardrail can be skipped) and UNCERTAIN otherwise. A query is
+    unmistakable only if it scores ON_TOPIC_THRESHOLD, is at most
+    LOCAL_MAX_CHARS long and has no more than MAX_UNKNOWN_WORDS words outside
+    MATH_VOCABULARY: a high score alone would let an off-topic request ride
+    along with a few calculus words. It never rejects; rejection is left to
+    the LLM guardrail.
+    """
+    if not text or not text.strip() or len(text) > LOCAL_MAX_CHARS:
+        return UNCERTAIN
+    result = score_query(text)
+    if result["red_flag"] or len(result["unknown_words"]) > MAX_UNKNOWN_WORDS:
+        return UNCERTAIN
+    return ON_TOPIC if result["score"] >= ON_TOPIC_THRESHOLD else UNCERTAIN
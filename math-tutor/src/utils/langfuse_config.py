@@ -2,7 +2,6 @@ import os
 import uuid
 import base64
 import logfire
-import nest_asyncio
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -16,9 +15,6 @@ def configure_langfuse(service_name: str, send_to_logfire: bool = False):
     # Load environment variables from .env
     load_dotenv()
 
-    # Apply nested asyncio patch
-    nest_asyncio.apply()
-
     session_id = f"{service_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{str(uuid.uuid4())[:8]}"
 
     # Read Langfuse credentials
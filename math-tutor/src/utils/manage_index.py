@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+# Add src to path so the shared utils package resolves when run as a script
+src_path = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(src_path))
+
+from utils.db_pool import acquire, close_pool, save_session_settings
+from utils.retrieval_backends import SEARCH_SQL
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+INDEX_NAME = "math_content_chunks_embedding_idx"
+MIN_INDEX_ROWS = int(os.getenv("VECTOR_INDEX_MIN_ROWS", "1000"))  # Below this an exact scan is faster
+HNSW_MAX_ROWS = int(os.getenv("VECTOR_INDEX_HNSW_MAX_ROWS", "100000"))  # Above this IVFFlat builds far cheaper
+RECALL_TARGET = float(os.getenv("VECTOR_INDEX_RECALL_TARGET", "0.95"))
+
+NEAREST_IDS_SQL = """
+SELECT id FROM math_content_chunks
+ORDER BY embedding <=> $1::vector
+LIMIT $2;
+"""
+# Same query under its own SQL text, so the exact baseline and the index runs
+# never share a prepared statement (and with it a cached plan)
+EXACT_NEAREST_IDS_SQL = NEAREST_IDS_SQL.replace("SELECT id", "SELECT /* exact */ id", 1)
+
+def choose_index_params(row_count: int, method: str = "auto") -> Dict:
+    """
+    Pick the index type and build parameters for a corpus of row_count vectors.
+
+    Follows the pgvector guidance: IVFFlat lists = rows / 1000 up to 1M rows
+    and sqrt(rows) above; HNSW uses m = 16 and ef_construction = 64, raised
+    for larger graphs.
+    """
+    if method == "auto":
+        if row_count < MIN_INDEX_ROWS:
+            method = "none"
+        elif row_count <= HNSW_MAX_ROWS:
+            method = "hnsw"
+        else:
+            method = "ivfflat"
+
+    if method == "hnsw":
+        if row_count <= 50000:
+            return {"method": "hnsw", "m": 16, "ef_construction": 64}
+        return {"method": "hnsw", "m": 24, "ef_construction": 128}
+    if method == "ivfflat":
+        lists = max(1, row_count // 1000) if row_count <= 1000000 else int(math.sqrt(row_count))
+        return {"method": "ivfflat", "lists": lists}
+    return {"method": "none"}
+
+def sweep_values(params: Dict) -> List[int]:
+    """Candidate probes / ef_search values to measure, cheapest first"""
+    if params["method"] == "ivfflat":
+        lists = params["lists"]
+        return sorted({p for p in (1, 2, 4, 8, 16, 32, 64, lists) if p <= lists})
+    if params["method"] == "hnsw":
+        return [10, 20, 40, 80, 160, 320]
+    return []
+
+def search_setting_name(method: str) -> Optional[str]:
+    """Session setting that trades recall for speed for the given index type"""
+    return {"ivfflat": "ivfflat.probes", "hnsw": "hnsw.ef_search"}.get(method)
+
+async def build_index(params: Dict):
+    """Drop and rebuild the chunk embedding index with the given parameters"""
+    async with acquire() as conn:
+        await conn.execute(f"DROP INDEX IF EXISTS {INDEX_NAME};")
+        if params["method"] == "hnsw":
+            await conn.execute(f"""
+                CREATE INDEX {INDEX_NAME}
+                ON math_content_chunks USING hnsw (embedding vector_cosine_ops)
+                WITH (m = {params['m']}, ef_construction = {params['ef_construction']});
+            """)
+        elif params["method"] == "ivfflat":
+            await conn.execute(f"""
+                CREATE INDEX {INDEX_NAME}
+                ON math_content_chunks USING ivfflat (embedding vector_cosine_ops)
+                WITH (lists = {params['lists']});
+            """)
+        await conn.execute("ANALYZE math_content_chunks;")
+    logger.info(f"Built vector index: {params}")
+
+async def _sample_queries(sample_size: int) -> List[List[float]]:
+    """Use stored chunk embeddings as representative query vectors"""
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT embedding FROM math_content_chunks WHERE embedding IS NOT NULL ORDER BY random() LIMIT $1;",
+            sample_size
+        )
+    return [row['embedding'] for row in rows]
+
+async def _timed_search(conn, query: List[float], k: int, setting: Optional[str], value: Optional[int], exact: bool):
+    """
+    Run one top-k search in a transaction with local planner/index settings.
+
+    Postgres does not replan a prepared statement when settings change and
+    may switch it to a generic plan after a few executions, so every run is
+    planned afresh for the settings of its own transaction.
+    """
+    async with conn.transaction():
+        await conn.execute("SET LOCAL plan_cache_mode = force_custom_plan;")
+        if exact:
+            await conn.execute("SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off;")
+        elif setting:
+            await conn.execute(f"SET LOCAL {setting} = {int(value)};")
+        start_time = time.perf_counter()
+        rows = await conn.fetch(EXACT_NEAREST_IDS_SQL if exact else NEAREST_IDS_SQL, query, k)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+    return [row['id'] for row in rows], elapsed_ms
+
+async def measure_recall(params: Dict, k: int, sample_size: int) -> List[Dict]:
+    """Measure recall@k and mean latency against exact search for each candidate setting"""
+    queries = await _sample_queries(sample_size)
+    if not queries:
+        return []
+
+    setting = search_setting_name(params["method"])
+    report = []
+    async with acquire() as conn:
+        truth, exact_ms = [], []
+        for query in queries:
+            ids, elapsed_ms = await _timed_search(conn, query, k, None, None, exact=True)
+            truth.append(set(ids))
+            exact_ms.append(elapsed_ms)
+        report.append({"setting": "exact", "value": None, "recall": 1.0, "latency_ms": sum(exact_ms) / len(exact_ms)})
+
+        for value in sweep_values(params):
+            hits, latencies = 0, []
+            for query, expected in zip(queries, truth):
+                ids, elapsed_ms = await _timed_search(conn, query, k, setting, value, exact=False)
+                hits += len(expected.intersection(ids))
+                latencies.append(elapsed_ms)
+            expected_total = sum(len(expected) for expected in truth) or 1
+            report.append({
+                "setting": setting,
+                "value": value,
+                "recall": hits / expected_total,
+                "latency_ms": sum(latencies) / len(latencies),
+            })
+    return report
+
+def print_recall_table(report: List[Dict], k: int):
+    """Print a recall@k vs latency table"""
+    print(f"\n{'setting':<18} {'value':>6} {f'recall@{k}':>10} {'latency (ms)':>14}")
+    print("-" * 52)
+    for row in report:
+        value = "-" if row["value"] is None else str(row["value"])
+        print(f"{row['setting']:<18} {value:>6} {row['recall']:>10.3f} {row['latency_ms']:>14.3f}")
+
+async def explain_search(sample_query: List[float], k: int = 5) -> bool:
+    """Check with EXPLAIN that the rag_search statement is served by the vector index"""
+    async with acquire() as conn:
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {SEARCH_SQL.rstrip().rstrip(';')}", sample_query, k)
+    plan_text = plan if isinstance(plan, str) else json.dumps(plan)
+    uses_index = INDEX_NAME in plan_text
+    if uses_index:
+        logger.info(f"EXPLAIN: search uses {INDEX_NAME}")
+    else:
+        logger.warning(f"EXPLAIN: search does not use {INDEX_NAME} (sequential scan)")
+    return uses_index
+
+async def rebuild_index(method: str = "auto", recall_target: float = RECALL_TARGET, k: int = 5, sample_size: int = 50, report: bool = False) -> Dict:
+    """
+    Size, build and tune the vector index for the current corpus.
+
+    Builds the index (after bulk load), picks the cheapest probes / ef_search
+    value that meets recall_target against exact search, persists it as a
+    session setting for every pooled connection and verifies the search plan.
+    """
+    async with acquire() as conn:
+        row_count = await conn.fetchval("SELECT COUNT(*) FROM math_content_chunks WHERE embedding IS NOT NULL;")
+
+    params = choose_index_params(row_count, method)
+    logger.info(f"{row_count} chunk vectors -> {params['method']} index")
+    await build_index(params)
+
+    if params["method"] == "none":
+        logger.info("Corpus is small enough for exact search; no ANN index built")
+        if report:
+            print_recall_table(await measure_recall(params, k, sample_size), k)
+        return {**params, "row_count": row_count}
+
+    recall_report = await measure_recall(params, k, sample_size)
+    if report:
+        print_recall_table(recall_report, k)
+
+    setting = search_setting_name(params["method"])
+    candidates = [row for row in recall_report if row["setting"] == setting]
+    chosen = next((row for row in candidates if row["recall"] >= recall_target), candidates[-1] if candidates else None)
+    if chosen is not None:
+        await save_session_settings({setting: str(chosen["value"])})
+        logger.info(f"Set {setting} = {chosen['value']} (recall@{k} {chosen['recall']:.3f}, {chosen['latency_ms']:.2f} ms)")
+
+    queries = await _sample_queries(1)
+    if queries:
+        await explain_search(queries[0], k)
+
+    return {**params, "row_count": row_count, setting: chosen["value"] if chosen else None}
+
+async def main(args):
+    """Rebuild and tune the index, then release the pool"""
+    try:
+        await rebuild_index(
+            method=args.method,
+            recall_target=args.recall_target,
+            k=args.k,
+            sample_size=args.queries,
+            report=True,
+        )
+    finally:
+        await close_pool()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build and tune the pgvector index for math_content_chunks")
+    parser.add_argument("--method", choices=["auto", "hnsw", "ivfflat", "none"], default="auto", help="Index type (auto picks from the row count)")
+    parser.add_argument("--recall-target", type=float, default=RECALL_TARGET, help="Minimum recall@k against exact search")
+    parser.add_argument("-k", type=int, default=5, help="k for recall@k")
+    parser.add_argument("--queries", type=int, default=50, help="Number of sampled query vectors")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,149 @@
+import re
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+from utils.input_classifier import score_query
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+ACCEPT = "accept"
+REJECT = "reject"
+UNCERTAIN = "uncertain"
+
+CORE_FIELDS = ["problem_analysis", "concept_explanation", "step_by_step_solution"]
+MIN_SOLUTION_CHARS = 80  # A worked solution shorter than this needs a closer look
+MIN_MATH_SCORE = 3.0  # Same scale as the input classifier
+MIN_STOPWORD_RATIO = 0.06  # English prose has far more function words than gibberish
+MIN_WORDLIKE_RATIO = 0.6  # Share of alphabetic tokens that look like words
+
+STOPWORDS = {
+    "the", "a", "an", "is", "are", "of", "to", "and", "in", "we", "it", "this", "that", "for",
+    "on", "with", "as", "by", "be", "so", "then", "from", "at", "or", "which", "can", "using",
+}
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+WORDLIKE_PATTERN = re.compile(r"^(?=.*[aeiouy])[a-z]{1,15}$")
+
+def _text_fields(response: Any) -> Dict[str, str]:
+    """All text of a structured response, by field (lists joined)"""
+    fields = {}
+    for name, value in (response.model_dump() if hasattr(response, "model_dump") else vars(response)).items():
+        if isinstance(value, str):
+            fields[name] = value
+        elif isinstance(value, list):
+            fields[name] = " ".join(str(item) for item in value)
+    return fields
+
+def language_profile(text: str) -> Dict[str, float]:
+    """Stopword and word-shape ratios of text, a cheap English / gibberish signal"""
+    words = [word.lower() for word in WORD_PATTERN.findall(text)]
+    if not words:
+        return {"stopword_ratio": 0.0, "wordlike_ratio": 0.0, "words": 0}
+    return {
+        "stopword_ratio": sum(word in STOPWORDS for word in words) / len(words),
+        "wordlike_ratio": sum(bool(WORDLIKE_PATTERN.match(word)) for word in words) / len(words),
+        "words": len(words),
+    }
+
+def local_output_check(response: Any) -> Dict:
+    """
+    Deterministic checks on a structured expert response.
+
+    Rejects responses with every core field empty; accepts responses whose
+    core fields are filled, whose worked solution has substance, that read
+    as English prose and that carry math content. Everything else is
+    UNCERTAIN and left to the LLM validator.
+
+    Returns:
+        {"decision": ACCEPT | REJECT | UNCERTAIN, "reasons": [...], "signals": {...}}
+    """
+    fields = _text_fields(response)
+    core = {name: fields.get(name, "").strip() for name in CORE_FIELDS}
+    all_text = "\n".join(fields.values())
+
+    if not any(core.values()):
+        return {"decision": REJECT, "reasons": ["all core fields are empty"], "signals": {}}
+
+    profile = language_profile(all_text)
+    math_score = score_query(all_text)["score"]
+    filled_fields = sum(1 for value in fields.values() if value.strip())
+    signals = {
+        **profile,
+        "math_score": math_score,
+        "filled_fields": filled_fields,
+        "total_fields": len(fields),
+        "solution_chars": len(core["step_by_step_solution"]),
+    }
+
+    reasons: List[str] = []
+    if not all(core.values()):
+        reasons.append("a core field is empty")
+    if signals["solution_chars"] < MIN_SOLUTION_CHARS:
+        reasons.append("worked solution is very short")
+    if profile["stopword_ratio"] < MIN_STOPWORD_RATIO or profile["wordlike_ratio"] < MIN_WORDLIKE_RATIO:
+        reasons.append("text does not read as English prose")
+    if math_score < MIN_MATH_SCORE:
+        reasons.append("little mathematical content")
+
+    return {"decision": UNCERTAIN if reasons else ACCEPT, "reasons": reasons, "signals": signals}
+
+class TieredOutputValidator:
+    """
+    Output validation that only calls the LLM when the local checks are unsure.
+
+    Tier 1 is local_output_check; tier 2 is the LLM validator passed to
+    validate(). Hit counts and latency are tracked per tier.
+    """
+
+    def __init__(self):
+        self.stats = {
+            "local_accept": {"count": 0, "total_ms": 0.0},
+            "local_reject": {"count": 0, "total_ms": 0.0},
+            "llm": {"count": 0, "total_ms": 0.0, "trips": 0},
+        }
+
+    def _record(self, tier: str, start_time: float):
+        self.stats[tier]["count"] += 1
+        self.stats[tier]["total_ms"] += (time.perf_counter() - start_time) * 1000
+
+    async def validate(self, response: Any, llm_validate: Callable[[Any], Awaitable[bool]]) -> Dict:
+        """
+        Decide whether a response should trip the output guardrail.
+
+        Args:
+            response: The structured expert response
+            llm_validate: Coroutine function returning True if the LLM validator trips
+
+        Returns:
+            {"tripwire_triggered": bool, "tier": "local" | "llm", "reasons": [...]}
+        """
+        start_time = time.perf_counter()
+        local = local_output_check(response)
+
+        if local["decision"] == ACCEPT:
+            self._record("local_accept", start_time)
+            return {"tripwire_triggered": False, "tier": "local", "reasons": []}
+        if local["decision"] == REJECT:
+            self._record("local_reject", start_time)
+            logger.warning(f"Output rejected locally: {local['reasons']}")
+            return {"tripwire_triggered": True, "tier": "local", "reasons": local["reasons"]}
+
+        logger.info(f"Local output check uncertain ({', '.join(local['reasons'])}); asking LLM validator")
+        tripped = await llm_validate(response)
+        self._record("llm", start_time)
+        if tripped:
+            self.stats["llm"]["trips"] += 1
+        return {"tripwire_triggered": tripped, "tier": "llm", "reasons": local["reasons"]}
+
+    def metrics(self) -> Dict:
+        """Per-tier hit rates and mean latency"""
+        total = sum(tier["count"] for tier in self.stats.values())
+        return {
+            name: {
+                **tier,
+                "hit_rate": round(tier["count"] / total, 4) if total else 0.0,
+                "mean_ms": round(tier["total_ms"] / tier["count"], 3) if tier["count"] else 0.0,
+            }
+            for name, tier in self.stats.items()
+        }
@@ -1,55 +1,73 @@
 import os
+import re
+import sys
 import json
+import time
+import hashlib
+import argparse
+import random
 import asyncio
 import logging
 from pathlib import Path
-from typing import List, Dict
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from openai import AsyncOpenAI
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+# Add src to path so the shared utils package resolves when run as a script
+src_path = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(src_path))
+
+from utils.db_pool import acquire, close_pool, expire_connections, pool_metrics
+from utils.tokens import count_tokens
+from utils.retrieval_backends import LocalVectorIndex, RAG_LOCAL_INDEX_DIR
+from utils.manage_index import rebuild_index
+from utils.embeddings import (
+    EMBEDDING_MODEL,
+    generate_embedding,
+    generate_embeddings,
+    embedding_cache_metrics,
+    embedding_usage,
+)
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("prepare_db.log"),
-        logging.StreamHandler()
-    ]
-)
+# Set up logging (handlers are configured when run as a script, not on import)
 logger = logging.getLogger(__name__)
 
 # Constants
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+
+CONTENT_COLUMNS = (
+    "content_id", "section", "sub_headings", "difficulty_level",
+    "notes", "tips_to_approach", "content", "content_hash",
+)
+CHUNK_COLUMNS = (
+    "content_id", "chunk_index", "sub_heading", "content", "token_count", "embedding",
+)
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Lexical document for each chunk: parent section, sub-headings and notes plus the chunk text
+UPDATE_SEARCH_TSV_SQL = """
+UPDATE math_content_chunks c
+SET search_tsv =
+    setweight(to_tsvector('english', m.content_id || ' ' || coalesce(m.section, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(c.sub_heading, '') || ' ' || array_to_string(coalesce(m.sub_headings, '{}'), ' ')), 'B') ||
+    setweight(to_tsvector('english', array_to_string(coalesce(m.notes, '{}'), ' ')), 'C') ||
+    to_tsvector('english', c.content)
+FROM math_content m
+WHERE c.content_id = m.content_id"""
 
-def get_db_connection():
-    """Establish database connection"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = False
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        return conn, cursor
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Chunking parameters
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*)$")
 
 async def create_tables():
     """Create necessary tables for storing math content and embeddings"""
     try:
-        conn, cursor = get_db_connection()
-        
-        # Enable pgvector extension
-        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-        
         # Create main content table
         create_table_sql = """
         CREATE TABLE IF NOT EXISTS math_content (
@@ -62,41 +80,82 @@ async def create_tables():
             tips_to_approach TEXT[],
             content TEXT NOT NULL,
             embedding vector(1536),
+            content_hash VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """
         
-        cursor.execute(create_table_sql)
+        create_chunks_table_sql = """
+        CREATE TABLE IF NOT EXISTS math_content_chunks (
+            id SERIAL PRIMARY KEY,
+            content_id VARCHAR(50) NOT NULL REFERENCES math_content (content_id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            sub_heading TEXT,
+            content TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            embedding vector(1536),
+            search_tsv tsvector,
+            UNIQUE (content_id, chunk_index)
+        );
+        """
+        
+        async with acquire() as conn:
+            async with conn.transaction():
+                # Enable pgvector extension
+                await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+                
+                await conn.execute(create_table_sql)
+                
+                # Tables created before incremental re-indexing have no manifest column
+                await conn.execute("ALTER TABLE math_content ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);")
+                
+                # Chunks of each section; these carry the embeddings used for search.
+                # The ANN index is built by manage_index after the bulk load.
+                await conn.execute(create_chunks_table_sql)
+                
+                # Full-text index for hybrid retrieval; backfill chunks stored before it existed
+                await conn.execute("ALTER TABLE math_content_chunks ADD COLUMN IF NOT EXISTS search_tsv tsvector;")
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS math_content_chunks_search_tsv_idx 
+                    ON math_content_chunks USING gin (search_tsv);
+                """)
+                await conn.execute(UPDATE_SEARCH_TSV_SQL + " AND c.search_tsv IS NULL;")
         
-        # Create index on embedding for faster similarity search
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS math_content_embedding_idx 
-            ON math_content USING ivfflat (embedding vector_cosine_ops) 
-            WITH (lists = 100);
-        """)
+        # Connections opened before CREATE EXTENSION have no binary vector codec
+        await expire_connections()
         
-        conn.commit()
-        conn.close()
         logger.info("Database tables created successfully")
         
     except Exception as e:
         logger.error(f"Error creating tables: {e}")
-        if 'conn' in locals() and conn:
-            conn.close()
         raise
 
-async def generate_embedding(text: str) -> List[float]:
-    """Generate embedding for given text using OpenAI"""
-    try:
-        response = await client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        raise
+def compute_content_hash(content: str, metadata: Dict) -> str:
+    """Hash everything that ends up in a math_content row, including the embedding model"""
+    payload = json.dumps(
+        {
+            "model": EMBEDDING_MODEL,
+            "chunking": [CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS],
+            "content": content,
+            "metadata": metadata,
+        },
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def load_content_manifest() -> Dict[str, Optional[str]]:
+    """Load the stored content_id -> content_hash manifest"""
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT content_id, content_hash FROM math_content;")
+    return {row['content_id']: row['content_hash'] for row in rows}
+
+async def delete_content(content_ids: List[str]):
+    """Delete rows whose source files no longer exist"""
+    async with acquire() as conn:
+        await conn.execute("DELETE FROM math_content WHERE content_id = ANY($1::text[]);", content_ids)
+    logger.info(f"Deleted {len(content_ids)} stale documents: {', '.join(content_ids)}")
 
 def load_content_files(content_dir: str) -> List[Dict]:
     """Load all .md and .json files from content directory"""
@@ -123,7 +182,8 @@ def load_content_files(content_dir: str) -> List[Dict]:
                 content_files.append({
                     'content_id': md_file.stem,
                     'content': md_content,
-                    'metadata': json_metadata
+                    'metadata': json_metadata,
+                    'content_hash': compute_content_hash(md_content, json_metadata)
                 })
                 
                 logger.info(f"Loaded content for {md_file.stem}")
@@ -136,70 +196,260 @@ def load_content_files(content_dir: str) -> List[Dict]:
     
     return content_files
 
-async def process_and_store_content(content_data: Dict):
-    """Process individual content and store in database"""
+class AdaptiveBackoff:
+    """
+    Rate-limit-aware backoff shared by all ingestion workers.
+
+    A rate limit doubles the shared delay (or uses the server's Retry-After),
+    every success halves it, so workers slow down together under pressure and
+    run at full speed otherwise.
+    """
+
+    def __init__(self, base_delay: float = 0.5, max_delay: float = 60.0, max_retries: int = 6):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.delay = 0.0
+        self.retries = 0
+
+    async def run(self, operation):
+        """Run an async operation, retrying on rate limits and transient API errors"""
+        for attempt in range(self.max_retries + 1):
+            if self.delay:
+                await asyncio.sleep(self.delay * random.uniform(0.8, 1.2))
+            try:
+                result = await operation()
+                self.delay = self.delay / 2 if self.delay > self.base_delay else 0.0
+                return result
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                retry_after = _retry_after_seconds(e)
+                self.delay = min(self.max_delay, max(retry_after, self.delay * 2, self.base_delay))
+                logger.warning(f"Embeddings API backoff {self.delay:.2f}s after {type(e).__name__} (attempt {attempt + 1})")
+
+def _retry_after_seconds(error: Exception) -> float:
+    """Read the Retry-After header from an API error, if present"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
     try:
-        content_id = content_data['content_id']
-        content = content_data['content']
-        metadata = content_data['metadata']
-        
-        # Generate embedding for the content
-        logger.info(f"Generating embedding for {content_id}")
-        embedding = await generate_embedding(content)
-        
-        # Prepare data for database insertion
-        section = metadata.get('section', '')
-        sub_headings = metadata.get('sub_headings', [])
-        difficulty_level = metadata.get('difficulty_level', 'intermediate')
-        notes = metadata.get('notes', [])
-        tips_to_approach = metadata.get('tips_to_approach', [])
-        
-        # Insert into database
-        conn, cursor = get_db_connection()
-        
-        insert_sql = """
-        INSERT INTO math_content 
-        (content_id, section, sub_headings, difficulty_level, notes, tips_to_approach, content, embedding)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (content_id) 
-        DO UPDATE SET
-            section = EXCLUDED.section,
-            sub_headings = EXCLUDED.sub_headings,
-            difficulty_level = EXCLUDED.difficulty_level,
-            notes = EXCLUDED.notes,
-            tips_to_approach = EXCLUDED.tips_to_approach,
-            content = EXCLUDED.content,
-            embedding = EXCLUDED.embedding,
-            updated_at = CURRENT_TIMESTAMP;
-        """
-        
-        # Convert embedding to PostgreSQL array format
-        embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-        
-        cursor.execute(insert_sql, (
-            content_id,
-            section,
-            sub_headings,
-            difficulty_level,
-            notes,
-            tips_to_approach,
-            content,
-            embedding_str
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Successfully stored content {content_id} in database")
+        return float(response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def _split_sections(content: str) -> List[Tuple[str, str]]:
+    """Split markdown into (sub_heading, body) sections at heading lines"""
+    sections = []
+    heading, lines = "", []
+    for line in content.splitlines():
+        match = HEADING_PATTERN.match(line)
+        if match:
+            if any(l.strip() for l in lines):
+                sections.append((heading, "\n".join(lines).strip()))
+            heading, lines = match.group(1).strip(), []
+        else:
+            lines.append(line)
+    if any(l.strip() for l in lines):
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+def _split_oversized(paragraph: str, max_tokens: int) -> List[str]:
+    """Split a single paragraph that exceeds max_tokens into word windows"""
+    words = paragraph.split()
+    pieces, current = [], []
+    for word in words:
+        current.append(word)
+        if count_tokens(" ".join(current)) > max_tokens and len(current) > 1:
+            current.pop()
+            pieces.append(" ".join(current))
+            current = [word]
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def chunk_content(content: str, max_tokens: int = None, overlap_tokens: int = None) -> List[Dict]:
+    """
+    Split a section's markdown into token-bounded, overlapping chunks.
+
+    Chunks never cross a sub-heading boundary. Within a sub-heading,
+    paragraphs are packed into windows of at most max_tokens, and each window
+    starts with the trailing paragraphs of the previous one (up to
+    overlap_tokens) so no step of a worked example is cut off from its context.
+
+    Args:
+        content: Markdown content of one section
+        max_tokens: Upper bound on tokens per chunk body
+        overlap_tokens: Tokens carried over between consecutive windows
+
+    Returns:
+        List of chunks with chunk_index, sub_heading, content and token_count
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    
+    chunks = []
+    for sub_heading, body in _split_sections(content):
+        paragraphs = []
+        for paragraph in re.split(r"\n\s*\n", body):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if count_tokens(paragraph) > max_tokens:
+                paragraphs.extend(_split_oversized(paragraph, max_tokens))
+            else:
+                paragraphs.append(paragraph)
+        
+        window: List[str] = []
+        window_tokens = 0
+        new_in_window = False
+        for paragraph in paragraphs:
+            paragraph_tokens = count_tokens(paragraph)
+            if window and window_tokens + paragraph_tokens > max_tokens:
+                chunks.append((sub_heading, window))
+                # Carry trailing paragraphs over as overlap
+                carried, carried_tokens = [], 0
+                for previous in reversed(window):
+                    previous_tokens = count_tokens(previous)
+                    if carried_tokens + previous_tokens > overlap_tokens or carried_tokens + previous_tokens + paragraph_tokens > max_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous_tokens
+                window, window_tokens = carried, carried_tokens
+                new_in_window = False
+            window.append(paragraph)
+            window_tokens += paragraph_tokens
+            new_in_window = True
+        if window and new_in_window:
+            chunks.append((sub_heading, window))
+    
+    result = []
+    for chunk_index, (sub_heading, paragraphs) in enumerate(chunks):
+        text = "\n\n".join(paragraphs)
+        if sub_heading:
+            text = f"## {sub_heading}\n\n{text}"
+        result.append({
+            'chunk_index': chunk_index,
+            'sub_heading': sub_heading,
+            'content': text,
+            'token_count': count_tokens(text),
+        })
+    return result
+
+def _content_record(content_data: Dict) -> tuple:
+    """Build a math_content row from loaded content"""
+    metadata = content_data['metadata']
+    return (
+        content_data['content_id'],
+        metadata.get('section', ''),
+        metadata.get('sub_headings', []),
+        metadata.get('difficulty_level', 'intermediate'),
+        metadata.get('notes', []),
+        metadata.get('tips_to_approach', []),
+        content_data['content'],
+        content_data['content_hash'],
+    )
+
+async def store_content_batch(records: List[tuple], chunk_records: List[tuple]):
+    """
+    Store a batch in one transaction: parent rows are COPYed into a staging
+    table and upserted, then the parents' chunks are replaced via COPY.
+    """
+    upsert_sql = """
+    INSERT INTO math_content 
+    (content_id, section, sub_headings, difficulty_level, notes, tips_to_approach, content, content_hash)
+    SELECT content_id, section, sub_headings, difficulty_level, notes, tips_to_approach, content, content_hash
+    FROM math_content_staging
+    ON CONFLICT (content_id) 
+    DO UPDATE SET
+        section = EXCLUDED.section,
+        sub_headings = EXCLUDED.sub_headings,
+        difficulty_level = EXCLUDED.difficulty_level,
+        notes = EXCLUDED.notes,
+        tips_to_approach = EXCLUDED.tips_to_approach,
+        content = EXCLUDED.content,
+        embedding = NULL,
+        content_hash = EXCLUDED.content_hash,
+        updated_at = CURRENT_TIMESTAMP;
+    """
+    
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE math_content_staging 
+                (LIKE math_content INCLUDING DEFAULTS) ON COMMIT DROP;
+            """)
+            await conn.copy_records_to_table(
+                "math_content_staging",
+                records=records,
+                columns=list(CONTENT_COLUMNS),
+            )
+            await conn.execute(upsert_sql)
+            await conn.execute(
+                "DELETE FROM math_content_chunks WHERE content_id = ANY($1::text[]);",
+                [record[0] for record in records]
+            )
+            await conn.copy_records_to_table(
+                "math_content_chunks",
+                records=chunk_records,
+                columns=list(CHUNK_COLUMNS),
+            )
+            await conn.execute(
+                UPDATE_SEARCH_TSV_SQL + " AND c.content_id = ANY($1::text[]);",
+                [record[0] for record in records]
+            )
+
+async def process_and_store_batch(batch: List[Dict], backoff: AdaptiveBackoff):
+    """Chunk a batch of content, embed every chunk with one API request and store it with one transaction"""
+    content_ids = [content_data['content_id'] for content_data in batch]
+    try:
+        chunked = [
+            (content_data, chunk)
+            for content_data in batch
+            for chunk in chunk_content(content_data['content'])
+        ]
+        
+        # Embed chunks with their section title so short chunks keep their context
+        embedding_inputs = [
+            f"{content_data['metadata'].get('section', '')}\n\n{chunk['content']}"
+            for content_data, chunk in chunked
+        ]
+        
+        logger.info(f"Generating embeddings for {len(chunked)} chunks of {len(batch)} documents: {', '.join(content_ids)}")
+        embeddings = await backoff.run(lambda: generate_embeddings(embedding_inputs))
+        
+        records = [_content_record(content_data) for content_data in batch]
+        chunk_records = [
+            (
+                content_data['content_id'],
+                chunk['chunk_index'],
+                chunk['sub_heading'],
+                chunk['content'],
+                chunk['token_count'],
+                embedding,
+            )
+            for (content_data, chunk), embedding in zip(chunked, embeddings)
+        ]
+        await store_content_batch(records, chunk_records)
+        
+        logger.info(f"Successfully stored {len(records)} documents ({len(chunk_records)} chunks) in database")
         
     except Exception as e:
-        logger.error(f"Error processing content {content_data.get('content_id', 'unknown')}: {e}")
-        if 'conn' in locals() and conn:
-            conn.close()
+        logger.error(f"Error processing batch {content_ids}: {e}")
         raise
 
-async def prepare_knowledge_base():
-    """Main function to prepare the knowledge base"""
+async def process_and_store_content(content_data: Dict):
+    """Process individual content and store in database"""
+    await process_and_store_batch([content_data], AdaptiveBackoff())
+
+async def prepare_knowledge_base(force: bool = False):
+    """
+    Main function to prepare the knowledge base.
+
+    Only new or changed documents are embedded; rows whose source files are
+    gone are deleted. Pass force=True to re-embed everything.
+    """
     try:
         logger.info("Starting knowledge base preparation...")
         
@@ -222,30 +472,123 @@ async def prepare_knowledge_base():
             logger.warning("No content files found to process")
             return
         
-        logger.info(f"Found {len(content_files)} content files to process")
+        logger.info(f"Found {len(content_files)} content files")
         
-        # Process each content file
-        for i, content_data in enumerate(content_files, 1):
-            logger.info(f"Processing content {i}/{len(content_files)}: {content_data['content_id']}")
-            await process_and_store_content(content_data)
-            
-            # Add small delay to avoid rate limiting
-            await asyncio.sleep(0.5)
+        # Diff the stored manifest against the filesystem
+        manifest = await load_content_manifest()
+        removed_ids = sorted(set(manifest) - {content_data['content_id'] for content_data in content_files})
+        if removed_ids:
+            await delete_content(removed_ids)
         
+        if not force:
+            content_files = [
+                content_data for content_data in content_files
+                if manifest.get(content_data['content_id']) != content_data['content_hash']
+            ]
+        
+        if not content_files:
+            logger.info("Knowledge base is up to date, nothing to embed")
+            if removed_ids:
+                await rebuild_index()
+            return
+        
+        logger.info(f"{len(content_files)} new or changed content files to process")
+        
+        # Embed and store in batches, with bounded concurrency and shared backoff
+        start_time = time.perf_counter()
+        tokens_before = embedding_usage["prompt_tokens"]
+        
+        batches = [
+            content_files[i:i + EMBEDDING_BATCH_SIZE]
+            for i in range(0, len(content_files), EMBEDDING_BATCH_SIZE)
+        ]
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+        backoff = AdaptiveBackoff()
+        
+        async def run_batch(batch: List[Dict]):
+            async with semaphore:
+                await process_and_store_batch(batch, backoff)
+        
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        
+        elapsed = time.perf_counter() - start_time
+        tokens = embedding_usage["prompt_tokens"] - tokens_before
         logger.info("Knowledge base preparation completed successfully!")
+        logger.info(
+            f"Ingested {len(content_files)} documents in {len(batches)} batches in {elapsed:.2f}s "
+            f"({len(content_files) / max(elapsed, 1e-9):.1f} docs/s, {tokens / max(elapsed, 1e-9):.0f} tokens/s, "
+            f"{backoff.retries} backoff retries)"
+        )
+        
+        # Size and build the vector index now that the rows exist
+        await rebuild_index()
         
         # Verify the data
-        conn, cursor = get_db_connection()
-        cursor.execute("SELECT COUNT(*) as count FROM math_content;")
-        result = cursor.fetchone()
-        conn.close()
+        async with acquire() as conn:
+            count = await conn.fetchval("SELECT COUNT(*) as count FROM math_content;")
         
-        logger.info(f"Total records in database: {result['count']}")
+        logger.info(f"Total records in database: {count}")
+        logger.info(f"Database pool metrics: {pool_metrics()}")
+        logger.info(f"Embedding cache metrics: {embedding_cache_metrics()}")
         
     except Exception as e:
         logger.error(f"Error in knowledge base preparation: {e}")
         raise
 
+async def build_local_index(
+    content_dir: str = "static/content",
+    index_dir: str = RAG_LOCAL_INDEX_DIR,
+    ivf_lists: int = 0,
+    embed_fn=generate_embeddings
+):
+    """
+    Build the in-process vector index used when RAG_BACKEND=local.
+
+    Runs the same chunking stage as the Postgres path and writes a
+    memory-mapped embedding matrix plus a metadata sidecar; no database is
+    needed. embed_fn can be swapped for a stub embedder to build offline.
+    """
+    try:
+        logger.info(f"Building local vector index in {index_dir}")
+        start_time = time.perf_counter()
+        
+        content_files = load_content_files(content_dir)
+        if not content_files:
+            logger.warning("No content files found to process")
+            return
+        
+        rows, embedding_inputs = [], []
+        for content_data in content_files:
+            metadata = content_data['metadata']
+            for chunk in chunk_content(content_data['content']):
+                rows.append({
+                    'content_id': content_data['content_id'],
+                    'section': metadata.get('section', ''),
+                    'difficulty_level': metadata.get('difficulty_level', 'intermediate'),
+                    'content': chunk['content'],
+                    'sub_headings': metadata.get('sub_headings', []),
+                    'notes': metadata.get('notes', []),
+                    'tips_to_approach': metadata.get('tips_to_approach', []),
+                    'chunk_index': chunk['chunk_index'],
+                    'sub_heading': chunk['sub_heading'],
+                })
+                embedding_inputs.append(f"{metadata.get('section', '')}\n\n{chunk['content']}")
+        
+        backoff = AdaptiveBackoff()
+        embeddings = []
+        for i in range(0, len(embedding_inputs), EMBEDDING_BATCH_SIZE * 4):
+            batch = embedding_inputs[i:i + EMBEDDING_BATCH_SIZE * 4]
+            embeddings.extend(await backoff.run(lambda batch=batch: embed_fn(batch)))
+        
+        LocalVectorIndex.build(rows, embeddings, index_dir=index_dir, ivf_lists=ivf_lists)
+        
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Local index built: {len(content_files)} documents, {len(rows)} chunks in {elapsed:.2f}s")
+        
+    except Exception as e:
+        logger.error(f"Error building local vector index: {e}")
+        raise
+
 async def test_vector_search(query: str = "linear differential equations"):
     """Test function to verify vector search functionality"""
     try:
@@ -254,28 +597,28 @@ async def test_vector_search(query: str = "linear differential equations"):
         # Generate embedding for query
         query_embedding = await generate_embedding(query)
         
-        # Perform vector search
-        conn, cursor = get_db_connection()
-        
         search_sql = """
         SELECT 
-            content_id, section, difficulty_level,
-            1 - (embedding <=> %s::vector) as similarity
-        FROM math_content
-        WHERE 1 - (embedding <=> %s::vector) > 0.5
-        ORDER BY similarity DESC
-        LIMIT 3;
+            m.content_id, m.section, m.difficulty_level, nearest.sub_heading,
+            1 - nearest.distance as similarity
+        FROM (
+            SELECT content_id, sub_heading, embedding <=> $1::vector as distance
+            FROM math_content_chunks
+            ORDER BY distance
+            LIMIT 3
+        ) nearest
+        JOIN math_content m ON m.content_id = nearest.content_id
+        WHERE nearest.distance < 0.5
+        ORDER BY nearest.distance;
         """
         
-        embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
-        cursor.execute(search_sql, (embedding_str, embedding_str))
-        
-        results = cursor.fetchall()
-        conn.close()
+        # Perform vector search on a pooled connection
+        async with acquire() as conn:
+            results = await conn.fetch(search_sql, query_embedding)
         
         logger.info("Vector search results:")
         for result in results:
-            logger.info(f"  - {result['content_id']}: {result['section']} (similarity: {result['similarity']:.3f})")
+            logger.info(f"  - {result['content_id']}: {result['section']} / {result['sub_heading']} (similarity: {result['similarity']:.3f})")
         
         return results
         
@@ -283,9 +626,36 @@ async def test_vector_search(query: str = "linear differential equations"):
         logger.error(f"Error in vector search test: {e}")
         return []
 
+async def main(force: bool = False, run_test: bool = False, backend: str = "pgvector", ivf_lists: int = 0):
+    """Prepare the knowledge base, optionally run the search test and release the pool"""
+    try:
+        if backend == "local":
+            await build_local_index(ivf_lists=ivf_lists)
+            return
+        
+        await prepare_knowledge_base(force=force)
+        
+        # Optionally run test (costs one embeddings call)
+        if run_test:
+            print("\nRunning vector search test...")
+            await test_vector_search()
+    finally:
+        await close_pool()
+
 if __name__ == "__main__":
-    asyncio.run(prepare_knowledge_base())
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("prepare_db.log"),
+            logging.StreamHandler()
+        ]
+    )
+    parser = argparse.ArgumentParser(description="Prepare the math content knowledge base")
+    parser.add_argument("--force", action="store_true", help="Re-embed every document, even if unchanged")
+    parser.add_argument("--test", action="store_true", help="Run a vector search test after indexing")
+    parser.add_argument("--backend", choices=["pgvector", "local"], default="pgvector", help="Index into Postgres or build the local in-process index")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="IVF lists for the local index (0 = exact search)")
+    args = parser.parse_args()
     
-    # Optionally run test
-    print("\nRunning vector search test...")
-    asyncio.run(test_vector_search())
+    asyncio.run(main(force=args.force, run_test=args.test, backend=args.backend, ivf_lists=args.ivf_lists))
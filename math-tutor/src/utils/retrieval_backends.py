@@ -0,0 +1,413 @@
+import os
+import json
+import logging
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from utils.db_pool import acquire, register_statement
+from utils.embeddings import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from utils.hybrid_search import BM25Index, row_key
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+MIN_SIMILARITY = 0.3
+RAG_BACKEND = os.getenv("RAG_BACKEND", "pgvector")  # "pgvector" or "local"
+RAG_LOCAL_INDEX_DIR = os.getenv("RAG_LOCAL_INDEX_DIR", "static/vector_index")
+RAG_LOCAL_IVF_PROBES = int(os.getenv("RAG_LOCAL_IVF_PROBES", "4"))
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGNMENTS_FILE = "ivf_assignments.npy"
+
+# The query vector is bound once, as a binary float32 parameter. The distance is
+# computed once per chunk in the inner query, which also drives the ORDER BY so
+# the ANN index can serve it; the similarity cutoff is applied to the top-k only.
+# Section metadata is joined from the parent row.
+SEARCH_SQL = f"""
+SELECT
+    m.content_id, m.section, m.difficulty_level, nearest.content, m.sub_headings,
+    m.notes, m.tips_to_approach, nearest.chunk_index, nearest.sub_heading,
+    1 - nearest.distance as similarity_score
+FROM (
+    SELECT
+        content_id, chunk_index, sub_heading, content,
+        embedding <=> $1::vector as distance
+    FROM math_content_chunks
+    ORDER BY distance
+    LIMIT $2
+) nearest
+JOIN math_content m ON m.content_id = nearest.content_id
+WHERE nearest.distance < {1 - MIN_SIMILARITY}
+ORDER BY nearest.distance;
+"""
+
+# Batched form of SEARCH_SQL: every query vector of the array gets its own
+# top-k through a LATERAL join, all in a single statement.
+SEARCH_MANY_SQL = f"""
+SELECT
+    q.query_index, m.content_id, m.section, m.difficulty_level, nearest.content, m.sub_headings,
+    m.notes, m.tips_to_approach, nearest.chunk_index, nearest.sub_heading,
+    1 - nearest.distance as similarity_score
+FROM unnest($1::vector[]) WITH ORDINALITY AS q(embedding, query_index)
+CROSS JOIN LATERAL (
+    SELECT
+        c.content_id, c.chunk_index, c.sub_heading, c.content,
+        c.embedding <=> q.embedding as distance
+    FROM math_content_chunks c
+    ORDER BY distance
+    LIMIT $2
+) nearest
+JOIN math_content m ON m.content_id = nearest.content_id
+WHERE nearest.distance < {1 - MIN_SIMILARITY}
+ORDER BY q.query_index, nearest.distance;
+"""
+
+# Full-text search over the chunk's search_tsv (section, sub-headings, notes
+# and content). Query terms are OR-ed so partial matches still rank.
+LEXICAL_SQL = """
+SELECT
+    m.content_id, m.section, m.difficulty_level, c.content, m.sub_headings,
+    m.notes, m.tips_to_approach, c.chunk_index, c.sub_heading,
+    ts_rank_cd(c.search_tsv, q.query) as lexical_score
+FROM math_content_chunks c
+JOIN math_content m ON m.content_id = c.content_id,
+LATERAL (
+    SELECT replace(plainto_tsquery('english', $1)::text, ' & ', ' | ')::tsquery as query
+) q
+WHERE q.query::text <> '' AND c.search_tsv @@ q.query
+ORDER BY lexical_score DESC
+LIMIT $2;
+"""
+
+# Batched form of LEXICAL_SQL
+LEXICAL_MANY_SQL = """
+SELECT
+    q.query_index, ranked.*
+FROM unnest($1::text[]) WITH ORDINALITY AS q(query_text, query_index)
+CROSS JOIN LATERAL (
+    SELECT
+        m.content_id, m.section, m.difficulty_level, c.content, m.sub_headings,
+        m.notes, m.tips_to_approach, c.chunk_index, c.sub_heading,
+        ts_rank_cd(c.search_tsv, tsq.query) as lexical_score
+    FROM math_content_chunks c
+    JOIN math_content m ON m.content_id = c.content_id,
+    LATERAL (
+        SELECT replace(plainto_tsquery('english', q.query_text)::text, ' & ', ' | ')::tsquery as query
+    ) tsq
+    WHERE tsq.query::text <> '' AND c.search_tsv @@ tsq.query
+    ORDER BY lexical_score DESC
+    LIMIT $2
+) ranked
+ORDER BY q.query_index, ranked.lexical_score DESC;
+"""
+
+# Similarity of given chunks to given query vectors (1-based query_index
+# into the vector array), for rows that lexical search found on its own
+SIMILARITIES_SQL = """
+SELECT
+    k.query_index, c.content_id, c.chunk_index,
+    1 - (c.embedding <=> ($1::vector[])[k.query_index]) as similarity_score
+FROM unnest($2::int[], $3::text[], $4::int[]) AS k(query_index, content_id, chunk_index)
+JOIN math_content_chunks c ON c.content_id = k.content_id AND c.chunk_index = k.chunk_index;
+"""
+
+# Prepare the search statements on every pooled connection
+register_statement(SEARCH_SQL, [0.0] * EMBEDDING_DIMENSIONS, 0)
+register_statement(LEXICAL_SQL, "", 0)
+register_statement(SEARCH_MANY_SQL, [], 0)
+register_statement(LEXICAL_MANY_SQL, [], 0)
+register_statement(SIMILARITIES_SQL, [], [], [], [])
+
+def _group_by_query(rows, query_count: int) -> List[List[Dict]]:
+    """Split rows of a batched statement (1-based query_index) into per-query lists"""
+    groups: List[List[Dict]] = [[] for _ in range(query_count)]
+    for row in rows:
+        row = dict(row)
+        groups[row.pop('query_index') - 1].append(row)
+    return groups
+
+class RetrievalBackend:
+    """
+    Interface for rag_search retrieval backends.
+
+    search() returns up to `limit` chunk rows ordered by descending
+    similarity_score, each a dict with the keys content_id, section,
+    difficulty_level, content, sub_headings, notes, tips_to_approach,
+    chunk_index, sub_heading and similarity_score.
+    """
+
+    name = "base"
+
+    async def search(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def lexical_search(self, query: str, limit: int) -> List[Dict]:
+        """Keyword search; rows as for search() but scored by lexical_score"""
+        raise NotImplementedError
+
+    async def search_many(self, query_embeddings: List[List[float]], limit: int) -> List[List[Dict]]:
+        """Top-k for each query vector; backends override this to batch the work"""
+        return [await self.search(query_embedding, limit) for query_embedding in query_embeddings]
+
+    async def lexical_search_many(self, queries: List[str], limit: int) -> List[List[Dict]]:
+        """Keyword search for each query; backends override this to batch the work"""
+        return [await self.lexical_search(query, limit) for query in queries]
+
+    async def similarities_many(
+        self, query_embeddings: List[List[float]], keys_per_query: List[List[Tuple[str, int]]]
+    ) -> List[Dict[Tuple[str, int], float]]:
+        """
+        Cosine similarity of specific chunks to each query vector.
+
+        Args:
+            query_embeddings: One vector per query
+            keys_per_query: (content_id, chunk_index) keys to score for each query
+
+        Returns:
+            One {key: similarity} dict per query (unknown chunks are left out)
+        """
+        raise NotImplementedError
+
+class PgVectorBackend(RetrievalBackend):
+    """Postgres + pgvector backend using the shared connection pool"""
+
+    name = "pgvector"
+
+    async def search(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        async with acquire() as conn:
+            rows = await conn.fetch(SEARCH_SQL, query_embedding, limit)
+        return [dict(row) for row in rows]
+
+    async def lexical_search(self, query: str, limit: int) -> List[Dict]:
+        async with acquire() as conn:
+            rows = await conn.fetch(LEXICAL_SQL, query, limit)
+        return [dict(row) for row in rows]
+
+    async def search_many(self, query_embeddings: List[List[float]], limit: int) -> List[List[Dict]]:
+        async with acquire() as conn:
+            rows = await conn.fetch(SEARCH_MANY_SQL, query_embeddings, limit)
+        return _group_by_query(rows, len(query_embeddings))
+
+    async def lexical_search_many(self, queries: List[str], limit: int) -> List[List[Dict]]:
+        async with acquire() as conn:
+            rows = await conn.fetch(LEXICAL_MANY_SQL, queries, limit)
+        return _group_by_query(rows, len(queries))
+
+    async def similarities_many(
+        self, query_embeddings: List[List[float]], keys_per_query: List[List[Tuple[str, int]]]
+    ) -> List[Dict[Tuple[str, int], float]]:
+        pairs = [(index + 1, key) for index, keys in enumerate(keys_per_query) for key in keys]
+        similarities: List[Dict[Tuple[str, int], float]] = [{} for _ in keys_per_query]
+        if not pairs:
+            return similarities
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                SIMILARITIES_SQL,
+                query_embeddings,
+                [query_index for query_index, _ in pairs],
+                [key[0] for _, key in pairs],
+                [key[1] for _, key in pairs],
+            )
+        for row in rows:
+            similarities[row['query_index'] - 1][(row['content_id'], row['chunk_index'])] = float(row['similarity_score'])
+        return similarities
+
+class LocalVectorIndex(RetrievalBackend):
+    """
+    In-process backend over a memory-mapped matrix of normalized float32 embeddings.
+
+    Chunk metadata lives in a JSON sidecar in the same order as the matrix
+    rows. Search is one matrix-vector product plus a partial sort. If the index
+    was built with IVF lists, only the rows of the nearest `probes` lists are
+    scored, falling back to exact search when that yields too few candidates.
+    """
+
+    name = "local"
+
+    def __init__(self, index_dir: str = RAG_LOCAL_INDEX_DIR, probes: int = RAG_LOCAL_IVF_PROBES):
+        index_path = Path(index_dir)
+        with open(index_path / METADATA_FILE, 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+
+        if sidecar.get("model") != EMBEDDING_MODEL:
+            logger.warning(f"Local index was built with {sidecar.get('model')}, queries use {EMBEDDING_MODEL}")
+
+        self.rows: List[Dict] = sidecar["rows"]
+        self.matrix = np.load(index_path / EMBEDDINGS_FILE, mmap_mode="r")
+        self.probes = probes
+        self.lexical_index: Optional[BM25Index] = None
+        self.row_positions: Optional[Dict[Tuple[str, int], int]] = None
+        self.centroids = None
+        self.list_rows: List[np.ndarray] = []
+
+        centroids_path = index_path / CENTROIDS_FILE
+        if centroids_path.exists():
+            self.centroids = np.load(centroids_path)
+            assignments = np.load(index_path / ASSIGNMENTS_FILE)
+            self.list_rows = [np.flatnonzero(assignments == i) for i in range(len(self.centroids))]
+
+        mode = f"IVF ({len(self.list_rows)} lists, {probes} probes)" if self.centroids is not None else "exact"
+        logger.info(f"Loaded local vector index: {len(self.rows)} chunks, {mode}")
+
+    def _top_k(self, query: np.ndarray, candidates: Optional[np.ndarray], limit: int):
+        """Score candidate rows (all rows if None) and return (row indices, scores) best first"""
+        matrix = self.matrix if candidates is None else self.matrix[candidates]
+        scores = matrix @ query
+        k = min(limit, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        indices = top if candidates is None else candidates[top]
+        return indices, scores[top]
+
+    def search_vector(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        """Synchronous top-k search; sub-millisecond for corpora of this size"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        indices = scores = None
+        if self.centroids is not None:
+            probes = min(self.probes, len(self.centroids))
+            nearest_lists = np.argsort(-(self.centroids @ query))[:probes]
+            candidates = np.concatenate([self.list_rows[i] for i in nearest_lists])
+            if len(candidates) >= limit:
+                indices, scores = self._top_k(query, candidates, limit)
+        if indices is None:
+            # Exact search over every row
+            indices, scores = self._top_k(query, None, limit)
+        return self._collect(indices, scores)
+
+    def search_vectors(self, query_embeddings: List[List[float]], limit: int) -> List[List[Dict]]:
+        """Exact top-k for many queries with a single matrix-matrix product"""
+        if self.centroids is not None:
+            return [self.search_vector(query_embedding, limit) for query_embedding in query_embeddings]
+        if not query_embeddings:
+            return []
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        all_scores = queries @ self.matrix.T
+        k = min(limit, all_scores.shape[1])
+
+        results = []
+        for scores in all_scores:
+            if k <= 0:
+                results.append([])
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results.append(self._collect(top, scores[top]))
+        return results
+
+    def _collect(self, indices, scores) -> List[Dict]:
+        """Rows for top-k indices above the similarity cutoff"""
+        results = []
+        for index, score in zip(indices, scores):
+            if score <= MIN_SIMILARITY:
+                break
+            results.append({**self.rows[int(index)], "similarity_score": float(score)})
+        return results
+
+    async def search(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        return self.search_vector(query_embedding, limit)
+
+    async def search_many(self, query_embeddings: List[List[float]], limit: int) -> List[List[Dict]]:
+        return self.search_vectors(query_embeddings, limit)
+
+    async def lexical_search(self, query: str, limit: int) -> List[Dict]:
+        if self.lexical_index is None:
+            self.lexical_index = BM25Index(self.rows)
+        return self.lexical_index.search(query, limit)
+
+    async def similarities_many(
+        self, query_embeddings: List[List[float]], keys_per_query: List[List[Tuple[str, int]]]
+    ) -> List[Dict[Tuple[str, int], float]]:
+        if self.row_positions is None:
+            self.row_positions = {row_key(row): index for index, row in enumerate(self.rows)}
+        similarities = []
+        for query_embedding, keys in zip(query_embeddings, keys_per_query):
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1)
+            positions = [(key, self.row_positions[key]) for key in keys if key in self.row_positions]
+            scores = self.matrix[[position for _, position in positions]] @ query if positions else []
+            similarities.append({key: float(score) for (key, _), score in zip(positions, scores)})
+        return similarities
+
+    @staticmethod
+    def build(rows: List[Dict], embeddings: List[List[float]], index_dir: str = RAG_LOCAL_INDEX_DIR, ivf_lists: int = 0):
+        """
+        Write a local index: normalized embeddings, metadata sidecar and optional IVF lists.
+
+        Args:
+            rows: Chunk metadata, one dict per embedding (see RetrievalBackend)
+            embeddings: Embedding vectors in the same order as rows
+            index_dir: Directory to write the index files into
+            ivf_lists: Number of IVF lists to train; 0 builds an exact-search index
+        """
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        np.save(index_path / EMBEDDINGS_FILE, matrix)
+
+        with open(index_path / METADATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"model": EMBEDDING_MODEL, "dimensions": matrix.shape[1], "rows": rows}, f, ensure_ascii=False)
+
+        centroids_path = index_path / CENTROIDS_FILE
+        assignments_path = index_path / ASSIGNMENTS_FILE
+        if ivf_lists and len(rows) > ivf_lists:
+            centroids, assignments = _train_ivf(matrix, ivf_lists)
+            np.save(centroids_path, centroids)
+            np.save(assignments_path, assignments)
+        else:
+            centroids_path.unlink(missing_ok=True)
+            assignments_path.unlink(missing_ok=True)
+
+        logger.info(f"Wrote local vector index with {len(rows)} chunks to {index_dir}")
+
+def _train_ivf(matrix: np.ndarray, lists: int, iterations: int = 20, seed: int = 0):
+    """Spherical k-means over normalized rows; returns (centroids, row assignments)"""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), size=lists, replace=False)].copy()
+    assignments = np.zeros(len(matrix), dtype=np.int32)
+    for _ in range(iterations):
+        assignments = np.argmax(matrix @ centroids.T, axis=1).astype(np.int32)
+        for i in range(lists):
+            members = matrix[assignments == i]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[i] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, assignments
+
+_backend: Optional[RetrievalBackend] = None
+
+def get_backend() -> RetrievalBackend:
+    """Return the configured retrieval backend (RAG_BACKEND), creating it on first use"""
+    global _backend
+    if _backend is None:
+        if RAG_BACKEND == "local":
+            _backend = LocalVectorIndex()
+        elif RAG_BACKEND == "pgvector":
+            _backend = PgVectorBackend()
+        else:
+            raise ValueError(f"Unknown RAG_BACKEND '{RAG_BACKEND}', expected 'pgvector' or 'local'")
+    return _backend
+
+def set_backend(backend: RetrievalBackend):
+    """Override the retrieval backend (e.g. a LocalVectorIndex built with a stub embedder)"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,263 @@
+import json
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Freshness states returned by SearchResultCache.get
+FRESH = "fresh"
+STALE = "stale"
+
+def search_cache_key(query: str, params: Dict) -> str:
+    """Key for a search: case- and whitespace-insensitive query plus the search parameters"""
+    normalized = " ".join(query.lower().split())
+    encoded_params = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{normalized}\x00{encoded_params}".encode("utf-8")).hexdigest()
+
+class SearchResultCache:
+    """
+    Two-tier cache for processed web search results.
+
+    The memory tier is an LRU bounded by entry count; the optional disk tier
+    is a SQLite file that survives restarts. Entries younger than ttl_seconds
+    are fresh. For stale_seconds after that they are still served as stale so
+    the caller can answer immediately and refresh in the background
+    (stale-while-revalidate); older entries are dropped.
+
+    Each entry remembers how many bytes of page content the original search
+    downloaded, so hits can report the bytes they saved.
+
+    Async callers use get_async(), which reads the disk tier on a worker
+    thread. Disk writes are write-behind: set() only queues the result, and
+    a background thread writes queued results in one transaction every
+    flush_seconds, so no caller waits on SQLite I/O.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: float = 21600,
+        stale_seconds: float = 0,
+        disk_path: Optional[str] = None,
+        flush_seconds: float = 1.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.flush_seconds = flush_seconds
+        self._memory: "OrderedDict[str, Tuple[float, bytes, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[float, bytes, int]] = {}  # Written to memory, not yet to disk
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "bytes_saved": 0,
+            "disk_writes": 0,
+            "disk_write_errors": 0,
+        }
+
+        if disk_path:
+            try:
+                self._db = sqlite3.connect(disk_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL;")
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS search_results (
+                        key TEXT PRIMARY KEY,
+                        created_at REAL NOT NULL,
+                        result BLOB NOT NULL,
+                        source_bytes INTEGER NOT NULL
+                    );
+                """)
+                self._db.commit()
+                logger.info(f"Search result disk cache enabled at {disk_path}")
+            except Exception as e:
+                logger.error(f"Could not open search result disk cache {disk_path}: {e}")
+                self._db = None
+
+        if self._db is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="search-cache-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _freshness(self, created_at: float) -> Optional[str]:
+        if self.ttl_seconds <= 0:
+            return FRESH
+        age = time.time() - created_at
+        if age < self.ttl_seconds:
+            return FRESH
+        if age < self.ttl_seconds + self.stale_seconds:
+            return STALE
+        return None
+
+    def _remember(self, key: str, created_at: float, packed: bytes, source_bytes: int):
+        self._memory[key] = (created_at, packed, source_bytes)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _hit(self, packed: bytes, source_bytes: int, state: str, tier: str) -> Tuple[Dict, str, int]:
+        self.stats[f"{tier}_hits"] += 1
+        if state == STALE:
+            self.stats["stale_hits"] += 1
+        self.stats["bytes_saved"] += source_bytes
+        return json.loads(packed), state, source_bytes
+
+    def _get_memory(self, key: str) -> Optional[Tuple[Dict, str, int]]:
+        """Memory tier lookup (also sees results still waiting to be written to disk)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, packed, source_bytes = entry
+                state = self._freshness(created_at)
+                if state is not None:
+                    self._memory.move_to_end(key)
+                    return self._hit(packed, source_bytes, state, "memory")
+                del self._memory[key]
+                self.stats["expired"] += 1
+            entry = self._pending.get(key)
+            if entry is not None:
+                state = self._freshness(entry[0])
+                if state is not None:
+                    self._remember(key, *entry)
+                    return self._hit(entry[1], entry[2], state, "memory")
+            return None
+
+    def _get_disk(self, key: str) -> Tuple[Optional[Dict], Optional[str], int]:
+        """Disk tier lookup; a fresh or stale row is promoted to memory"""
+        row = None
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT created_at, result, source_bytes FROM search_results WHERE key = ?;", (key,)
+                    ).fetchone()
+            except Exception as e:
+                logger.warning(f"Search result disk cache read failed: {e}")
+
+        with self._lock:
+            if row is not None:
+                created_at, packed, source_bytes = row
+                state = self._freshness(created_at)
+                if state is not None:
+                    self._remember(key, created_at, packed, source_bytes)
+                    return self._hit(packed, source_bytes, state, "disk")
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None, None, 0
+
+    def get(self, key: str) -> Tuple[Optional[Dict], Optional[str], int]:
+        """
+        Look up a result, checking memory first and then disk (blocks on disk reads; see get_async).
+
+        Returns:
+            (result, state, bytes_saved) where state is FRESH or STALE,
+            or (None, None, 0) on a miss
+        """
+        hit = self._get_memory(key)
+        if hit is not None:
+            return hit
+        return self._get_disk(key)
+
+    async def get_async(self, key: str) -> Tuple[Optional[Dict], Optional[str], int]:
+        """Look up a result without blocking the event loop; disk reads run on a worker thread"""
+        hit = self._get_memory(key)
+        if hit is not None:
+            return hit
+        if self._db is None:
+            return self._get_disk(key)  # Nothing to read; only counts the miss
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def set(self, key: str, result: Dict, source_bytes: int = 0):
+        """Store a result in memory and, if enabled, queue it for the disk tier"""
+        packed = json.dumps(result, separators=(",", ":")).encode("utf-8")
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, packed, source_bytes)
+            if self._db is not None:
+                self._pending[key] = (created_at, packed, source_bytes)
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every queued result to disk in one transaction; returns the number written"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+        rows = [(key, created_at, packed, source_bytes) for key, (created_at, packed, source_bytes) in pending.items()]
+
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO search_results (key, created_at, result, source_bytes) VALUES (?, ?, ?, ?);",
+                    rows
+                )
+                self._db.commit()
+            except Exception as e:
+                logger.warning(f"Search result disk cache write of {len(rows)} results failed: {e}")
+                with self._lock:
+                    self.stats["disk_write_errors"] += 1
+                    # Keep them for the next flush unless a newer result is already queued
+                    for key, entry in pending.items():
+                        self._pending.setdefault(key, entry)
+                return 0
+        with self._lock:
+            self.stats["disk_writes"] += len(rows)
+        return len(rows)
+
+    def close(self):
+        """Write queued results and close the disk tier"""
+        if self._db is None or self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def metrics(self) -> Dict:
+        """Return hit/miss counters, bytes saved and the current memory tier size"""
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hits": hits,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "pending_disk_writes": len(self._pending),
+                "disk_enabled": self._db is not None,
+            }
+
+    def clear(self):
+        """Drop every cached result from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._pending.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM search_results;")
+                self._db.commit()
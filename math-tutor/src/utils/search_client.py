@@ -0,0 +1,71 @@
+import os
+import asyncio
+import logging
+from typing import Optional
+import httpx
+from exa_py.api import AsyncExa
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+EXA_API_KEY = os.getenv("EXA_API_KEY")
+EXA_MAX_CONNECTIONS = int(os.getenv("EXA_MAX_CONNECTIONS", "10"))
+EXA_MAX_KEEPALIVE = int(os.getenv("EXA_MAX_KEEPALIVE", "5"))
+EXA_KEEPALIVE_SECONDS = float(os.getenv("EXA_KEEPALIVE_SECONDS", "60"))
+EXA_REQUEST_TIMEOUT = float(os.getenv("EXA_REQUEST_TIMEOUT", "30"))
+
+class PooledAsyncExa(AsyncExa):
+    """AsyncExa whose HTTP client has bounded, keep-alive connection pooling"""
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=EXA_REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=EXA_MAX_CONNECTIONS,
+                    max_keepalive_connections=EXA_MAX_KEEPALIVE,
+                    keepalive_expiry=EXA_KEEPALIVE_SECONDS,
+                ),
+            )
+        return self._client
+
+# Process-wide client state. The httpx client's connections belong to the
+# event loop that opened them, so the client is rebuilt on a different loop.
+_exa: Optional[PooledAsyncExa] = None
+_exa_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_exa_client() -> PooledAsyncExa:
+    """Get the process-wide async Exa client, creating it on first use"""
+    global _exa, _exa_loop
+
+    loop = asyncio.get_running_loop()
+    if _exa is not None and _exa_loop is loop:
+        return _exa
+
+    if _exa is not None:
+        # The old loop owns those connections; they cannot be reused here
+        logger.warning("Event loop changed, discarding Exa client")
+
+    _exa = PooledAsyncExa(api_key=EXA_API_KEY)
+    _exa_loop = loop
+    logger.info(f"Exa client created (max_connections={EXA_MAX_CONNECTIONS})")
+    return _exa
+
+async def close_search_client():
+    """Close the shared Exa client's connection pool (call at shutdown)"""
+    global _exa, _exa_loop
+    if _exa is None:
+        return
+    exa, owner_loop = _exa, _exa_loop
+    _exa, _exa_loop = None, None
+    if exa._client is not None and owner_loop is asyncio.get_running_loop():
+        await exa._client.aclose()
+    logger.info("Exa client closed")
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import sqlite3
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # "memory" or "sqlite"
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "86400"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.sqlite3")
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "2"))
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", "200"))
+SESSION_RETENTION_SECONDS = float(os.getenv("SESSION_RETENTION_SECONDS", str(30 * 86400)))
+
+SESSION_OVERHEAD_BYTES = 700  # Dict, keys, metadata strings and empty memory of one session
+TURN_OVERHEAD_BYTES = 400  # Dict, keys and lists of one remembered turn
+
+def estimate_session_bytes(session: Dict) -> int:
+    """
+    Approximate in-memory size of a session.
+
+    Counts the remembered text plus fixed per-session and per-turn
+    overheads; the conversation memory keeps a fixed number of turns, so
+    this stays O(1).
+    """
+    memory = session.get("memory") or {}
+    size = SESSION_OVERHEAD_BYTES
+    for turn in memory.get("recent", []):
+        size += TURN_OVERHEAD_BYTES + len(turn.get("problem", "")) + len(turn.get("answer", ""))
+        size += sum(len(item) for item in turn.get("formulas", []) + turn.get("topics", []))
+    size += sum(len(item) for item in memory.get("earlier_topics", []) + memory.get("earlier_formulas", []))
+    return size
+
+class SessionStore:
+    """
+    Interface for the expert's session storage.
+
+    Sessions are plain dicts keyed by session id. get() returns the stored
+    dict (callers may mutate it) and put() must be called after a change so
+    the store can re-account its size and persist it.
+    """
+
+    name = "base"
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def put(self, session_id: str, session: Dict):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def metrics(self) -> Dict:
+        return {"backend": self.name}
+
+    def close(self):
+        """Flush pending writes and release resources"""
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+class MemorySessionStore(SessionStore):
+    """
+    Bounded in-process session store.
+
+    An LRU ordered by last access: sessions idle longer than the TTL are
+    dropped, and the least recently used sessions are evicted when either
+    the session count or the estimated byte size goes over its limit. All
+    operations are O(1) amortized.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl_seconds: float = SESSION_IDLE_TTL_SECONDS,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_bytes = max_bytes
+        # session_id -> (last_access, estimated_bytes, session)
+        self._sessions: "OrderedDict[str, Tuple[float, int, Dict]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def _is_idle(self, last_access: float, now: float) -> bool:
+        return self.idle_ttl_seconds > 0 and (now - last_access) >= self.idle_ttl_seconds
+
+    def _drop(self, session_id: str) -> Optional[Dict]:
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        self._bytes -= entry[1]
+        return entry[2]
+
+    def _evict(self, now: float):
+        """Expire idle sessions from the cold end, then enforce the count and byte limits"""
+        while self._sessions:
+            session_id, (last_access, _, _) = next(iter(self._sessions.items()))
+            if self._is_idle(last_access, now):
+                self.stats["expired"] += 1
+            elif len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+                self.stats["evictions"] += 1
+            else:
+                break
+            self._drop(session_id)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            last_access, size, session = entry
+            if self._is_idle(last_access, now):
+                self._drop(session_id)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._sessions[session_id] = (now, size, session)
+            self._sessions.move_to_end(session_id)
+            self.stats["hits"] += 1
+            return session
+
+    def put(self, session_id: str, session: Dict):
+        now = time.monotonic()
+        size = estimate_session_bytes(session)
+        with self._lock:
+            self._drop(session_id)
+            self._sessions[session_id] = (now, size, session)
+            self._bytes += size
+            self._evict(now)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                **self.stats,
+                "sessions": len(self._sessions),
+                "estimated_bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+            }
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Durable session store: a MemorySessionStore in front of a SQLite table.
+
+    Writes are write-behind: put() only marks the session dirty, and a
+    background thread writes dirty sessions in one transaction every
+    SESSION_FLUSH_SECONDS or as soon as SESSION_FLUSH_BATCH are pending.
+    Sessions evicted from memory are reloaded from SQLite on the next get().
+    """
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        memory: Optional[MemorySessionStore] = None,
+        flush_seconds: float = SESSION_FLUSH_SECONDS,
+        flush_batch: int = SESSION_FLUSH_BATCH,
+        retention_seconds: float = SESSION_RETENTION_SECONDS,
+    ):
+        self.memory = memory or MemorySessionStore()
+        self.flush_seconds = flush_seconds
+        self.flush_batch = flush_batch
+        self.retention_seconds = retention_seconds
+        self._dirty: Dict[str, Dict] = {}
+        self._dirty_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.stats = {"disk_hits": 0, "flushes": 0, "rows_written": 0, "write_errors": 0}
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("PRAGMA synchronous=NORMAL;")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);")
+        if retention_seconds > 0:
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?;", (time.time() - retention_seconds,))
+        self._db.commit()
+        logger.info(f"SQLite session store at {path} (flush every {flush_seconds}s or {flush_batch} sessions)")
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every dirty session in one transaction; returns the number written"""
+        with self._dirty_lock:
+            if not self._dirty:
+                return 0
+            pending, self._dirty = self._dirty, {}
+            now = time.time()
+            rows = [(session_id, now, json.dumps(session)) for session_id, session in pending.items()]
+
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, updated_at, data) VALUES (?, ?, ?);", rows
+                )
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Session store flush of {len(rows)} sessions failed: {e}")
+                self.stats["write_errors"] += 1
+                with self._dirty_lock:
+                    # Keep them for the next flush unless a newer version is already pending
+                    for session_id, session in pending.items():
+                        self._dirty.setdefault(session_id, session)
+                return 0
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(rows)
+        return len(rows)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        session = self.memory.get(session_id)
+        if session is not None:
+            return session
+        with self._dirty_lock:
+            session = self._dirty.get(session_id)
+        if session is None:
+            with self._db_lock:
+                row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?;", (session_id,)).fetchone()
+            if row is None:
+                return None
+            session = json.loads(row[0])
+            self.stats["disk_hits"] += 1
+        self.memory.put(session_id, session)
+        return session
+
+    def put(self, session_id: str, session: Dict):
+        self.memory.put(session_id, session)
+        with self._dirty_lock:
+            self._dirty[session_id] = session
+            pending = len(self._dirty)
+        if pending >= self.flush_batch:
+            self._wake.set()
+
+    def delete(self, session_id: str):
+        self.memory.delete(session_id)
+        with self._dirty_lock:
+            self._dirty.pop(session_id, None)
+        with self._db_lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?;", (session_id,))
+            self._db.commit()
+
+    def metrics(self) -> Dict:
+        with self._dirty_lock:
+            pending = len(self._dirty)
+        return {**self.memory.metrics(), "backend": self.name, **self.stats, "pending_writes": pending}
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+_store: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    """Return the configured session store (SESSION_STORE), creating it on first use"""
+    global _store
+    if _store is None:
+        if SESSION_STORE == "memory":
+            _store = MemorySessionStore()
+        elif SESSION_STORE == "sqlite":
+            _store = SQLiteSessionStore()
+        else:
+            raise ValueError(f"Unknown SESSION_STORE '{SESSION_STORE}', expected 'memory' or 'sqlite'")
+    return _store
+
+def set_session_store(store: SessionStore):
+    """Override the session store (e.g. a MemorySessionStore with small limits)"""
+    global _store
+    _store = store
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Every SingleFlight by name, for metrics
+_groups: Dict[str, "SingleFlight"] = {}
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical async calls.
+
+    The first caller for a key starts the call; callers arriving with the same
+    key while it is in flight await the same task and share its result or
+    exception. Nothing is cached once the call finishes. The shared task is
+    shielded, so a caller that is cancelled or times out does not cancel it
+    for the others.
+
+    In-flight tasks belong to one event loop; a caller on another loop starts
+    its own call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "calls": 0,
+            "upstream_calls": 0,
+            "upstream_calls_saved": 0,
+        }
+        _groups[name] = self
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run call() for key, or join the identical call already in flight.
+
+        Args:
+            key: Normalized identity of the call
+            call: Zero-argument function returning the awaitable to run
+
+        Returns:
+            The call's result
+        """
+        self.stats["calls"] += 1
+        loop = asyncio.get_running_loop()
+
+        task = self._inflight.get(key)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            self.stats["upstream_calls_saved"] += 1
+            return await asyncio.shield(task)
+
+        self.stats["upstream_calls"] += 1
+        task = loop.create_task(call())
+        self._inflight[key] = task
+        task.add_done_callback(lambda finished: self._forget(key, finished))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Mark the exception retrieved even if every caller went away
+            logger.debug(f"{self.name} call failed for key {key[:16]}: {task.exception()!r}")
+
+    def metrics(self) -> Dict:
+        """Return call counters and the number of calls in flight"""
+        return {
+            **self.stats,
+            "in_flight": len(self._inflight),
+        }
+
+def single_flight_metrics() -> Dict[str, Dict]:
+    """Metrics for every SingleFlight group, by name"""
+    return {name: group.metrics() for name, group in _groups.items()}
@@ -0,0 +1,149 @@
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+# An escape cut off at the end of a chunk: "\", "\u", "\u00", ... or the first half of a surrogate pair
+INCOMPLETE_ESCAPE = re.compile(r'(?:\\u[dD][89abAB][0-9a-fA-F]{2}(?:\\(?:u[0-9a-fA-F]{0,3})?)?|\\(?:u[0-9a-fA-F]{0,3})?)$')
+
+_decoder = json.JSONDecoder()
+
+def _skip(text: str, pos: int, chars: str = " \t\r\n") -> int:
+    while pos < len(text) and text[pos] in chars:
+        pos += 1
+    return pos
+
+def _backslashes_before(text: str, index: int, start: int) -> int:
+    """Number of consecutive backslashes ending just before text[index], not looking before start"""
+    count = 0
+    while index - 1 - count >= start and text[index - 1 - count] == "\\":
+        count += 1
+    return count
+
+class StructuredOutputParser:
+    """
+    Incremental parser for a JSON object streamed as text deltas.
+
+    Feed it the model's output text as it arrives; it reports string fields
+    character by character while they are being written and every field once
+    its value is complete. Text already reported is never decoded again, so
+    a long field costs about the same however finely it is chunked.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self._pos = 0  # Where the next key starts (after the last complete field)
+        self._started = False
+        self._finished = False
+        self._key: Optional[str] = None  # String field currently streaming
+        self._value_start = 0  # Buffer index just after its opening quote
+        self._decoded_to = 0  # Buffer index up to which its text has been reported
+
+    def feed(self, delta: str) -> List[Dict]:
+        """
+        Add a chunk of output text.
+
+        Returns:
+            Events in order: {"type": "field_delta", "field", "text"} while a
+            string field is being written and {"type": "field_done", "field",
+            "value"} when any field is complete
+        """
+        self.buffer += delta
+        events: List[Dict] = []
+        while not self._finished and self._step(events):
+            pass
+        return events
+
+    def _step(self, events: List[Dict]) -> bool:
+        """Advance past one complete field; False when more input is needed"""
+        text = self.buffer
+        pos = _skip(text, self._pos)
+        if not self._started:
+            if pos >= len(text):
+                return False
+            if text[pos] != "{":
+                raise ValueError("Structured output does not start with a JSON object")
+            self._started = True
+            self._pos = pos + 1
+            return True
+
+        pos = _skip(text, pos, " \t\r\n,")
+        if pos >= len(text):
+            return False
+        if text[pos] == "}":
+            self._finished = True
+            return False
+
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return False
+        pos = _skip(text, pos)
+        if pos >= len(text) or text[pos] != ":":
+            return False
+        pos = _skip(text, pos + 1)
+        if pos >= len(text):
+            return False
+
+        if text[pos] == '"':
+            return self._step_string(key, pos, events)
+
+        try:
+            value, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return False
+        if text[pos] not in "[{" and end >= len(text):
+            # A number or literal at the very end may still be growing
+            return False
+        self.fields[key] = value
+        events.append({"type": "field_done", "field": key, "value": value})
+        self._pos = end
+        return True
+
+    def _step_string(self, key: str, pos: int, events: List[Dict]) -> bool:
+        if self._key != key:
+            self._key = key
+            self._value_start = pos + 1
+            self._decoded_to = pos + 1
+
+        text = self.buffer
+        end = self._find_closing_quote()
+        safe_end = end if end is not None else len(text) - self._incomplete_escape_length(text)
+        if safe_end > self._decoded_to:
+            chunk = json.loads(f'"{text[self._decoded_to:safe_end]}"')
+            self._decoded_to = safe_end
+            if chunk:
+                events.append({"type": "field_delta", "field": key, "text": chunk})
+        if end is None:
+            return False
+
+        value = json.loads(text[self._value_start - 1:end + 1])
+        self.fields[key] = value
+        events.append({"type": "field_done", "field": key, "value": value})
+        self._key = None
+        self._pos = end + 1
+        return True
+
+    def _find_closing_quote(self) -> Optional[int]:
+        """Index of the unescaped quote closing the current string, if it has arrived"""
+        text = self.buffer
+        search_from = self._decoded_to
+        while True:
+            index = text.find('"', search_from)
+            if index < 0:
+                return None
+            if _backslashes_before(text, index, self._value_start) % 2 == 0:
+                return index
+            search_from = index + 1
+
+    def _incomplete_escape_length(self, text: str) -> int:
+        """Length of an escape sequence cut off at the end of text (0 if there is none)"""
+        tail = text[max(self._decoded_to, len(text) - 12):]
+        match = INCOMPLETE_ESCAPE.search(tail)
+        if not match:
+            return 0
+        # A backslash that is itself escaped ("\\\\u12" is a backslash then "u12") starts nothing
+        start = len(text) - len(match.group())
+        if _backslashes_before(text, start, self._decoded_to) % 2 == 1:
+            return 0
+        return len(match.group())
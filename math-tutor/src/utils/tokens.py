@@ -0,0 +1,51 @@
+import logging
+from typing import Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+TOKENIZER_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4  # Fallback estimate when tiktoken is unavailable
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None if tiktoken is not installed or cannot load"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating tokens from characters: {e}")
+            _encoding = None
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text with the local tokenizer"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: Optional[str] = None) -> str:
+    """Truncate text to at most max_tokens tokens, appending suffix if anything was cut"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        truncated = text[:max_chars]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        truncated = encoding.decode(tokens[:max_tokens])
+    return truncated + suffix if suffix else truncated
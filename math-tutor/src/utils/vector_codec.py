@@ -0,0 +1,53 @@
+import sys
+import struct
+import logging
+from array import array
+from typing import List, Sequence
+import asyncpg
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# pgvector binary format: uint16 dimensions, uint16 unused, then float32 values (network byte order)
+_HEADER = struct.Struct(">HH")
+
+def encode_vector(vector: Sequence[float]) -> bytes:
+    """Encode a vector in pgvector's binary wire format"""
+    values = array("f", vector)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return _HEADER.pack(len(values), 0) + values.tobytes()
+
+def decode_vector(data: bytes) -> List[float]:
+    """Decode pgvector's binary wire format into a list of floats"""
+    dimensions, _ = _HEADER.unpack_from(data)
+    values = array("f")
+    values.frombytes(data[_HEADER.size:_HEADER.size + 4 * dimensions])
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values.tolist()
+
+def encode_vector_text(vector: Sequence[float]) -> str:
+    """Encode a vector as a pgvector text literal (the legacy path, kept for comparison)"""
+    return "[" + ",".join(str(x) for x in vector) + "]"
+
+async def register_vector_codec(conn: asyncpg.Connection) -> bool:
+    """
+    Register the binary vector codec on a connection.
+
+    Returns:
+        False if the pgvector extension is not installed in this database yet
+    """
+    try:
+        await conn.set_type_codec(
+            "vector",
+            schema="public",
+            encoder=encode_vector,
+            decoder=decode_vector,
+            format="binary",
+        )
+        return True
+    except ValueError as e:
+        # asyncpg raises ValueError("unknown type: public.vector") before CREATE EXTENSION
+        logger.debug(f"Vector codec not registered: {e}")
+        return False
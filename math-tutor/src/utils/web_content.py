@@ -0,0 +1,198 @@
+import re
+import zlib
+import logging
+from typing import List, Dict, Optional
+import numpy as np
+from utils.tokens import count_tokens, truncate_to_tokens
+from utils.hybrid_search import BM25Index, tokenize
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+PASSAGE_MAX_TOKENS = 120  # Longer paragraphs are truncated
+PASSAGE_MIN_TOKENS = 40  # Shorter paragraphs are joined with the next one
+SHINGLE_SIZE = 5  # Words per shingle for near-duplicate detection
+MINHASH_PERMUTATIONS = 64
+DUPLICATE_THRESHOLD = 0.7  # Estimated Jaccard similarity above which a passage is a duplicate
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_rng = np.random.default_rng(20240601)  # Fixed seed: signatures are comparable across calls
+_HASH_A = _rng.integers(1, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+# Lines that are page furniture rather than content. Navigation words only
+# count when they are the whole line, so prose such as "Next, we integrate..."
+# or "Accept that the integrand is odd..." is kept.
+BOILERPLATE_PATTERN = re.compile(
+    r"^(home|menu|skip to (main )?content|sign in|log ?in|sign up|subscribe|share|tweet|print|next|previous|prev|"
+    r"back to top|related (posts|articles)|advertisement|accept( all)?( cookies)?|privacy policy|terms of (use|service)|"
+    r"follow us|download (the )?app|read more|click here)\W*$",
+    re.IGNORECASE
+)
+FOOTER_PATTERN = re.compile(r"^copyright\b|©|\ball rights reserved\b|\buses? cookies\b", re.IGNORECASE)
+MARKDOWN_LINK_ONLY = re.compile(r"^(\s*[-*]?\s*!?\[[^\]]*\]\([^)]*\)\s*)+$")
+MATH_CHARS = "=∫√^/+-*()<>≤≥πθ∑"
+HEADING_PATTERN = re.compile(
+    r"^(example|solution|problem|exercise|question|answer|theorem|lemma|proof|corollary|definition|"
+    r"note|remark|step|case|method)\b",
+    re.IGNORECASE
+)
+MIN_LINE_WORDS = 4  # Shorter lines are kept only when they look like math or headings
+
+def _is_boilerplate(line: str) -> bool:
+    """Whether a line looks like navigation, chrome or a link list"""
+    if BOILERPLATE_PATTERN.match(line) or FOOTER_PATTERN.search(line) or MARKDOWN_LINK_ONLY.match(line):
+        return True
+    has_math = any(char.isdigit() or char in MATH_CHARS for char in line)
+    if (
+        not has_math  # Absolute values such as |x-1| + |x-2| are not menu separators
+        and line.count("|") >= 3
+        and len(tokenize(line.replace("|", " "))) <= 3 * line.count("|")
+    ):
+        return True  # Breadcrumbs and menu bars: "Home | Maths | Integrals | ..."
+    words = line.split()
+    if len(words) < MIN_LINE_WORDS:
+        looks_like_heading = line.startswith("#") or line.rstrip().endswith(":") or bool(HEADING_PATTERN.match(line))
+        return not (has_math or looks_like_heading)
+    return False
+
+def clean_text(text: str) -> str:
+    """
+    Strip navigation and boilerplate from extracted page text.
+
+    Drops menu/footer lines, link-only lines and repeated lines, and
+    collapses whitespace, keeping paragraph breaks.
+    """
+    if not text:
+        return ""
+    kept = []
+    seen = set()
+    for raw_line in text.splitlines():
+        line = " ".join(raw_line.split())
+        if not line:
+            if kept and kept[-1] != "":
+                kept.append("")
+            continue
+        if _is_boilerplate(line):
+            continue
+        fingerprint = line.lower()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        kept.append(line)
+    return "\n".join(kept).strip()
+
+def split_passages(text: str, max_tokens: int = PASSAGE_MAX_TOKENS, min_tokens: int = PASSAGE_MIN_TOKENS) -> List[str]:
+    """Split text into paragraph passages, joining short paragraphs and truncating long ones"""
+    passages = []
+    current, current_tokens = [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if current and current_tokens + tokens > max_tokens:
+            passages.append("\n".join(current))
+            current, current_tokens = [], 0
+        if tokens > max_tokens:
+            passages.append(truncate_to_tokens(paragraph, max_tokens, suffix="…"))
+            continue
+        current.append(paragraph)
+        current_tokens += tokens
+        if current_tokens >= min_tokens:
+            passages.append("\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature over word shingles; None for text too short to shingle"""
+    words = tokenize(text)
+    if not words:
+        return None
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+def estimated_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return float(np.mean(a == b))
+
+def select_passages(query_results: Dict[str, List[Dict]], token_budget: int) -> Dict:
+    """
+    Pick the passages worth sending to the model across every query.
+
+    Each result's text is split into passages, which are ranked per query by
+    BM25 against the query; passages sharing no term with the query are
+    dropped unless nothing matches. Near-duplicates of an already kept
+    passage (from any query) are dropped. Queries then take turns adding their next best
+    passage until token_budget is used, so one query cannot take the whole
+    budget. Kept passages are returned in page order.
+
+    Args:
+        query_results: query -> list of {"title", "url", "content"} results
+        token_budget: Token budget for all kept passages together
+
+    Returns:
+        {"passages": {query: {url: [passage, ...]}}, "tokens": int, "duplicates_removed": int}
+    """
+    ranked_by_query = {}
+    for query, results in query_results.items():
+        rows = []
+        for result_index, result in enumerate(results):
+            for passage_index, passage in enumerate(split_passages(result.get("content") or "")):
+                rows.append({
+                    "content": passage,
+                    "url": result.get("url"),
+                    "order": (result_index, passage_index),
+                })
+        if not rows:
+            ranked_by_query[query] = []
+            continue
+        # Passages sharing no term with the query are only used when none does
+        ranked_by_query[query] = BM25Index(rows).search(query, len(rows)) or rows
+
+    kept_signatures: List[np.ndarray] = []
+    selected = {query: [] for query in query_results}
+    cursors = {query: 0 for query in query_results}
+    tokens_used = 0
+    duplicates_removed = 0
+
+    active = [query for query in query_results if ranked_by_query[query]]
+    while active and tokens_used < token_budget:
+        still_active = []
+        for query in active:
+            ranked = ranked_by_query[query]
+            while cursors[query] < len(ranked):
+                row = ranked[cursors[query]]
+                cursors[query] += 1
+                signature = minhash_signature(row["content"])
+                if signature is not None and any(
+                    estimated_similarity(signature, kept) >= DUPLICATE_THRESHOLD for kept in kept_signatures
+                ):
+                    duplicates_removed += 1
+                    continue
+                tokens = count_tokens(row["content"])
+                if tokens_used + tokens > token_budget:
+                    continue  # Too big for what is left; a shorter passage may still fit
+                selected[query].append(row)
+                tokens_used += tokens
+                if signature is not None:
+                    kept_signatures.append(signature)
+                break
+            if cursors[query] < len(ranked):
+                still_active.append(query)
+        active = still_active
+
+    passages = {}
+    for query, rows in selected.items():
+        by_url: Dict[str, List[Dict]] = {}
+        for row in sorted(rows, key=lambda row: row["order"]):
+            by_url.setdefault(row["url"], []).append(row["content"])
+        passages[query] = by_url
+
+    return {"passages": passages, "tokens": tokens_used, "duplicates_removed": duplicates_removed}
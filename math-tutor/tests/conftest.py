@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app imports its modules from src (e.g. "from utils.web_content import ...")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
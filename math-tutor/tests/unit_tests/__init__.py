@@ -0,0 +1 @@
+"""Unit tests for the math tutor's standalone helpers."""
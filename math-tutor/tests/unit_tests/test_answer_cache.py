@@ -0,0 +1,26 @@
+import pytest
+
+from utils.answer_cache import math_fingerprint, normalize_math_query
+
+DIFFERENT_PROBLEMS = [
+    ("Solve a x + 2 = 0", "Solve x + 2 = 0"),
+    ("Integrate from 0 to a of x^2 dx", "Integrate from 0 to 1 of x^2 dx"),
+    ("Integrate x^a dx", "Integrate x dx"),
+    ("Integrate from 0 to 1 of x dx", "Integrate from 1 to 0 of x dx"),
+]
+
+
+@pytest.mark.parametrize("first, second", DIFFERENT_PROBLEMS)
+def test_different_problems_do_not_collide(first: str, second: str) -> None:
+    first_normalized, second_normalized = normalize_math_query(first), normalize_math_query(second)
+    assert first_normalized != second_normalized
+    assert math_fingerprint(first_normalized) != math_fingerprint(second_normalized)
+
+
+def test_variable_a_is_kept() -> None:
+    assert normalize_math_query("Integrate from 0 to a of x^2 dx") == "integrate from 0 to a x^2 dx"
+    assert normalize_math_query("Integrate x^a dx") == "integrate x^a dx"
+
+
+def test_rewordings_share_a_key() -> None:
+    assert normalize_math_query("Please find the value of ∫ x² dx") == normalize_math_query("What is the integral of x^2 dx?")
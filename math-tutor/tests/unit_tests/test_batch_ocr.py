@@ -0,0 +1,26 @@
+from utils.batch_ocr import split_problems
+
+
+def test_option_labels_stay_with_their_question() -> None:
+    page = "\n".join([
+        "1. Evaluate ∫ x dx.",
+        "(1) x^2 (2) x^2/2",
+        "(3) 2x (4) 1",
+        "2) Find dy/dx if y = sin x.",
+    ])
+    assert split_problems(page) == [
+        "1. Evaluate ∫ x dx.\n(1) x^2 (2) x^2/2\n(3) 2x (4) 1",
+        "2) Find dy/dx if y = sin x.",
+    ]
+
+
+def test_numbered_list_inside_a_question_does_not_split() -> None:
+    page = "Q3. Which of these is odd?\n1) sin x\n2) cos x\nQ4. Differentiate e^x."
+    assert split_problems(page) == [
+        "Q3. Which of these is odd?\n1) sin x\n2) cos x",
+        "Q4. Differentiate e^x.",
+    ]
+
+
+def test_separator_lines_take_precedence() -> None:
+    assert split_problems("Find the limit.\n---\nFind the area.") == ["Find the limit.", "Find the area."]
@@ -0,0 +1,37 @@
+from utils.web_content import clean_text
+
+SOLUTION_LINES = [
+    "Example 5",
+    "Next, we integrate by parts using u = x and dv = sin x dx.",
+    "∫ |x| dx = x|x|/2 + C",
+    "Accept that the integrand is odd, so the integral over [-a, a] vanishes.",
+    "Evaluate ∫|x-1| + |x-2| dx from 0 to 3",
+    "Solution:",
+    "Theorem 7.1",
+]
+
+
+def test_solution_text_is_kept() -> None:
+    assert clean_text("\n".join(SOLUTION_LINES)).splitlines() == SOLUTION_LINES
+
+
+def test_page_furniture_is_dropped() -> None:
+    page = "\n".join([
+        "Home | Maths | Calculus | Integrals",
+        "Next »",
+        "Accept all cookies",
+        "Share",
+        "[Previous](/a) [Next](/b)",
+        "Copyright 2024 Example Tutors. All rights reserved.",
+        "Example 5",
+        "Next, we integrate by parts using u = x and dv = sin x dx.",
+    ])
+    assert clean_text(page).splitlines() == [
+        "Example 5",
+        "Next, we integrate by parts using u = x and dv = sin x dx.",
+    ]
+
+
+def test_repeated_lines_are_dropped() -> None:
+    text = "Evaluate ∫|x-1| + |x-2| dx from 0 to 3\nEvaluate ∫|x-1| + |x-2| dx from 0 to 3"
+    assert clean_text(text) == "Evaluate ∫|x-1| + |x-2| dx from 0 to 3"